@@ -0,0 +1,270 @@
+"""
+Mesure de bout en bout de l'importation, de la généralisation et de la prédiction.
+
+Les trois étapes s'exécutent sur histoires.txt et tests.txt, chacune dans son propre
+processus, sur une base neuve dans un répertoire temporaire. Les requêtes JDM sont servies
+par un JDMReplayServer (voir jdm_replay.py) : les mesures ne dépendent ni du réseau ni de
+l'API publique, et un enregistrement incomplet se voit au nombre de requêtes absentes.
+
+Scénarios :
+    cold  caches vides (cache JDM, mémo de généralisation, cache de prédiction)
+    warm  base neuve, caches recopiés d'un passage à froid : une régression des caches
+          se voit à l'écart entre les deux scénarios ; un cache de prédiction recopié qui
+          ne sert plus (aucun succès) fait échouer la mesure
+
+Pour chaque étape : durée, débit, latences p50/p95 (par histoire pour la prédiction, par
+lot validé pour l'importation, par recherche pour la généralisation, par requête pour
+JDM), requêtes reçues par le serveur de rejeu, accès aux caches et mémoire maximale.
+Les résultats sont écrits en JSON dans benchmarks/<commit>.json ; --compare affiche
+l'écart entre deux fichiers de résultats.
+
+    python benchmark.py --fixture data/jdm_fixture.jsonl --workers 2 --latency 0.02
+    python benchmark.py --compare benchmarks/ancien.json benchmarks/nouveau.json
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+import metrics
+
+try:
+    import resource
+except ImportError:
+    # Windows : pas de mesure de la mémoire maximale
+    resource = None
+
+STAGES = ("import", "generalize", "predict")
+SCENARIOS = ("cold", "warm")
+# Caches recopiés pour le scénario warm (relatifs au répertoire de travail)
+CACHE_PATHS = ("data/cache", "data/generalization_memo.json", "data/prediction_cache.json")
+PREDICTION_CACHE = "data/prediction_cache.json"
+
+def _percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    if not values:
+        return {"p50": None, "p95": None}
+    values = sorted(values)
+    def at(q: float) -> float:
+        return values[min(len(values) - 1, int(q * len(values)))]
+    return {"p50": at(0.5), "p95": at(0.95)}
+
+def _histogram_percentiles(name: str, **labels: Any) -> Dict[str, Optional[float]]:
+    return {"p50": metrics.quantile(name, 0.5, **labels), "p95": metrics.quantile(name, 0.95, **labels)}
+
+def _peak_memory_mb() -> Dict[str, Optional[float]]:
+    """Mémoire résidente maximale du processus et du plus gros processus de pool (Mio)"""
+    if resource is None:
+        return {"process": None, "workers": None}
+    # ru_maxrss : kio sous Linux, octets sous macOS
+    unit = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return {"process": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / unit,
+            "workers": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / unit}
+
+def run_stage(stage: str, workers: int = 1) -> Dict[str, Any]:
+    """
+    Exécute une étape dans le répertoire courant et retourne ses mesures
+    (appelé dans un processus dédié par run_benchmark)
+    """
+    # Importés ici : le processus parent n'a pas besoin de la base
+    from story_generator import StoryGenerator
+    from story_generalizer import generalize_stories
+    from story_test import StoryTest
+
+    metrics.reset()
+    latencies = None
+    with open(f"benchmark_{stage}.log", "w", encoding="utf-8") as log, contextlib.redirect_stdout(log):
+        start = time.perf_counter()
+        if stage == "import":
+            items = StoryGenerator(input_file="histoires.txt").load_and_store_stories(resume=False, workers=workers)
+            latency = {"unit": "lot", **_histogram_percentiles("consistency_check_seconds", kind="stories")}
+        elif stage == "generalize":
+            items = len(generalize_stories(workers=workers))
+            latency = {"unit": "recherche", **_histogram_percentiles("generalization_seconds")}
+        else:
+            StoryTest(cache_file=PREDICTION_CACHE).run_all_tests(workers=workers, output_file="data/benchmark_predictions.jsonl")
+            with open("data/benchmark_predictions.jsonl", "r", encoding="utf-8") as f:
+                latencies = [json.loads(line)["elapsed"] for line in f]
+            items = len(latencies)
+        seconds = time.perf_counter() - start
+    if latencies is not None:
+        latency = {"unit": "histoire", **_percentiles(latencies)}
+
+    caches = {}
+    for cache in ("jdm", "prediction", "generalization_memo", "hypernym_index"):
+        hits = metrics.total("cache_lookups_total", cache=cache, result="hit")
+        # Cache JDM : un échec en mémoire peut être servi par le disque, seuls les échecs sur disque vont au réseau
+        misses = metrics.total("cache_lookups_total", cache=cache, result="miss", **({"tier": "disk"} if cache == "jdm" else {}))
+        if hits or misses:
+            caches[cache] = {"hits": hits, "misses": misses, "hit_ratio": hits / (hits + misses)}
+    return {
+        "seconds": seconds,
+        "items": items,
+        "throughput": items / seconds if seconds else None,
+        "latency": latency,
+        "jdm": {"requests": metrics.total("jdm_requests_total"), **_histogram_percentiles("jdm_request_seconds")},
+        "caches": caches,
+        "peak_memory_mb": _peak_memory_mb(),
+    }
+
+def _prepare_workdir(scenario: str, stories_file: str, tests_file: str, warm_from: Optional[str]) -> str:
+    work_dir = tempfile.mkdtemp(prefix=f"jdm-benchmark-{scenario}-")
+    shutil.copy(stories_file, os.path.join(work_dir, "histoires.txt"))
+    shutil.copy(tests_file, os.path.join(work_dir, "tests.txt"))
+    if warm_from is not None:
+        for path in CACHE_PATHS:
+            source, target = os.path.join(warm_from, path), os.path.join(work_dir, path)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            if os.path.isdir(source):
+                shutil.copytree(source, target)
+            elif os.path.exists(source):
+                shutil.copy(source, target)
+    return work_dir
+
+def _run_scenario(server, work_dir: str, workers: int) -> Dict[str, Any]:
+    env = {**os.environ, "JDM_BASE_URL": server.url, "PYTHONHASHSEED": "0"}
+    env.pop("JDM_RECORD", None)
+    results = {}
+    for stage in STAGES:
+        server.reset_stats()
+        result_file = os.path.join(work_dir, f"benchmark_{stage}.json")
+        subprocess.run([sys.executable, os.path.abspath(__file__), "--stage", stage, "--workers", str(workers), "--result", result_file],
+                       cwd=work_dir, env=env, check=True)
+        with open(result_file, "r", encoding="utf-8") as f:
+            result = json.load(f)
+        # Requêtes vues par le serveur : celles qui ont manqué tous les caches
+        result["replay"] = server.stats()
+        results[stage] = result
+        print(f"  {stage:<11} {result['seconds']:7.2f} s  {result['items']:5d} éléments  {result['replay']['requests']:6d} requêtes JDM"
+              + (f"  ({result['replay']['missing']} absentes de l'enregistrement)" if result["replay"]["missing"] else ""))
+    return results
+
+def _check_warm(results: Dict[str, Any]) -> List[str]:
+    """Anomalies du scénario warm : caches recopiés qui ne servent plus"""
+    problems = []
+    prediction = results["predict"]["caches"].get("prediction")
+    if not prediction or prediction["hit_ratio"] <= 0:
+        problems.append("warm : aucun accès au cache de prédiction recopié n'a réussi (empreinte de la base modifiée ?)")
+    return problems
+
+def _commit() -> str:
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=here, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=here, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "inconnu"
+    return commit + ("-dirty" if dirty else "")
+
+def run_benchmark(fixture_file: str, stories_file: str = "histoires.txt", tests_file: str = "tests.txt", workers: int = 1,
+                  latency: float = 0.0, scenarios: List[str] = SCENARIOS, keep: bool = False) -> Dict[str, Any]:
+    """
+    Exécute les scénarios et retourne les résultats
+
+    Args:
+        fixture_file: Enregistrement des réponses JDM rejouées
+        stories_file: Histoires importées
+        tests_file: Histoires à trous prédites
+        workers: Nombre de processus de chaque étape
+        latency: Latence ajoutée à chaque réponse JDM (secondes)
+        scenarios: Scénarios à exécuter (warm est précédé d'un passage à froid qui remplit les caches)
+        keep: Garder les répertoires de travail
+    """
+    from jdm_replay import JDMReplayServer
+
+    stories_file, tests_file = os.path.abspath(stories_file), os.path.abspath(tests_file)
+    server = JDMReplayServer(fixture_file, port=0, latency=latency).start()
+    report = {
+        "commit": _commit(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "settings": {"fixture": os.path.abspath(fixture_file), "stories": stories_file, "tests": tests_file,
+                     "workers": workers, "latency": latency},
+        "scenarios": {},
+        "problems": [],
+    }
+    work_dirs = []
+    try:
+        cold_dir = None
+        for scenario in SCENARIOS:
+            if scenario not in scenarios and not (scenario == "cold" and "warm" in scenarios):
+                continue
+            work_dir = _prepare_workdir(scenario, stories_file, tests_file, cold_dir if scenario == "warm" else None)
+            work_dirs.append(work_dir)
+            print(f"Scénario {scenario} ({work_dir})")
+            results = _run_scenario(server, work_dir, workers)
+            if scenario in scenarios:
+                report["scenarios"][scenario] = results
+            if scenario == "warm":
+                report["problems"] += _check_warm(results)
+            if scenario == "cold":
+                cold_dir = work_dir
+    finally:
+        server.shutdown()
+        if not keep:
+            for work_dir in work_dirs:
+                shutil.rmtree(work_dir, ignore_errors=True)
+    return report
+
+def save_report(report: Dict[str, Any], output_dir: str = "benchmarks") -> str:
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, f"{report['commit']}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    return path
+
+def compare_reports(old: Dict[str, Any], new: Dict[str, Any]):
+    """Affiche durée, débit, p95, requêtes JDM et mémoire de deux résultats, avec l'écart relatif"""
+    def ratio(a: Optional[float], b: Optional[float]) -> str:
+        return f"{100 * (b - a) / a:+6.1f} %" if a and b is not None else "      -"
+    print(f"{old['commit']} -> {new['commit']}")
+    for scenario, stages in new["scenarios"].items():
+        for stage, result in stages.items():
+            previous = old["scenarios"].get(scenario, {}).get(stage)
+            if previous is None:
+                continue
+            print(f"{scenario:<5} {stage:<11}")
+            rows = [("durée (s)", previous["seconds"], result["seconds"]),
+                    ("débit (/s)", previous["throughput"], result["throughput"]),
+                    ("p95 (s)", previous["latency"]["p95"], result["latency"]["p95"]),
+                    ("requêtes JDM", previous["replay"]["requests"], result["replay"]["requests"]),
+                    ("mémoire (Mio)", previous["peak_memory_mb"]["process"], result["peak_memory_mb"]["process"])]
+            for label, a, b in rows:
+                a_text = f"{a:10.3f}" if a is not None else "         -"
+                b_text = f"{b:10.3f}" if b is not None else "         -"
+                print(f"    {label:<14} {a_text} {b_text}  {ratio(a, b)}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mesure de l'importation, de la généralisation et de la prédiction sur un rejeu de JDM")
+    parser.add_argument("--fixture", default="data/jdm_fixture.jsonl", help="Enregistrement des réponses JDM (voir jdm_replay.py)")
+    parser.add_argument("--stories", default="histoires.txt", help="Fichier d'histoires importées")
+    parser.add_argument("--tests", default="tests.txt", help="Fichier d'histoires à trous")
+    parser.add_argument("--workers", type=int, default=1, help="Nombre de processus de chaque étape")
+    parser.add_argument("--latency", type=float, default=0.0, help="Latence ajoutée à chaque réponse JDM (secondes)")
+    parser.add_argument("--scenario", choices=SCENARIOS, action="append", help="Scénario à exécuter (par défaut : tous)")
+    parser.add_argument("--output-dir", default="benchmarks", help="Répertoire des résultats JSON")
+    parser.add_argument("--keep", action="store_true", help="Garder les répertoires de travail")
+    parser.add_argument("--compare", nargs=2, metavar=("ANCIEN", "NOUVEAU"), help="Comparer deux fichiers de résultats")
+    # Exécution d'une étape dans un processus dédié (utilisé par run_benchmark)
+    parser.add_argument("--stage", choices=STAGES, help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.stage:
+        with open(args.result, "w", encoding="utf-8") as f:
+            json.dump(run_stage(args.stage, args.workers), f)
+    elif args.compare:
+        with open(args.compare[0], "r", encoding="utf-8") as f_old, open(args.compare[1], "r", encoding="utf-8") as f_new:
+            compare_reports(json.load(f_old), json.load(f_new))
+    else:
+        report = run_benchmark(args.fixture, args.stories, args.tests, args.workers, args.latency, args.scenario or list(SCENARIOS), args.keep)
+        print(f"Résultats écrits dans {save_report(report, args.output_dir)}")
+        for problem in report["problems"]:
+            print(f"Anomalie : {problem}")
+        if report["problems"]:
+            sys.exit(1)
@@ -0,0 +1,221 @@
+"""
+Représentation compacte des factoïdes.
+
+Les termes (sujet, prédicat, objet, lieu, temps) sont remplacés par des entiers d'une table
+partagée par tout le processus : chaque terme distinct n'est stocké qu'une fois et deux
+termes égaux sont le même objet chaîne, ce qui rend les comparaisons immédiates. Un
+Factoid occupe quelques emplacements (__slots__) au lieu d'un dictionnaire de huit clés.
+
+Factoid garde l'interface d'un dictionnaire (f["subject"], f.get(...), f.copy(), **f) pour
+le code existant ; la conversion en dictionnaire n'a lieu qu'aux frontières JSON
+(to_dict, json_default) et lors du passage entre processus (__reduce__ : les entiers ne
+sont pas valides dans la table d'un autre processus).
+"""
+import threading
+from typing import Any, Dict, Iterator, List, Optional
+
+class TermTable:
+    """Table d'internement : terme <-> entier"""
+
+    def __init__(self):
+        self.ids: Dict[str, int] = {}
+        self.strings: List[str] = []
+        # Ajouts seulement : les lectures se font sans verrou (serveur de prédiction multithread)
+        self._lock = threading.Lock()
+
+    def intern(self, term: str) -> int:
+        term_id = self.ids.get(term)
+        if term_id is None:
+            with self._lock:
+                term_id = self.ids.get(term)
+                if term_id is None:
+                    term_id = len(self.strings)
+                    self.strings.append(term)
+                    self.ids[term] = term_id
+        return term_id
+
+    def __len__(self) -> int:
+        return len(self.strings)
+
+# Table des termes du processus
+TERMS = TermTable()
+
+# Rôle absent du factoïde (différent d'un rôle à None) ; champ absent
+_ABSENT = -1
+_MISSING = object()
+
+class Factoid:
+    ROLES = ("subject", "predicate", "object", "location", "time")
+    # Champs hors rôles, dans l'ordre des fichiers JSON
+    FIELDS = ("original_sentence", "story_id", "id", "stories_id")
+
+    __slots__ = ("_subject", "_predicate", "_object", "_location", "_time",
+                 "original_sentence", "story_id", "id", "stories_id", "_extra")
+
+    def __init__(self, subject: Optional[str] = "", predicate: Optional[str] = "", object: Optional[str] = "", location: Optional[str] = "", time: Optional[str] = "", **fields: Any):
+        self._subject = _intern(subject)
+        self._predicate = _intern(predicate)
+        self._object = _intern(object)
+        self._location = _intern(location)
+        self._time = _intern(time)
+        self.original_sentence = fields.pop("original_sentence", _MISSING)
+        self.story_id = fields.pop("story_id", _MISSING)
+        self.id = fields.pop("id", _MISSING)
+        self.stories_id = fields.pop("stories_id", _MISSING)
+        # Clés inconnues, conservées telles quelles
+        self._extra: Optional[Dict[str, Any]] = fields or None
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Factoid":
+        if isinstance(data, Factoid):
+            return data.copy()
+        factoid = cls.__new__(cls)
+        factoid._extra = None
+        for role in cls.ROLES:
+            setattr(factoid, "_" + role, _intern(data[role]) if role in data else _ABSENT)
+        for field in cls.FIELDS:
+            setattr(factoid, field, data.get(field, _MISSING))
+        extra = {key: value for key, value in data.items() if key not in cls.ROLES and key not in cls.FIELDS}
+        if extra:
+            factoid._extra = extra
+        return factoid
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {}
+        for key in self.keys():
+            data[key] = self[key]
+        return data
+
+    def term_id(self, role: str) -> Optional[int]:
+        """Identifiant du terme d'un rôle dans TERMS (None si le rôle est vide ou absent)"""
+        value = getattr(self, "_" + role)
+        return value if value is not None and value >= 0 else None
+
+    def keys(self) -> List[str]:
+        keys = [role for role in self.ROLES if getattr(self, "_" + role) != _ABSENT]
+        keys.extend(field for field in self.FIELDS if getattr(self, field) is not _MISSING)
+        if self._extra:
+            keys.extend(self._extra)
+        return keys
+
+    def items(self) -> List[tuple]:
+        return [(key, self[key]) for key in self.keys()]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.keys())
+
+    def __len__(self) -> int:
+        return len(self.keys())
+
+    def __contains__(self, key: str) -> bool:
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def __getitem__(self, key: str) -> Any:
+        slot = _ROLE_SLOTS.get(key)
+        if slot is not None:
+            value = slot.__get__(self)
+            if value is None:
+                return None
+            if value == _ABSENT:
+                raise KeyError(key)
+            return _STRINGS[value]
+        slot = _FIELD_SLOTS.get(key)
+        if slot is not None:
+            value = slot.__get__(self)
+            if value is _MISSING:
+                raise KeyError(key)
+            return value
+        if self._extra and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        # Chemin rapide des rôles : appelé pour chaque factoïde de la base lors des prédictions
+        slot = _ROLE_SLOTS.get(key)
+        if slot is not None:
+            value = slot.__get__(self)
+            if value is None:
+                return None
+            return _STRINGS[value] if value != _ABSENT else default
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __setitem__(self, key: str, value: Any):
+        if key in self.ROLES:
+            setattr(self, "_" + key, _intern(value))
+        elif key in self.FIELDS:
+            setattr(self, key, value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def setdefault(self, key: str, default: Any = None) -> Any:
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def copy(self) -> "Factoid":
+        factoid = Factoid.__new__(Factoid)
+        factoid._subject = self._subject
+        factoid._predicate = self._predicate
+        factoid._object = self._object
+        factoid._location = self._location
+        factoid._time = self._time
+        factoid.original_sentence = self.original_sentence
+        factoid.story_id = self.story_id
+        factoid.id = self.id
+        # Même comportement que dict.copy() : copie superficielle
+        factoid.stories_id = self.stories_id
+        factoid._extra = dict(self._extra) if self._extra else None
+        return factoid
+
+    def terms(self) -> tuple:
+        """(sujet, prédicat, objet, lieu, temps) en un seul appel ; None pour un rôle absent"""
+        return (_term(self._subject), _term(self._predicate), _term(self._object), _term(self._location), _term(self._time))
+
+    def same_terms(self, other: "Factoid") -> bool:
+        """Mêmes sujet, prédicat, objet, lieu et temps (comparaison d'entiers)"""
+        return (self._subject == other._subject and self._predicate == other._predicate and self._object == other._object
+                and self._location == other._location and self._time == other._time)
+
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, Factoid):
+            return self.same_terms(other) and self.to_dict() == other.to_dict()
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f"Factoid({self.to_dict()!r})"
+
+    def __reduce__(self):
+        return (Factoid.from_dict, (self.to_dict(),))
+
+# Accès directs aux emplacements, sans getattr par nom
+_ROLE_SLOTS = {role: getattr(Factoid, "_" + role) for role in Factoid.ROLES}
+_FIELD_SLOTS = {field: getattr(Factoid, field) for field in Factoid.FIELDS}
+_STRINGS = TERMS.strings
+
+def _term(value: Optional[int]) -> Optional[str]:
+    return _STRINGS[value] if value is not None and value != _ABSENT else None
+
+def _intern(term: Optional[str]) -> Optional[int]:
+    return TERMS.intern(term) if term is not None else None
+
+def json_default(obj: Any) -> Any:
+    """Paramètre `default` de json.dump : les Factoid sont écrits comme des dictionnaires"""
+    if isinstance(obj, Factoid):
+        return obj.to_dict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+def to_factoids(factoids: List[Dict[str, Any]]) -> List[Factoid]:
+    return [Factoid.from_dict(f) for f in factoids]
@@ -1,91 +1,230 @@
 import json
 import os
 import re
-from typing import List, Dict, Any
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import IO, Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+from story_store import StoryStore, read_record
+
+# Tokeniseur des lignes "[sujet] ... [predicat] ... [objet] ... [lieu] ... [temps] ..."
+_FACTOID_PATTERN = re.compile(r"\[(sujet|predicat|objet|lieu|temps)\]\s*([^\[]+)")
+_ROLES = {"sujet": "subject", "predicat": "predicate", "objet": "object", "lieu": "location", "temps": "time"}
+
+class ParsedFactoid(NamedTuple):
+    """Composantes d'une ligne de factoïde (immuable, partagée par le cache de parse_line)"""
+    subject: str = ""
+    predicate: str = ""
+    object: str = ""
+    location: str = ""
+    time: str = ""
+
+    def get(self, role: str, default: Any = None) -> Any:
+        return getattr(self, role) if role in self._fields else default
+
+    def as_dict(self) -> Dict[str, Any]:
+        return self._asdict()
+
+@lru_cache(maxsize=65536)
+def parse_line(sentence: str) -> ParsedFactoid:
+    """Analyse une ligne de factoïde ; les lignes répétées ne sont analysées qu'une fois"""
+    components = {}
+    for role, value in _FACTOID_PATTERN.findall(sentence):
+        components[_ROLES[role]] = value.strip().lower()
+    return ParsedFactoid(**components)
+
+def parse_lines(lines: Iterable[str]) -> Iterator[ParsedFactoid]:
+    """Analyse en flux les lignes de factoïdes (les lignes sans '[' sont ignorées)"""
+    for line in lines:
+        if "[" in line:
+            yield parse_line(line.strip())
+
+def parse_file(file_path: str) -> Iterator[ParsedFactoid]:
+    """Analyse en flux les lignes de factoïdes d'un fichier texte"""
+    with open(file_path, "r", encoding="utf-8") as f:
+        yield from parse_lines(f)
 
 class FactoidExtractor:
     """
     Classe permettant d'extraire des factoïdes (triplets étendus) à partir d'histoires structurées.
-    Tous les factoïdes sont stockés dans un seul fichier JSON : all_factoids.json.
+    Les factoïdes sont ajoutés à un fichier JSONL (un enregistrement par ligne) : all_factoids.jsonl.
+
+    L'extraction est idempotente : un fichier d'état note, pour chaque histoire extraite, le
+    numéro de sa version stockée (voir StoryStore.version) et le premier identifiant de ses factoïdes. Les
+    histoires inchangées sont ignorées ; une histoire modifiée est extraite à nouveau et ses
+    anciens enregistrements, toujours présents dans le fichier, sont ignorés à la lecture
+    (voir iter_factoids et compact).
     """
 
-    def __init__(self, stories_dir: str = "data/stories", output_file: str = "data/factoids/all_factoids.json"):
+    def __init__(self, stories_dir: str = "data/stories", output_file: str = "data/factoids/all_factoids.jsonl", state_file: str = "data/factoids/extraction_state.json"):
         self.stories_dir = stories_dir
         self.output_file = output_file
+        self.state_file = state_file
         os.makedirs(os.path.dirname(output_file), exist_ok=True)
-        self.factoids = self._load_existing_factoids()
-        self.counter = self._init_counter()
+        # Chargé à la première extraction : la plupart des utilisateurs n'ont besoin que de l'analyse des lignes
+        self._state: Optional[Dict[str, Any]] = None
 
-    def _init_counter(self) -> int:
-        return max((f["id"] for f in self.factoids), default=0) + 1
+    @property
+    def state(self) -> Dict[str, Any]:
+        if self._state is None:
+            self._state = self._load_state()
+        return self._state
 
-    def _load_existing_factoids(self) -> List[Dict[str, Any]]:
-        if os.path.exists(self.output_file):
-            with open(self.output_file, 'r', encoding='utf-8') as f:
+    def _load_state(self) -> Dict[str, Any]:
+        if os.path.exists(self.state_file):
+            with open(self.state_file, 'r', encoding='utf-8') as f:
                 return json.load(f)
-        return []
+        return {"next_id": 1, "stories": {}, "output_size": 0}
+
+    def _save_state(self):
+        tmp_file = self.state_file + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, ensure_ascii=False)
+        os.replace(tmp_file, self.state_file)
 
     def _extract_factoid_components(self, sentence: str) -> Dict[str, Any]:
-        pattern = re.compile(r"\[(sujet|predicat|objet|lieu|temps)\]\s*([^\[]+)")
-        matches = pattern.findall(sentence)
-        factoid = {"subject": "", "predicate": "", "object": "", "location": "", "time": ""}
-        for role, value in matches:
-            if role == "sujet":
-                factoid["subject"] = value.strip().lower()
-            elif role == "predicat":
-                factoid["predicate"] = value.strip().lower()
-            elif role == "objet":
-                factoid["object"] = value.strip().lower()
-            elif role == "lieu":
-                factoid["location"] = value.strip().lower()
-            elif role == "temps":
-                factoid["time"] = value.strip().lower()
-        return factoid
+        return parse_line(sentence).as_dict()
+
+    def parse_lines(self, lines: Iterable[str]) -> Iterator[ParsedFactoid]:
+        return parse_lines(lines)
+
+    def parse_file(self, file_path: str) -> Iterator[ParsedFactoid]:
+        return parse_file(file_path)
 
     def extract_factoids_from_story(self, story: Dict[str, Any]) -> List[Dict[str, Any]]:
-        sentences = story.get("original_sentences", [])
-        story_id = story.get("id", "unknown")
-        new_factoids = []
-
-        for sentence in sentences:
-            factoid = self._extract_factoid_components(sentence)
-            factoid["original_sentence"] = sentence
-            factoid["story_id"] = story_id
-
-            factoid_record = {
-                "id": self.counter,
-                "subject": factoid["subject"],
-                "predicate": factoid["predicate"],
-                "object": factoid["object"],
-                "location": factoid["location"],
-                "time": factoid["time"],
-                "stories": [story_id],
-                "original_sentence": sentence
-            }
-            self.factoids.append(factoid_record)
-            new_factoids.append(factoid_record)
-            self.counter += 1
-
-        return new_factoids
-
-    def extract_all_factoids(self) -> List[Dict[str, Any]]:
-        results = []
-
-        for filename in os.listdir(self.stories_dir):
-            if filename.endswith(".json"):
-                file_path = os.path.join(self.stories_dir, filename)
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    story = json.load(f)
-                extracted = self.extract_factoids_from_story(story)
-                results.extend(extracted)
-
-        with open(self.output_file, "w", encoding="utf-8") as f:
-            json.dump(self.factoids, f, ensure_ascii=False, indent=2)
-
-        return results
+        """Factoïdes d'une histoire, numérotés à la suite des factoïdes déjà extraits (sans écriture)"""
+        records = []
+        for sentence, components in _parse_story(story):
+            records.append(self._make_record(story.get("id", "unknown"), sentence, components))
+        return records
+
+    def _make_record(self, story_id: str, sentence: str, components: ParsedFactoid) -> Dict[str, Any]:
+        record = {"id": self.state["next_id"], **components.as_dict(), "stories": [story_id], "original_sentence": sentence}
+        self.state["next_id"] += 1
+        return record
+
+    def _pending_stories(self) -> List[Tuple[str, int, Tuple[str, int, int]]]:
+        """Histoires nouvelles ou modifiées depuis la dernière extraction : [(identifiant, version, position)]"""
+        store = StoryStore(self.stories_dir)
+        # Histoires supprimées : leurs factoïdes ne sont plus à jour
+        for story_id in [story_id for story_id in self.state["stories"] if not store.has_story(story_id)]:
+            del self.state["stories"][story_id]
+
+        pending = []
+        for story_id in sorted(store.story_ids()):
+            version = store.version(story_id)
+            if self.state["stories"].get(story_id, {}).get("version") != version:
+                pending.append((story_id, version, store.locate(story_id)))
+        store.close()
+        return pending
+
+    def extract_all_factoids(self, workers: int = 1, save_every: int = 100) -> int:
+        """
+        Extrait en flux les factoïdes des histoires nouvelles ou modifiées et les ajoute au fichier JSONL.
+
+        Args:
+            workers: Nombre de processus d'analyse des histoires
+            save_every: Nombre d'histoires entre deux sauvegardes du fichier d'état
+
+        Returns:
+            Nombre de factoïdes ajoutés
+        """
+        self._truncate_to_checkpoint()
+        pending = self._pending_stories()
+        locations = [location for _, _, location in pending]
+        if workers > 1:
+            executor = ProcessPoolExecutor(max_workers=workers)
+            parsed = _map_bounded(executor, locations, max(1, len(pending) // (4 * workers)), 2 * workers)
+        else:
+            executor = None
+            parsed = map(_parse_story_record, locations)
+
+        added = 0
+        try:
+            with open(self.output_file, "a", encoding="utf-8") as out:
+                # Une seule histoire en mémoire à la fois (résultats du pool dans l'ordre des histoires)
+                for count, ((story_id, version, _), sentences) in enumerate(zip(pending, parsed), start=1):
+                    first_id = self.state["next_id"]
+                    for sentence, components in sentences:
+                        out.write(json.dumps(self._make_record(story_id, sentence, components), ensure_ascii=False) + "\n")
+                    added += len(sentences)
+                    self.state["stories"][story_id] = {"version": version, "first_id": first_id}
+                    if count % save_every == 0:
+                        self._checkpoint(out)
+                self._checkpoint(out)
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+
+        return added
+
+    def _checkpoint(self, out: IO[str]):
+        """Sauvegarde l'état avec la taille du fichier JSONL qu'il couvre"""
+        out.flush()
+        self.state["output_size"] = out.tell()
+        self._save_state()
+
+    def _truncate_to_checkpoint(self):
+        """
+        Retire les enregistrements écrits après la dernière sauvegarde de l'état (arrêt brutal) :
+        leurs histoires ne figurent pas dans l'état et sont extraites de nouveau
+        """
+        size = self.state.get("output_size")
+        if size is not None and os.path.exists(self.output_file) and os.path.getsize(self.output_file) > size:
+            with open(self.output_file, "r+b") as f:
+                f.truncate(size)
+
+    def iter_factoids(self) -> Iterator[Dict[str, Any]]:
+        """Parcourt en flux les factoïdes à jour (dernière extraction de chaque histoire)"""
+        if not os.path.exists(self.output_file):
+            return
+        stories = self.state["stories"]
+        with open(self.output_file, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                entry = stories.get(record["stories"][0])
+                if entry is not None and record["id"] >= entry["first_id"]:
+                    yield record
+
+    def compact(self) -> int:
+        """Réécrit le fichier JSONL sans les enregistrements périmés ; retourne le nombre de factoïdes gardés"""
+        tmp_file = self.output_file + ".tmp"
+        kept = 0
+        with open(tmp_file, "w", encoding="utf-8") as out:
+            for record in self.iter_factoids():
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                kept += 1
+        os.replace(tmp_file, self.output_file)
+        self.state["output_size"] = os.path.getsize(self.output_file)
+        self._save_state()
+        return kept
+
+def _parse_story(story: Dict[str, Any]) -> List[Tuple[str, ParsedFactoid]]:
+    # Histoires importées : les phrases d'origine sont portées par les factoïdes
+    sentences = story.get("original_sentences") or [f["original_sentence"] for f in story.get("factoids", []) if f.get("original_sentence")]
+    return [(sentence, parse_line(sentence)) for sentence in sentences]
+
+def _parse_story_record(location: Tuple[str, int, int]) -> List[Tuple[str, ParsedFactoid]]:
+    return _parse_story(read_record(*location))
+
+def _parse_story_records(locations: List[Tuple[str, int, int]]) -> List[List[Tuple[str, ParsedFactoid]]]:
+    return [_parse_story_record(location) for location in locations]
+
+def _map_bounded(executor: ProcessPoolExecutor, locations: List[Tuple[str, int, int]], chunksize: int, max_in_flight: int) -> Iterator[List[Tuple[str, ParsedFactoid]]]:
+    """Analyse les histoires dans le pool, dans l'ordre, avec au plus `max_in_flight` paquets en cours"""
+    in_flight = deque()
+    chunks = (locations[i:i + chunksize] for i in range(0, len(locations), chunksize))
+    for chunk in chunks:
+        in_flight.append(executor.submit(_parse_story_records, chunk))
+        if len(in_flight) >= max_in_flight:
+            yield from in_flight.popleft().result()
+    while in_flight:
+        yield from in_flight.popleft().result()
 
 
 if __name__ == "__main__":
     extractor = FactoidExtractor()
-    result = extractor.extract_all_factoids()
-    print(f"Extrait {len(result)} nouveaux factoïdes dans un seul fichier.")
\ No newline at end of file
+    added = extractor.extract_all_factoids()
+    print(f"Extrait {added} nouveaux factoïdes dans {extractor.output_file}.")
@@ -1,13 +1,27 @@
 import os
 import json
-from typing import List, Dict
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, List, Dict, Optional, Set, Tuple
 from story_database import StoryDatabase
 from story_generator import StoryGenerator
-from factoid_extractor import FactoidExtractor
-from jdm_client import JDMClient
+from factoid_extractor import FactoidExtractor, ParsedFactoid, parse_line
+from factoid import Factoid
+from jdm_client import JDMClient, verbose
+import metrics
+from prediction_cache import PredictionCache
+from semantic_index import SemanticIndex
 
 class FactoidPredict1:
-    def __init__(self, sample_size: int = 4, subject_weight : float = 1.0, predicate_weight : float = 2, object_weight : float = 1, location_weight : float = 0.25, time_weight : float = 0.25, include_generalized: bool = False, stories_dir: str = "data/stories", factoids_dir: str = "data/factoids"):
+    def __init__(self, sample_size: int = 4, subject_weight : float = 1.0, predicate_weight : float = 2, object_weight : float = 1, location_weight : float = 0.25, time_weight : float = 0.25, include_generalized: bool = False, multi_gap: bool = True, beam_width: int = 3, beam_time_budget: float = 5.0, cache_size: int = 4096, cache_file: Optional[str] = None, semantic_index_file: Optional[str] = "data/semantic_index.json", similarity_threshold: float = 0.5, stories_dir: str = "data/stories", factoids_dir: str = "data/factoids"):
+        # Paramètres du constructeur, pour recréer le prédicteur dans les processus de predict_batch
+        self.init_kwargs = {
+            "sample_size": sample_size, "subject_weight": subject_weight, "predicate_weight": predicate_weight,
+            "object_weight": object_weight, "location_weight": location_weight, "time_weight": time_weight,
+            "include_generalized": include_generalized, "multi_gap": multi_gap, "beam_width": beam_width,
+            "beam_time_budget": beam_time_budget, "cache_size": cache_size, "semantic_index_file": semantic_index_file,
+            "similarity_threshold": similarity_threshold, "stories_dir": stories_dir, "factoids_dir": factoids_dir
+        }
         self.stories_dir = stories_dir
         self.factoids_dir = factoids_dir
         self.extractor = FactoidExtractor()
@@ -20,14 +34,28 @@ class FactoidPredict1:
 
         self.include_generalized = include_generalized
 
+        self.similarity_threshold = similarity_threshold
+        self.semantic_index = None
+        if semantic_index_file:
+            index = SemanticIndex(semantic_index_file)
+            if index.load():
+                self.semantic_index = index
+
         self.jdm = JDMClient(logging=False)
 
         self.sample_size = sample_size
 
+        self.multi_gap = multi_gap
+        self.beam_width = beam_width
+        self.beam_time_budget = beam_time_budget
+
         self.story_generator = StoryGenerator()
 
         StoryDatabase.initialize()
 
+        # Créé après le chargement de la base, dont il suit les modifications
+        self.cache = PredictionCache(max_size=cache_size, cache_file=cache_file)
+
     def _factoid_text(self, factoid: Dict) -> str:
         parts = []
         if factoid.get("subject"):
@@ -42,94 +70,284 @@ class FactoidPredict1:
             parts.append(f"[temps] {factoid['time']}")
         return " ".join(parts)
 
-    def predict_missing(self, story_lines: List[str]) -> List[str]:
-        predictions = []
+    def predict_missing(self, story_lines: List[str], multi_gap: Optional[bool] = None) -> List[str]:
+        """
+        Prédit les lignes manquantes ('?') d'une histoire.
+
+        En mode multi-trous, chaque suite de '?' consécutifs est complétée
+        conjointement par une recherche en faisceau (voir _beam_fill).
+        """
+        return [result["prediction"] for result in self._predict_gaps(story_lines, multi_gap)]
+
+    def predict_batch(self, stories: List[List[str]], workers: int = 1) -> List[Dict[str, Any]]:
+        """
+        Prédit les lignes manquantes de plusieurs histoires incomplètes.
+
+        Les lignes de contexte partagées par plusieurs histoires ne donnent lieu qu'à une
+        seule recherche de candidats. Avec `workers` > 1, ces recherches puis les histoires
+        sont réparties sur un pool de processus.
+
+        Returns:
+            Un résultat par histoire, dans l'ordre d'entrée : index, prédictions, scores,
+            histoires sources des candidats retenus et durée de prédiction (secondes, y
+            compris la recherche des candidats de ses contextes)
+        """
+        story_contexts = [self._story_contexts(lines) for lines in stories]
+        contexts = {key: (direction, line) for keys in story_contexts for key, direction, line in keys}
+        missing = [(key, direction, line) for key, (direction, line) in contexts.items() if self.cache.get(key) is None]
+        # Durée de la recherche des candidats de chaque contexte (0 : déjà en cache)
+        retrieval = dict.fromkeys(contexts, 0.0)
+
+        if workers <= 1:
+            for key, direction, line in missing:
+                start = time.perf_counter()
+                self.cache.set(key, self._score_context(direction, line))
+                retrieval[key] = time.perf_counter() - start
+            results = [self._predict_story_result(index, lines) for index, lines in enumerate(stories)]
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_batch_worker, initargs=(self.init_kwargs, self.cache.snapshot())) as executor:
+                chunksize = max(1, len(missing) // (4 * workers))
+                scored = executor.map(_score_context_worker, [direction for _, direction, _ in missing], [line for _, _, line in missing], chunksize=chunksize)
+                for (key, _, _), (candidates, seconds, worker_metrics) in zip(missing, scored):
+                    self.cache.set(key, candidates)
+                    retrieval[key] = seconds
+                    metrics.merge(worker_metrics)
+                # Chaque histoire reçoit les candidats de ses contextes
+                entries = self.cache.snapshot()
+                story_entries = [{key: entries[key] for key, _, _ in keys if key in entries} for keys in story_contexts]
+                results = list(executor.map(_predict_batch_worker, range(len(stories)), stories, story_entries))
+            for result in results:
+                metrics.merge(result.pop("metrics"))
+
+        for result, keys in zip(results, story_contexts):
+            result["elapsed"] += sum(retrieval[key] for key in {key for key, _, _ in keys})
+        return results
+
+    def _predict_story_result(self, index: int, story_lines: List[str]) -> Dict[str, Any]:
+        start = time.perf_counter()
+        gaps = self._predict_gaps(story_lines)
+        return {
+            "index": index,
+            "predictions": [gap["prediction"] for gap in gaps],
+            "scores": [gap["score"] for gap in gaps],
+            "sources": [gap["source"] for gap in gaps],
+            "elapsed": time.perf_counter() - start
+        }
+
+    def _story_contexts(self, story_lines: List[str]) -> List[Tuple[str, str, str]]:
+        """Lignes de contexte voisines d'un trou : [(clé du cache, direction, ligne)]"""
+        contexts = []
+        for i, line in enumerate(story_lines):
+            if line.strip() != "?":
+                continue
+            for direction, context in (("previous", story_lines[i - 1] if i > 0 else None),
+                                       ("next", story_lines[i + 1] if i < len(story_lines) - 1 else None)):
+                if self._is_context(context):
+                    contexts.append((self._context_key(direction, context), direction, context))
+        return contexts
+
+    def _context_key(self, direction: str, line: str) -> str:
+        context = tuple(parse_line(line))
+        weights = (self.subject_weight, self.predicate_weight, self.object_weight, self.location_weight, self.time_weight, self.sample_size, self.include_generalized,
+                   self.similarity_threshold if self.semantic_index is not None else None, self.semantic_index.built_at if self.semantic_index is not None else None)
+        return PredictionCache.make_key(direction, context, weights)
+
+    def _retrieve(self, direction: str, line: Optional[str]) -> List[Tuple[float, Dict, str]]:
+        """Candidats pour une ligne de contexte ('previous' ou 'next'), via le cache LRU"""
+        if not self._is_context(line):
+            return []
+
+        key = self._context_key(direction, line)
+        candidates = self.cache.get(key)
+        if candidates is None:
+            candidates = self._score_context(direction, line)
+            self.cache.set(key, candidates)
+        return candidates
+
+    def _score_context(self, direction: str, line: str) -> List[Tuple[float, Dict, str]]:
+        """Recherche des candidats d'une ligne de contexte dans la base (sans le cache)"""
+        with metrics.timer("prediction_scoring_seconds", direction=direction):
+            if direction == "previous":
+                candidates = self._predict_from_previous(line, set())
+            else:
+                candidates = self._predict_from_next(line, set())
+        metrics.inc("prediction_candidates_total", len(candidates), direction=direction)
+        return candidates
+
+    def save_cache(self):
+        """Sauvegarde le cache de candidats si un fichier de persistance est configuré"""
+        self.cache.save()
+
+    def _predict_gaps(self, story_lines: List[str], multi_gap: Optional[bool] = None) -> List[Dict[str, Any]]:
+        if multi_gap is None:
+            multi_gap = self.multi_gap
+
+        results = []
         all_subjects = set()
 
         for line in story_lines:
             if '?' not in line:
-                all_subjects.add(self.extractor._extract_factoid_components(line)["subject"].lower())
+                all_subjects.add(parse_line(line).subject)
 
-        for i in range(len(story_lines)):
-            if story_lines[i].strip() == "?":
-                prev_line = story_lines[i - 1] if i > 0 else None
-                next_line = story_lines[i + 1] if i < len(story_lines) - 1 else None
+        i = 0
+        while i < len(story_lines):
+            if story_lines[i].strip() != "?":
+                i += 1
+                continue
 
-                pred_previous = self._predict_from_previous(prev_line, all_subjects)
-                pred_next = self._predict_from_next(next_line, all_subjects)
+            # Bornes de la suite de trous consécutifs [i, j[
+            j = i
+            while j < len(story_lines) and story_lines[j].strip() == "?":
+                j += 1
 
-                pred_possibles = pred_previous + pred_next
-                pred_possibles = sorted(pred_possibles, key = lambda x: x[0], reverse=True)
-
-                if pred_possibles == []:
-                    pred = "?"
+            if multi_gap and j - i > 1:
+                prev_line = story_lines[i - 1] if i > 0 else None
+                next_line = story_lines[j] if j < len(story_lines) else None
+                chosen = self._beam_fill(prev_line, next_line, j - i)
+            else:
+                chosen = []
+                for k in range(i, j):
+                    prev_line = story_lines[k - 1] if k > 0 else None
+                    next_line = story_lines[k + 1] if k < len(story_lines) - 1 else None
+
+                    pred_possibles = self._retrieve("previous", prev_line) + self._retrieve("next", next_line)
+                    pred_possibles = sorted(pred_possibles, key = lambda x: x[0], reverse=True)
+                    chosen.append(pred_possibles[0] if pred_possibles else None)
+
+            for candidate in chosen:
+                if candidate is None:
+                    results.append({"prediction": "?", "score": None, "source": None})
                 else:
-                    pred_subject = pred_possibles[0][1]["subject"]
-                    story_id_origin = pred_possibles[0][2]
-                    if not pred_subject.lower() in all_subjects:
-                        # sélectionne un sujet le plus sémantiquement proche
-                        # checker r_syn, r_masc, r_fem
+                    results.append({"prediction": self._adapt_prediction(candidate, all_subjects), "score": candidate[0], "source": candidate[2]})
+            i = j
+
+        return results
+
+    def _is_context(self, line: Optional[str]) -> bool:
+        return line is not None and line.strip() != "?"
+
+    def _beam_fill(self, prev_line: Optional[str], next_line: Optional[str], length: int) -> List[Optional[Tuple[float, Dict, str]]]:
+        """
+        Complète une suite de `length` trous consécutifs par recherche en faisceau.
+
+        Chaque ligne prédite sert de contexte précédent pour le trou suivant ; la ligne
+        qui suit la suite n'est utilisée que pour le dernier trou. Le score d'un faisceau
+        est la somme des scores des candidats retenus. Au plus `beam_width` faisceaux sont
+        conservés à chaque étape, et les trous restants sont laissés vides (None) une fois
+        le budget de temps `beam_time_budget` (en secondes) épuisé.
+        """
+        deadline = time.monotonic() + self.beam_time_budget if self.beam_time_budget else None
+        # Faisceau : (score cumulé, candidats retenus, ligne de contexte précédente)
+        beams = [(0.0, [], prev_line)]
+
+        for step in range(length):
+            if deadline is not None and time.monotonic() > deadline:
+                break
+
+            last = step == length - 1
+            next_candidates = self._retrieve("next", next_line) if last else []
+
+            expanded = []
+            for score, chosen, context in beams:
+                candidates = self._retrieve("previous", context) + next_candidates
+                seen = set()
+                for candidate in sorted(candidates, key=lambda x: x[0], reverse=True):
+                    text = self._factoid_text(candidate[1])
+                    if text in seen:
+                        continue
+                    seen.add(text)
+                    expanded.append((score + candidate[0], chosen + [candidate], text))
+
+                if not candidates:
+                    expanded.append((score, chosen + [None], None))
+
+            beams = sorted(expanded, key=lambda x: x[0], reverse=True)[:self.beam_width]
+
+        best = beams[0][1]
+        return best + [None] * (length - len(best))
+
+    def _adapt_prediction(self, candidate: Tuple[float, Dict, str], all_subjects: Set[str]) -> str:
+        """Remplace le sujet du candidat par le sujet de l'histoire le plus proche, puis le met en forme"""
+        pred_factoid = candidate[1]
+        pred_subject = pred_factoid["subject"]
+        story_id_origin = candidate[2]
+        if not pred_subject.lower() in all_subjects:
+            # sélectionne un sujet le plus sémantiquement proche
+            # checker r_syn, r_masc, r_fem
+            
+            subject_found = None
+            if not '(' in pred_subject and self.semantic_index is not None:
+                # sujet de l'histoire le plus similaire dans l'index sémantique, sans appel réseau
+                scored = [(self.semantic_index.similarity(pred_subject, subject), subject) for subject in sorted(all_subjects)]
+                best = max(scored, default=(0.0, None))
+                if best[0] >= self.similarity_threshold:
+                    subject_found = best[1]
+            elif not '(' in pred_subject:
+                for subject in all_subjects:
+                    if self.jdm.has_relation(pred_subject, subject, "r_masc"):
+                        # derivation masculin
+                        if verbose():
+                            print("Deriv masculin")
+                        subject_found = subject
+                    elif self.jdm.has_relation(pred_subject, subject, "r_fem"):
+                        # derivation feminin
+                        if verbose():
+                            print("Deriv feminin")
+                        subject_found = subject
+                    elif self.jdm.has_relation(pred_subject, subject, "r_syn"):
+                        # derivation synonyme
+                        if verbose():
+                            print("Deriv syn")
+                        subject_found = subject
+            else:
+                if verbose():
+                    print(pred_subject)
+                p_subject = pred_subject.strip("()")
+                if ':' in p_subject:
+                    p_subject = p_subject.split(':')[0]
+                # on suppose a present qu'on remplace toutes les occurences de pred_subject par subject dans l'histoire originale
+                origin_story = StoryDatabase.get_story(story_id_origin)
+                for subject in all_subjects:
+                    new_factoids = []
+                    for factoid in origin_story["factoids"]:
+                        new_factoid = factoid.copy()
+                        if factoid["subject"] == pred_subject:
+                            new_factoid["subject"] = subject
+                        elif factoid["object"] == pred_subject:
+                            new_factoid["object"] = subject
+
+                        new_factoid["subject"] = new_factoid["subject"].strip("()")
+                        new_factoid["object"] = new_factoid["object"].strip("()")
+                        if ':' in new_factoid["subject"]:
+                            new_factoid["subject"] = new_factoid["subject"].split(':')[0]
+                        if ':' in new_factoid["object"]:
+                            new_factoid["object"] = new_factoid["object"].split(':')[0]
                         
-                        subject_found = None
-                        if not '(' in pred_subject:
-                            for subject in all_subjects:
-                                if self.jdm.has_relation(pred_subject, subject, "r_masc"):
-                                    # derivation masculin
-                                    print("Deriv masculin")
-                                    subject_found = subject
-                                elif self.jdm.has_relation(pred_subject, subject, "r_fem"):
-                                    # derivation feminin
-                                    print("Deriv feminin")
-                                    subject_found = subject
-                                elif self.jdm.has_relation(pred_subject, subject, "r_syn"):
-                                    # derivation synonyme
-                                    print("Deriv syn")
-                                    subject_found = subject
-                        else:
-                            print(pred_subject)
-                            p_subject = pred_subject.strip("()")
-                            if ':' in p_subject:
-                                p_subject = p_subject.split(':')[0]
-                            # on suppose a present qu'on remplace toutes les occurences de pred_subject par subject dans l'histoire originale
-                            origin_story = StoryDatabase.get_story(story_id_origin)
-                            for subject in all_subjects:
-                                new_factoids = []
-                                for factoid in origin_story["factoids"]:
-                                    new_factoid = factoid.copy()
-                                    if factoid["subject"] == pred_subject:
-                                        new_factoid["subject"] = subject
-                                    elif factoid["object"] == pred_subject:
-                                        new_factoid["object"] = subject
-
-                                    new_factoid["subject"] = new_factoid["subject"].strip("()")
-                                    new_factoid["object"] = new_factoid["object"].strip("()")
-                                    if ':' in new_factoid["subject"]:
-                                        new_factoid["subject"] = new_factoid["subject"].split(':')[0]
-                                    if ':' in new_factoid["object"]:
-                                        new_factoid["object"] = new_factoid["object"].split(':')[0]
-                                    
-                                    new_factoids.append(new_factoid)
-                                            
-                                test_story = {
-                                    "id": "test",
-                                    "domain": "test",
-                                    "factoids": new_factoids
-                                }         
-
-                                if StoryGenerator.check_story_consistency(self, test_story, ignore = True):
-                                    subject_found = subject
-
-                        if subject_found != None:
-                            pred_possibles[0][1]["subject"] = subject_found
-                    pred = self._factoid_text(pred_possibles[0][1])
-
-                predictions.append(pred)
-        
-        return predictions
+                        new_factoids.append(new_factoid)
+                                
+                    test_story = {
+                        "id": "test",
+                        "domain": "test",
+                        "factoids": new_factoids
+                    }         
+
+                    if self.story_generator.check_story_consistency(test_story, ignore = True):
+                        subject_found = subject
+
+            if subject_found != None:
+                pred_factoid["subject"] = subject_found
+        return self._factoid_text(pred_factoid)
+
+    # Rôles pour lesquels le score accepte des termes proches (voir check_terms)
+    SIMILAR_ROLES = ("subject", "object")
 
-    def check_terms(self, term1: str, term2: str, type:str) -> bool:
+    def check_terms(self, term1: str, term2: str, type:str, similar: bool = False) -> bool:
         if term1 == term2:
             return True
+
+        # Similarité sémantique hors ligne (voir SemanticIndex), sans appel réseau ; sujets et objets seulement
+        if similar and type in self.SIMILAR_ROLES and self.semantic_index is not None and term1 and term2:
+            return self.semantic_index.similarity(term1, term2) >= self.similarity_threshold
         
         return False
     
@@ -178,26 +396,34 @@ class FactoidPredict1:
         
         return False
 
+    def _context_score(self, factoid: Factoid, context: ParsedFactoid) -> float:
+        """Score d'un factoïde de la base par rapport au factoïde de contexte"""
+        subject, predicate, object_, location, time_ = factoid.terms()
+        score = 0
+        if self.check_terms(subject, context.subject, "subject", similar=True):
+            score += self.subject_weight
+        if self.check_terms(predicate, context.predicate, "predicate"):
+            score += self.predicate_weight
+        if self.check_terms(object_, context.object, "object", similar=True):
+            score += self.object_weight
+
+        if location != "" and self.check_terms(location, context.location, "location"):
+            score += self.location_weight
+        if time_ != "" and self.check_terms(time_, context.time, "time"):
+            score += self.time_weight
+        return score
+
     def _predict_from_previous(self, prev_line: str, all_subjects: List[str]) -> str:
         candidates = []
+        if not self._is_context(prev_line):
+            return candidates
 
-        prev_factoid = self.extractor._extract_factoid_components(prev_line)
+        prev_factoid = parse_line(prev_line)
         for factoid in StoryDatabase.list_factoids():
             if len(candidates) >= self.sample_size:
                 return candidates
             else:
-                score = 0
-                if self.check_terms(factoid.get("subject"), prev_factoid.get("subject"), "subject"):
-                    score += self.subject_weight
-                if self.check_terms(factoid.get("predicate"), prev_factoid.get("predicate"), "predicate"):
-                    score += self.predicate_weight
-                if self.check_terms(factoid.get("object"), prev_factoid.get("object"), "object"):
-                    score += self.object_weight
-
-                if factoid.get("location") != "" and self.check_terms(factoid.get("location"), prev_factoid.get("location"), "location"):
-                    score += self.location_weight
-                if factoid.get("time") != "" and self.check_terms(factoid.get("time"), prev_factoid.get("time"), "time"):
-                    score += self.time_weight
+                score = self._context_score(factoid, prev_factoid)
 
                 if score >= 2.0:
                     found = False
@@ -235,24 +461,15 @@ class FactoidPredict1:
 
     def _predict_from_next(self, next_line: str, all_subjects: List[str]) -> str:
         candidates = []
+        if not self._is_context(next_line):
+            return candidates
 
-        next_factoid = self.extractor._extract_factoid_components(next_line)
+        next_factoid = parse_line(next_line)
         for factoid in StoryDatabase.list_factoids():
             if len(candidates) >= self.sample_size:
                 return candidates
             else:
-                score = 0
-                if factoid.get("subject") == next_factoid.get("subject"):
-                    score += self.subject_weight
-                if factoid.get("predicate") == next_factoid.get("predicate"):
-                    score += self.predicate_weight
-                if factoid.get("object") == next_factoid.get("object"):
-                    score += self.object_weight
-
-                if factoid.get("location") != "" and factoid.get("location") == next_factoid.get("location"):
-                    score += self.location_weight
-                if factoid.get("time") != "" and factoid.get("time") == next_factoid.get("time"):
-                    score += self.time_weight
+                score = self._context_score(factoid, next_factoid)
 
                 if score >= 2.0:
                     found = False
@@ -287,3 +504,23 @@ class FactoidPredict1:
                         if found:
                             break
         return candidates
+
+
+# Prédicteur propre à chaque processus du pool de predict_batch
+_batch_predictor = None
+
+def _init_batch_worker(init_kwargs: Dict[str, Any], cache_entries: Dict[str, List]):
+    global _batch_predictor
+    _batch_predictor = FactoidPredict1(**init_kwargs)
+    _batch_predictor.cache.update(cache_entries)
+
+def _score_context_worker(direction: str, line: str) -> Tuple[List[Tuple[float, Dict, str]], float, Dict[str, List]]:
+    start = time.perf_counter()
+    candidates = _batch_predictor._score_context(direction, line)
+    return candidates, time.perf_counter() - start, metrics.take()
+
+def _predict_batch_worker(index: int, story_lines: List[str], cache_entries: Dict[str, List]) -> Dict[str, Any]:
+    _batch_predictor.cache.update(cache_entries)
+    result = _batch_predictor._predict_story_result(index, story_lines)
+    result["metrics"] = metrics.take()
+    return result
@@ -0,0 +1,79 @@
+"""
+Verrou consultatif exclusif entre processus, posé sur un fichier (fcntl sous Unix, msvcrt sous Windows).
+
+Le verrou est réentrant dans un même thread ; les threads d'un processus se l'échangent
+comme un RLock. Seuls les processus qui prennent le verrou sont coordonnés : il ne bloque
+pas les lectures ou écritures des autres.
+"""
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+class FileLock:
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+        self._depth = 0
+        self._thread_lock = threading.RLock()
+
+    def acquire(self):
+        self._thread_lock.acquire()
+        if self._depth == 0:
+            try:
+                self._file = self._lock_file()
+            except BaseException:
+                self._thread_lock.release()
+                raise
+        self._depth += 1
+
+    def _lock_file(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        f = open(self.path, "a+b")
+        try:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            else:
+                # Verrou sur le premier octet ; LK_LOCK abandonne après une dizaine de secondes
+                f.seek(0)
+                while True:
+                    try:
+                        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:
+                        time.sleep(0.05)
+        except BaseException:
+            f.close()
+            raise
+        return f
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0:
+            f, self._file = self._file, None
+            try:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+            finally:
+                f.close()
+        self._thread_lock.release()
+
+    @property
+    def depth(self) -> int:
+        """Nombre d'acquisitions en cours (1 : acquisition la plus externe)"""
+        return self._depth
+
+    def __enter__(self) -> "FileLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
@@ -0,0 +1,209 @@
+"""
+Index hors ligne de la fermeture transitive des hyperonymes (r_isa) des termes du corpus.
+
+Pour chaque terme, les ancêtres r_isa sont parcourus en largeur jusqu'à une profondeur
+maximale ; un nœud déjà atteint n'est pas reparcouru (protection contre les cycles). Le
+poids d'un chemin est le plus faible poids de ses relations, et chaque ancêtre garde son
+meilleur chemin le plus court. L'index est stocké de façon compacte : une table des noms
+et, par terme, les identifiants d'ancêtres triés avec leurs poids et profondeurs. Les
+recherches se font ensuite sans accès réseau.
+"""
+import json
+import os
+import time
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+from jdm_client import JDMClient
+from story_database import StoryDatabase
+
+# Profondeurs stockées sur 16 bits
+MAX_DEPTH = 32767
+
+class HypernymIndex:
+    def __init__(self, index_file: str = "data/hypernym_index.json"):
+        self.index_file = index_file
+        self.max_depth = 0
+        self.built_at: float = 0.0
+        # Les termes indexés occupent les premiers identifiants de `names`
+        self.names: List[str] = []
+        self.name_ids: Dict[str, int] = {}
+        self.term_count = 0
+        # Ligne i : ancestors/weights/depths[indptr[i]:indptr[i + 1]], triée par identifiant d'ancêtre
+        self.indptr = array("l", [0])
+        self.ancestor_ids = array("l")
+        self.weights = array("d")
+        self.depths = array("h")
+
+    def build(self, terms: Iterable[str], jdm: JDMClient, max_depth: int = 3, min_weight: int = 5) -> "HypernymIndex":
+        """
+        Calcule la fermeture r_isa des termes (relations servies par le cache du client)
+
+        Args:
+            terms: Termes du corpus
+            jdm: Client JDM
+            max_depth: Nombre maximal de relations r_isa enchaînées
+            min_weight: Poids minimum des relations
+        """
+        if not 1 <= max_depth <= MAX_DEPTH:
+            raise ValueError(f"max_depth doit être compris entre 1 et {MAX_DEPTH}")
+        self.max_depth = max_depth
+        terms = sorted({t.lower() for t in terms if t})
+        self.names = list(terms)
+        self.name_ids = {name: i for i, name in enumerate(self.names)}
+        self.term_count = len(terms)
+        self.indptr = array("l", [0])
+        self.ancestor_ids = array("l")
+        self.weights = array("d")
+        self.depths = array("h")
+
+        # Hyperonymes directs, demandés une seule fois par nœud
+        direct: Dict[str, List[Tuple[str, float]]] = {}
+
+        def hypernyms(name: str) -> List[Tuple[str, float]]:
+            if name not in direct:
+                direct[name] = self._direct_hypernyms(name, jdm, min_weight)
+            return direct[name]
+
+        for term in terms:
+            # ancêtre -> (poids du chemin, profondeur)
+            best: Dict[str, Tuple[float, int]] = {}
+            frontier = [(term, float("inf"))]
+            visited = {term}
+            for depth in range(1, max_depth + 1):
+                next_frontier: Dict[str, float] = {}
+                for name, path_weight in frontier:
+                    for parent, weight in hypernyms(name):
+                        if parent in visited:
+                            continue
+                        weight = min(path_weight, weight)
+                        if weight > next_frontier.get(parent, 0.0):
+                            next_frontier[parent] = weight
+                for parent, weight in next_frontier.items():
+                    visited.add(parent)
+                    best[parent] = (weight, depth)
+                frontier = list(next_frontier.items())
+                if not frontier:
+                    break
+
+            row = sorted((self._name_id(name), weight, depth) for name, (weight, depth) in best.items())
+            for ancestor_id, weight, depth in row:
+                self.ancestor_ids.append(ancestor_id)
+                self.weights.append(weight)
+                self.depths.append(depth)
+            self.indptr.append(len(self.ancestor_ids))
+
+        self.built_at = time.time()
+        return self
+
+    @staticmethod
+    def _direct_hypernyms(name: str, jdm: JDMClient, min_weight: int) -> List[Tuple[str, float]]:
+        result = jdm.get_relations_from(name, types_ids=[jdm.relation_type_ids["r_isa"]], min_weight=min_weight)
+        if not result or not result.get("relations"):
+            return []
+        names = {node.get("id"): node.get("name") for node in result.get("nodes", [])}
+        parents = []
+        for rel in result["relations"]:
+            parent = names.get(rel.get("node2"))
+            if parent and parent != name and ":" not in parent and rel.get("w", 0) >= min_weight:
+                parents.append((parent, float(rel["w"])))
+        return parents
+
+    def _name_id(self, name: str) -> int:
+        name_id = self.name_ids.get(name)
+        if name_id is None:
+            name_id = len(self.names)
+            self.names.append(name)
+            self.name_ids[name] = name_id
+        return name_id
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.index_file) or ".", exist_ok=True)
+        with open(self.index_file, "w", encoding="utf-8") as f:
+            json.dump({
+                "max_depth": self.max_depth,
+                "built_at": self.built_at,
+                "term_count": self.term_count,
+                "names": self.names,
+                "indptr": list(self.indptr),
+                "ancestors": list(self.ancestor_ids),
+                "weights": list(self.weights),
+                "depths": list(self.depths)
+            }, f, ensure_ascii=False)
+
+    def load(self) -> bool:
+        if not os.path.exists(self.index_file):
+            return False
+        with open(self.index_file, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        self.max_depth = data["max_depth"]
+        self.built_at = data["built_at"]
+        self.term_count = data["term_count"]
+        self.names = data["names"]
+        self.name_ids = {name: i for i, name in enumerate(self.names)}
+        self.indptr = array("l", data["indptr"])
+        self.ancestor_ids = array("l", data["ancestors"])
+        self.weights = array("d", data["weights"])
+        self.depths = array("h", data["depths"])
+        return True
+
+    def _row(self, term: str) -> Optional[Tuple[int, int]]:
+        term_id = self.name_ids.get(term.lower())
+        if term_id is None or term_id >= self.term_count:
+            return None
+        return self.indptr[term_id], self.indptr[term_id + 1]
+
+    def contains(self, term: str) -> bool:
+        return self._row(term) is not None
+
+    def ancestors(self, term: str) -> List[Tuple[str, float, int]]:
+        """Ancêtres d'un terme : [(nom, poids du chemin, profondeur)], du plus proche au plus lointain"""
+        row = self._row(term)
+        if row is None:
+            return []
+        start, end = row
+        ancestors = [(self.names[self.ancestor_ids[i]], self.weights[i], self.depths[i]) for i in range(start, end)]
+        return sorted(ancestors, key=lambda x: (x[2], -x[1]))
+
+    def shared_ancestors(self, terms: List[str]) -> List[Tuple[str, float, int]]:
+        """
+        Ancêtres communs à tous les termes, du plus spécifique au plus général : profondeur
+        maximale la plus faible, puis poids minimal le plus fort. Retourne [(nom, poids, profondeur)].
+        """
+        shared: Optional[Dict[int, Tuple[float, int]]] = None
+        for term in dict.fromkeys(terms):
+            row = self._row(term)
+            if row is None:
+                return []
+            start, end = row
+            current = {self.ancestor_ids[i]: (self.weights[i], self.depths[i]) for i in range(start, end)}
+            if shared is None:
+                shared = current
+            else:
+                shared = {a: (min(w, current[a][0]), max(d, current[a][1])) for a, (w, d) in shared.items() if a in current}
+            if not shared:
+                return []
+        if not shared:
+            return []
+        return sorted(((self.names[a], w, d) for a, (w, d) in shared.items()), key=lambda x: (x[2], -x[1], x[0]))
+
+    def most_specific_shared_ancestor(self, terms: List[str]) -> Optional[str]:
+        shared = self.shared_ancestors(terms)
+        return shared[0][0] if shared else None
+
+def corpus_subjects() -> List[str]:
+    """Sujets distincts des histoires non généralisées de StoryDatabase"""
+    subjects = set()
+    for story_id in StoryDatabase.list_stories():
+        story = StoryDatabase.get_story(story_id)
+        if story.get("generalized"):
+            continue
+        for factoid in story.get("factoids", []):
+            if factoid.get("subject"):
+                subjects.add(factoid["subject"].lower())
+    return sorted(subjects)
+
+if __name__ == "__main__":
+    StoryDatabase.initialize()
+    index = HypernymIndex().build(corpus_subjects(), JDMClient(logging=False))
+    index.save()
+    print(f"Index des hyperonymes : {index.term_count} termes, {len(index.names) - index.term_count} ancêtres supplémentaires.")
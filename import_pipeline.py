@@ -0,0 +1,273 @@
+"""
+Importation en flux des histoires : lecture -> validation -> persistance.
+
+Les trois étapes tournent en parallèle, reliées par des files bornées : la mémoire
+utilisée par le pipeline ne dépend pas de la taille du fichier. Après chaque lot
+persisté, un fichier de reprise enregistre le numéro de la dernière histoire validée,
+ce qui permet de reprendre une importation interrompue. Les histoires dont le contenu
+n'a pas changé depuis la dernière importation sont ignorées (voir StoryDatabase.story_hash).
+
+Avec plusieurs processus, l'extraction et la validation des lots sont réparties sur un
+pool ; la lecture attribue les numéros d'histoire et le processus principal fusionne
+les résultats dans l'ordre du fichier, ce qui rend les identifiants déterministes.
+"""
+import json
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from queue import Empty, Full, Queue
+from typing import Any, Dict, Iterator, List, Tuple
+from story_database import StoryDatabase
+from review_queue import ReviewQueue
+import metrics
+
+# Fin de flux entre deux étapes
+_DONE = object()
+
+class ImportPipeline:
+    def __init__(self, generator, batch_size: int = 32, queue_size: int = 4, checkpoint_file: str = "data/import_checkpoint.json", force: bool = True, workers: int = 1, review_queue_file: str = "data/review_queue.json"):
+        """
+        Args:
+            generator: StoryGenerator fournissant le fichier d'entrée, l'extraction et la validation
+            batch_size: Nombre d'histoires par lot validé et persisté
+            queue_size: Nombre maximal de lots en attente entre deux étapes
+            checkpoint_file: Fichier de reprise
+            force: Accepte automatiquement les termes et relations inconnus de JDM
+            workers: Nombre de processus d'extraction et de validation
+            review_queue_file: File de revue des histoires bloquées (générateur en mode différé)
+        """
+        self.generator = generator
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.checkpoint_file = checkpoint_file
+        self.force = force
+        self.workers = workers
+        self.review_queue_file = review_queue_file
+        self._errors: List[BaseException] = []
+        self._stop = threading.Event()
+
+    def load_checkpoint(self) -> Dict[str, Any]:
+        if not os.path.exists(self.checkpoint_file):
+            return {}
+        try:
+            with open(self.checkpoint_file, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (json.JSONDecodeError, OSError):
+            return {}
+
+    def _save_checkpoint(self, checkpoint: Dict[str, Any]):
+        os.makedirs(os.path.dirname(self.checkpoint_file) or ".", exist_ok=True)
+        tmp_file = self.checkpoint_file + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(checkpoint, f, ensure_ascii=False)
+        os.replace(tmp_file, self.checkpoint_file)
+
+    def _resume_point(self, resume: bool) -> int:
+        """Numéro de la dernière histoire persistée lors d'une importation interrompue du même fichier"""
+        checkpoint = self.load_checkpoint()
+        if not resume or checkpoint.get("completed") or checkpoint.get("input_file") != os.path.abspath(self.generator.input_file):
+            return 0
+        return checkpoint.get("last_story", 0)
+
+    def read_stories(self, start_after: int = 0) -> Iterator[Tuple[int, str, List[str]]]:
+        """Lit le fichier d'entrée en flux et produit (numéro, domaine, phrases) pour chaque histoire"""
+        current_domain = None
+        factoid_sentences = []
+        story_counter = 1
+
+        with open(self.generator.input_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                if '[' not in line:
+                    if current_domain and factoid_sentences:
+                        if story_counter > start_after:
+                            yield story_counter, current_domain, factoid_sentences
+                        story_counter += 1
+                    current_domain = line
+                    factoid_sentences = []
+                else:
+                    factoid_sentences.append(line)
+
+            if current_domain and factoid_sentences and story_counter > start_after:
+                yield story_counter, current_domain, factoid_sentences
+
+    def _put(self, queue: Queue, item: Any) -> bool:
+        """Dépose un élément en attendant qu'une place se libère, sauf si le pipeline est arrêté"""
+        while not self._stop.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                continue
+        return False
+
+    def _parse_stage(self, start_after: int, sink: Queue):
+        try:
+            batch = []
+            for item in self.read_stories(start_after):
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    if not self._put(sink, batch):
+                        return
+                    batch = []
+            if batch:
+                self._put(sink, batch)
+        except BaseException as e:
+            self._errors.append(e)
+        finally:
+            self._put(sink, _DONE)
+
+    def _validate_stage(self, source: Queue, sink: Queue):
+        try:
+            if self.workers > 1:
+                self._validate_in_pool(source, sink)
+                return
+            while True:
+                batch = self._get(source)
+                if batch is _DONE:
+                    return
+                if not self._put(sink, _validate_batch(self.generator, batch, self.force)):
+                    return
+        except BaseException as e:
+            self._errors.append(e)
+        finally:
+            self._put(sink, _DONE)
+
+    def _validate_in_pool(self, source: Queue, sink: Queue):
+        """Valide les lots dans un pool de processus et les transmet dans l'ordre de lecture"""
+        in_flight = deque()
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_import_worker, initargs=(self.generator.init_kwargs,)) as executor:
+            done = False
+            while not done or in_flight:
+                # Garde au plus deux lots en cours par processus
+                while not done and len(in_flight) < 2 * self.workers:
+                    batch = self._get(source)
+                    if batch is _DONE:
+                        done = True
+                    else:
+                        in_flight.append(executor.submit(_validate_import_batch, batch, self.force))
+                if in_flight and not self._put(sink, in_flight.popleft().result()):
+                    for future in in_flight:
+                        future.cancel()
+                    return
+
+    def _get(self, source: Queue) -> Any:
+        while not self._stop.is_set():
+            try:
+                return source.get(timeout=0.1)
+            except Empty:
+                continue
+        return _DONE
+
+    def run(self, resume: bool = True) -> int:
+        """
+        Importe le fichier d'entrée. Retourne le nombre d'histoires ajoutées ou remplacées dans StoryDatabase.
+
+        Args:
+            resume: Reprend après la dernière histoire persistée si l'importation précédente a été interrompue
+        """
+        if self.workers > 1 and not self.force and not self.generator.defer_reviews:
+            raise ValueError("L'importation interactive ne peut pas utiliser plusieurs processus : utiliser le mode différé.")
+
+        self._errors = []
+        self._stop.clear()
+        start_after = self._resume_point(resume)
+        if start_after:
+            print(f"Reprise de l'importation après l'histoire {start_after}.")
+
+        parsed = Queue(maxsize=self.queue_size)
+        validated = Queue(maxsize=self.queue_size)
+        stages = [
+            threading.Thread(target=self._parse_stage, args=(start_after, parsed), daemon=True),
+            threading.Thread(target=self._validate_stage, args=(parsed, validated), daemon=True)
+        ]
+        for stage in stages:
+            stage.start()
+
+        added = 0
+        unchanged = 0
+        deferred = 0
+        review_queue = ReviewQueue(self.review_queue_file)
+        checkpoint = {"input_file": os.path.abspath(self.generator.input_file), "last_story": start_after, "completed": False}
+        try:
+            while True:
+                item = validated.get()
+                if item is _DONE or self._errors:
+                    break
+                metrics.merge(item.pop("metrics", None))
+                # Termes et relations acceptés par les processus de validation
+                StoryDatabase.add_valid_terms(item["accepted"]["terms"])
+                StoryDatabase.add_valid_relations(item["accepted"]["relations"])
+                stories = [story for (_, story), consistent in zip(item["stories"], item["verdicts"]) if consistent]
+                StoryDatabase.add_stories(stories)
+                added += len(stories)
+                unchanged += item["unchanged"]
+                if item["deferred"]:
+                    for story, terms, relations in item["deferred"]:
+                        review_queue.add_story(story, terms, relations)
+                    review_queue.save()
+                    deferred += len(item["deferred"])
+
+                checkpoint["last_story"] = item["last_story"]
+                self._save_checkpoint(checkpoint)
+        finally:
+            # Arrête les étapes en amont si la persistance a échoué
+            self._stop.set()
+            for stage in stages:
+                stage.join(timeout=1)
+
+        if self._errors:
+            raise self._errors[0]
+
+        # Les lots n'ont rempli que le journal des factoïdes : une seule réécriture de factoids.json
+        StoryDatabase.save_factoids()
+        checkpoint["completed"] = True
+        self._save_checkpoint(checkpoint)
+        if unchanged:
+            print(f"{unchanged} histoire(s) inchangée(s) ignorée(s).")
+        if deferred:
+            print(f"{deferred} histoire(s) en attente de revue (main.py review).")
+        return added
+
+def _validate_batch(generator, batch: List[Tuple[int, str, List[str]]], force: bool) -> Dict[str, Any]:
+    """
+    Extrait et valide un lot. Les histoires déjà importées avec le même contenu sont
+    écartées avant toute requête JDM.
+
+    Returns:
+        Les histoires numérotées à enregistrer, leurs verdicts, les validations à fusionner,
+        les histoires mises en attente de revue et le nombre d'histoires inchangées
+    """
+    numbered_stories = []
+    unchanged = 0
+    for number, domain, sentences in batch:
+        story = generator._create_story(domain, sentences, number)
+        if StoryDatabase.is_unchanged(story):
+            unchanged += 1
+        else:
+            numbered_stories.append((number, story))
+
+    verdicts = generator.check_stories_consistency([story for _, story in numbered_stories], force = force)
+    accepted = generator.pending_validations or {"terms": [], "relations": []}
+    if generator.pending_validations is not None:
+        generator.pending_validations = {"terms": [], "relations": []}
+    return {"stories": numbered_stories, "verdicts": verdicts, "accepted": accepted, "deferred": generator.take_pending_reviews(),
+            "unchanged": unchanged, "last_story": batch[-1][0]}
+
+# Générateur propre à chaque processus du pool d'importation
+_worker_generator = None
+
+def _init_import_worker(init_kwargs: Dict[str, Any]):
+    global _worker_generator
+    from story_generator import StoryGenerator
+    _worker_generator = StoryGenerator(**init_kwargs)
+    _worker_generator.pending_validations = {"terms": [], "relations": []}
+
+def _validate_import_batch(batch: List[Tuple[int, str, List[str]]], force: bool):
+    result = _validate_batch(_worker_generator, batch, force)
+    # Mesures du processus, ajoutées à celles du processus principal
+    result["metrics"] = metrics.take()
+    return result
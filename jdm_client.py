@@ -7,24 +7,39 @@ import time
 import os
 import logging
 from typing import List, Dict, Any, Optional, Union
+import metrics
+from jdm_replay import JDMRecorder
+
+DEFAULT_BASE_URL = "https://jdm-api.demo.lirmm.fr"
+
+def verbose() -> bool:
+    """Journal détaillé des requêtes et du cache : activé par JDM_VERBOSE=1 (main.py --verbose)"""
+    return os.environ.get("JDM_VERBOSE", "") not in ("", "0")
+
+# Valeur par défaut de `error_result` dans JDMClient._request : le corps de la réponse est rendu
+_BODY = object()
+
+class JDMUnavailableError(RuntimeError):
+    """API indisponible (débit limité, erreur serveur) après toutes les tentatives : aucune réponse à interpréter"""
 
 class JDMCache:
     """
     Cache pour stocker les résultats des requêtes à l'API JeuxDeMots
     afin de réduire le nombre d'appels réseau et d'améliorer les performances.
     """
-    def __init__(self, cache_dir: str = "data/cache", max_age: int = 86400, logging: bool = True):
+    def __init__(self, cache_dir: str = "data/cache", max_age: int = 86400, logging: Optional[bool] = None):
         """
         Initialise le cache JDM
         
         Args:
             cache_dir: Répertoire où stocker les fichiers de cache
             max_age: Durée de validité maximale des entrées du cache en secondes (par défaut: 1 jour)
+            logging: Affiche les accès au cache (par défaut : voir verbose())
         """
         self.memory_cache = {}  # Cache en mémoire pour les accès rapides
         self.cache_dir = cache_dir
         self.max_age = max_age
-        self.logging = logging
+        self.logging = verbose() if logging is None else logging
         
         # Créer le répertoire de cache s'il n'existe pas
         os.makedirs(cache_dir, exist_ok=True)
@@ -76,9 +91,11 @@ class JDMCache:
         if key in self.memory_cache:
             cache_entry = self.memory_cache[key]
             if time.time() - cache_entry["timestamp"] < self.max_age:
+                metrics.inc("cache_lookups_total", cache="jdm", tier="memory", result="hit")
                 if self.logging: 
                     print(f"[CACHE-MEM] Hit pour {method}")
                 return cache_entry["data"]
+        metrics.inc("cache_lookups_total", cache="jdm", tier="memory", result="miss")
         
         # Ensuite vérifier le cache sur disque
         file_path = self._get_cache_file_path(key)
@@ -91,6 +108,7 @@ class JDMCache:
                 if time.time() - cache_entry["timestamp"] < self.max_age:
                     # Mettre à jour le cache en mémoire
                     self.memory_cache[key] = cache_entry
+                    metrics.inc("cache_lookups_total", cache="jdm", tier="disk", result="hit")
                     if self.logging: 
                         print(f"[CACHE-DISK] Hit pour {method}")
                     return cache_entry["data"]
@@ -98,6 +116,7 @@ class JDMCache:
                 # En cas d'erreur, ignorer l'entrée du cache
                 pass
         
+        metrics.inc("cache_lookups_total", cache="jdm", tier="disk", result="miss")
         return None
     
     def set(self, method: str, data: Dict, **params) -> None:
@@ -132,19 +151,26 @@ class JDMCache:
 class JDMClient:
     """Client pour l'API JDM"""
     
-    def __init__(self, base_url: str = "https://jdm-api.demo.lirmm.fr", use_cache: bool = True, logging: bool = True):
+    def __init__(self, base_url: Optional[str] = None, use_cache: bool = True, logging: Optional[bool] = None, max_retries: int = 4, retry_delay: float = 0.5):
         """
         Initialise le client JDM
         
         Args:
-            base_url: URL de base de l'API JDM
+            base_url: URL de base de l'API JDM (par défaut : JDM_BASE_URL, sinon l'API publique)
             use_cache: Indique si le cache doit être utilisé
+            logging: Affiche les requêtes et les accès au cache (par défaut : voir verbose())
+            max_retries: Nouvelles tentatives après une erreur passagère (429, 5xx)
+            retry_delay: Première pause entre deux tentatives, doublée à chaque fois, si la réponse n'a pas d'en-tête Retry-After (secondes)
         """
-        self.base_url = base_url
+        self.base_url = (base_url or os.environ.get("JDM_BASE_URL") or DEFAULT_BASE_URL).rstrip("/")
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        # Réponses du réseau ajoutées au fichier JDM_RECORD (voir jdm_replay.py)
+        self.recorder = JDMRecorder(os.environ["JDM_RECORD"]) if os.environ.get("JDM_RECORD") else None
         self.use_cache = use_cache
-        self.cache = JDMCache(logging=logging) # Ajouter un cache par défaut
+        self.logging = verbose() if logging is None else logging
+        self.cache = JDMCache(logging=self.logging) # Ajouter un cache par défaut
         self.relation_type_ids = {}
-        self.logging = logging
         self._initialize_relation_type_ids()
     
     def _initialize_relation_type_ids(self):
@@ -157,36 +183,102 @@ class JDMClient:
                 self.relation_type_ids[name] = rel_id
                 logger.info(f"ID de la relation '${name}' : {rel_id}")
 
-    def get_node_by_name(self, node_name: str) -> Dict[str, Any]:
+    def _request(self, method: str, path: str, params: Optional[Dict[str, Any]] = None, error_result: Any = _BODY, delay: float = 0.0, **cache_params) -> Any:
         """
-        Récupère un nœud par son nom
-        
+        Requête GET sur l'API, servie par le cache si possible
+
         Args:
-            node_name: Nom du nœud
-        
+            method: Nom de la méthode (clé du cache, étiquette des mesures)
+            path: Chemin de la requête sous base_url
+            params: Paramètres de la requête
+            error_result: Résultat rendu sans mise en cache si le statut n'est pas 200, avec la clé "error" pour un dictionnaire
+                (par défaut, le corps de la réponse est rendu et mis en cache)
+            delay: Pause avant l'envoi de la requête (secondes)
+            cache_params: Paramètres de la clé du cache
+
         Returns:
-            Informations sur le nœud
+            Réponse JSON de l'API
+
+        Raises:
+            JDMUnavailableError: Erreur passagère (429, 5xx) à chaque tentative ; jamais rendue comme une réponse,
+                pour qu'aucun verdict ne soit tiré d'une absence de réponse
         """
         # Vérifier d'abord le cache si activé
         if self.use_cache:
-            cached_result = self.cache.get("get_node_by_name", node_name=node_name)
+            cached_result = self.cache.get(method, **cache_params)
             if cached_result is not None:
                 return cached_result
-        
-        url = f"{self.base_url}/v0/node_by_name/{node_name.lower()}"
+
+        url = f"{self.base_url}{path}"
         if self.logging:
-            print(f"Requête GET: {url}")
-        response = requests.get(url)
+            print(f"Requête GET: {url} avec params={params}" if params is not None else f"Requête GET: {url}")
+        if delay:
+            time.sleep(delay)
+
+        for attempt in range(self.max_retries + 1):
+            start = time.perf_counter()
+            response = requests.get(url, params=params) if params is not None else requests.get(url)
+            seconds = time.perf_counter() - start
+            metrics.observe("jdm_request_seconds", seconds, method=method)
+            metrics.inc("jdm_requests_total", method=method, status=response.status_code)
+            if self.recorder is not None:
+                self.recorder.record(path, params, response.status_code, response.text, seconds)
+            if not self._is_transient(response.status_code):
+                break
+            if attempt == self.max_retries:
+                raise JDMUnavailableError(f"Erreur {response.status_code} après {attempt + 1} tentative(s) : {url}")
+            time.sleep(self._retry_pause(response, attempt))
         if response.status_code != 200:
             print(f"Erreur {response.status_code}: {response.text}")
-            return {"error": f"Erreur {response.status_code}", "node": None}
+            if isinstance(error_result, dict):
+                return {**error_result, "error": f"Erreur {response.status_code}"}
+            if error_result is not _BODY:
+                return error_result
         result = response.json()
-        
+
         # Mettre en cache le résultat si le cache est activé
         if self.use_cache:
-            self.cache.set("get_node_by_name", result, node_name=node_name.lower())
-            
+            self.cache.set(method, result, **cache_params)
         return result
+
+    @staticmethod
+    def _is_transient(status: int) -> bool:
+        """Débit limité ou erreur du serveur : la même requête peut réussir plus tard"""
+        return status == 429 or status >= 500
+
+    def _retry_pause(self, response: requests.Response, attempt: int) -> float:
+        """Pause avant la tentative suivante : en-tête Retry-After (secondes) s'il est présent, sinon attente exponentielle"""
+        try:
+            return max(0.0, float(response.headers.get("Retry-After", "")))
+        except ValueError:
+            return self.retry_delay * 2 ** attempt
+
+    @staticmethod
+    def _relation_params(types_ids: Optional[List[int]], min_weight: Optional[int], max_weight: Optional[int], limit: Optional[int]) -> Dict[str, Any]:
+        params = {}
+        if types_ids:
+            params["types_ids"] = types_ids
+        if min_weight:
+            params["min_weight"] = min_weight
+        if max_weight:
+            params["max_weight"] = max_weight
+        if limit:
+            params["limit"] = limit
+        return params
+
+    def get_node_by_name(self, node_name: str) -> Dict[str, Any]:
+        """
+        Récupère un nœud par son nom
+        
+        Args:
+            node_name: Nom du nœud
+        
+        Returns:
+            Informations sur le nœud
+        """
+        node_name = node_name.lower()
+        return self._request("get_node_by_name", f"/v0/node_by_name/{node_name}",
+                             error_result={"node": None}, node_name=node_name)
     
     def get_relations_from(self, node_name: str, 
                           types_ids: Optional[List[int]] = None,
@@ -205,37 +297,10 @@ class JDMClient:
         Returns:
             Relations sortantes du nœud
         """
-        # Vérifier d'abord le cache si activé
-        if self.use_cache:
-            cached_result = self.cache.get("get_relations_from", node_name=node_name.lower(), types_ids=types_ids, min_weight=min_weight, max_weight=max_weight, limit=limit)
-            if cached_result is not None:
-                return cached_result
-        
-        url = f"{self.base_url}/v0/relations/from/{node_name.lower()}"
-        
-        params = {}
-        if types_ids:
-            params["types_ids"] = types_ids
-        if min_weight:
-            params["min_weight"] = min_weight
-        if max_weight:
-            params["max_weight"] = max_weight
-        if limit:
-            params["limit"] = limit
-
-        if self.logging:
-            print(f"Requête GET: {url} avec params={params}")
-        response = requests.get(url, params=params)
-        if response.status_code != 200:
-            print(f"Erreur {response.status_code}: {response.text}")
-            return {"error": f"Erreur {response.status_code}", "nodes": [], "relations": []}
-        result = response.json()
-        
-        # Mettre en cache le résultat si le cache est activé
-        if self.use_cache:
-            self.cache.set("get_relations_from", result, node_name=node_name.lower(), types_ids=types_ids, min_weight=min_weight, max_weight=max_weight, limit=limit)
-            
-        return result
+        node_name = node_name.lower()
+        return self._request("get_relations_from", f"/v0/relations/from/{node_name}", self._relation_params(types_ids, min_weight, max_weight, limit),
+                             error_result={"nodes": [], "relations": []},
+                             node_name=node_name, types_ids=types_ids, min_weight=min_weight, max_weight=max_weight, limit=limit)
     
     def get_relations_to(self, node_name: str, 
                         types_ids: Optional[List[int]] = None,
@@ -254,37 +319,10 @@ class JDMClient:
         Returns:
             Relations entrantes vers le nœud
         """
-        # Vérifier d'abord le cache si activé
-        if self.use_cache:
-            cached_result = self.cache.get("get_relations_to", node_name=node_name.lower(), types_ids=types_ids, min_weight=min_weight, max_weight=max_weight, limit=limit)
-            if cached_result is not None:
-                return cached_result
-        
-        url = f"{self.base_url}/v0/relations/to/{node_name.lower()}"
-        
-        params = {}
-        if types_ids:
-            params["types_ids"] = types_ids
-        if min_weight:
-            params["min_weight"] = min_weight
-        if max_weight:
-            params["max_weight"] = max_weight
-        if limit:
-            params["limit"] = limit
-        
-        if self.logging:
-            print(f"Requête GET: {url} avec params={params}")
-        response = requests.get(url, params=params)
-        if response.status_code != 200:
-            print(f"Erreur {response.status_code}: {response.text}")
-            return {"error": f"Erreur {response.status_code}", "nodes": [], "relations": []}
-        result = response.json()
-        
-        # Mettre en cache le résultat si le cache est activé
-        if self.use_cache:
-            self.cache.set("get_relations_to", result, node_name=node_name.lower(), types_ids=types_ids, min_weight=min_weight, max_weight=max_weight, limit=limit)
-            
-        return result
+        node_name = node_name.lower()
+        return self._request("get_relations_to", f"/v0/relations/to/{node_name}", self._relation_params(types_ids, min_weight, max_weight, limit),
+                             error_result={"nodes": [], "relations": []},
+                             node_name=node_name, types_ids=types_ids, min_weight=min_weight, max_weight=max_weight, limit=limit)
     
     def get_relations_from_to(self, node1_name: str, node2_name: str,
                              types_ids: Optional[List[int]] = None,
@@ -304,39 +342,11 @@ class JDMClient:
         Returns:
             Relations entre les deux nœuds
         """
-
-        # Vérifier d'abord le cache si activé
-        if self.use_cache:
-            cached_result = self.cache.get("get_relations_from_to", node1_name=node1_name.lower(), node2_name=node2_name.lower(), types_ids=types_ids, min_weight=min_weight, max_weight=max_weight, limit=limit)
-            if cached_result is not None:
-                return cached_result
-        
-        url = f"{self.base_url}/v0/relations/from/{node1_name.lower()}/to/{node2_name.lower()}"
-
-        params = {}
-        if types_ids:
-            params["types_ids"] = types_ids
-        if min_weight:
-            params["min_weight"] = min_weight
-        if max_weight:
-            params["max_weight"] = max_weight
-        if limit:
-            params["limit"] = limit
-
-        if self.logging:
-            print(f"Requête GET: {url} avec params={params}")
-        response = requests.get(url, params=params)
-        if response.status_code != 200:
-            print(f"Erreur {response.status_code}: {response.text}")
-            #return {"nodes": [], "relations": []}
-        
-        result = response.json()
-
-        # Mettre en cache le résultat si le cache est activé
-        if self.use_cache:
-            self.cache.set("get_relations_from_to", result, node1_name=node1_name.lower(), node2_name=node2_name.lower(), types_ids=types_ids, min_weight=min_weight, max_weight=max_weight, limit=limit)
-            
-        return result
+        node1_name = node1_name.lower()
+        node2_name = node2_name.lower()
+        # En cas d'erreur (relation absente), la réponse de l'API est gardée en cache
+        return self._request("get_relations_from_to", f"/v0/relations/from/{node1_name}/to/{node2_name}", self._relation_params(types_ids, min_weight, max_weight, limit),
+                             node1_name=node1_name, node2_name=node2_name, types_ids=types_ids, min_weight=min_weight, max_weight=max_weight, limit=limit)
     
     def get_relation_types(self) -> List[Dict[str, Any]]:
         """
@@ -345,29 +355,8 @@ class JDMClient:
         Returns:
             Liste des types de relations
         """
-        method = "get_relation_types"
-        if self.use_cache:
-            cached = self.cache.get(method)
-            if cached:
-                return cached
-
-        url = f"{self.base_url}/v0/relations_types"
-        print(f"Requête GET: {url}")
-        
-        # Ajouter un délai pour éviter de surcharger l'API
-        time.sleep(0.5)
-        
-        response = requests.get(url)
-        if response.status_code != 200:
-            print(f"Erreur {response.status_code}: {response.text}")
-            return []
-        result = response.json();
-
-        # Mettre en cache le résultat si le cache est activé
-        if self.use_cache:
-            self.cache.set("get_relation_types", result)
-        
-        return result
+        # Délai pour éviter de surcharger l'API
+        return self._request("get_relation_types", "/v0/relations_types", error_result=[], delay=0.5)
 
     def has_relation(self, source: str, target: str, relation_name: str) -> bool:
         """
@@ -394,7 +383,10 @@ logger.setLevel(logging.INFO)
 file_handler = logging.FileHandler(log_file_path, mode='w', encoding='utf-8')
 file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
 logger.addHandler(file_handler)
-logger.addHandler(logging.StreamHandler())
+# Console : avertissements seulement, sauf en mode détaillé
+stream_handler = logging.StreamHandler()
+stream_handler.setLevel(logging.INFO if verbose() else logging.WARNING)
+logger.addHandler(stream_handler)
 
 if __name__ == "__main__":
     # Exemple de test simple pour vérifier le fonctionnement du client
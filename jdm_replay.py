@@ -0,0 +1,245 @@
+"""
+Enregistrement et rejeu des réponses de l'API JDM, pour des mesures reproductibles hors ligne.
+
+Enregistrement : avec JDM_RECORD=fichier.jsonl, chaque JDMClient ajoute au fichier les
+réponses reçues du réseau (une ligne JSON par requête). Les réponses servies par le cache
+ne passent pas par le réseau : enregistrer avec un cache vide (data/cache) pour tout
+capturer. Exemple :
+
+    JDM_RECORD=data/jdm_fixture.jsonl python main.py import
+
+Rejeu : JDMReplayServer sert les réponses enregistrées sur les points d'accès de
+openapi.json utilisés par JDMClient, avec une latence, des erreurs et une limite de débit
+injectées à la demande ; JDM_BASE_URL y redirige les clients :
+
+    python jdm_replay.py --fixture data/jdm_fixture.jsonl --port 8766 --latency 0.05
+    JDM_BASE_URL=http://127.0.0.1:8766 python main.py import
+
+Une requête absente de l'enregistrement reçoit une réponse 404 et est comptée dans
+GET /_replay/stats.
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+# Points d'accès de openapi.json utilisés par JDMClient
+ENDPOINTS = [re.compile(pattern) for pattern in (
+    r"^/v0/node_by_name/[^/]+$",
+    r"^/v0/relations/from/[^/]+$",
+    r"^/v0/relations/to/[^/]+$",
+    r"^/v0/relations/from/[^/]+/to/[^/]+$",
+    r"^/v0/relations_types$",
+)]
+
+def request_key(path: str, params: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Clé d'une requête : chemin décodé et paramètres triés, encodés comme le fait requests
+    (une liste donne un paramètre répété)
+
+    Args:
+        path: Chemin de la requête, sans l'URL de base
+        params: Paramètres de la requête
+    """
+    pairs = []
+    for name, value in (params or {}).items():
+        for item in (value if isinstance(value, (list, tuple)) else [value]):
+            pairs.append((name, str(item)))
+    return _key(urllib.parse.unquote(path), pairs)
+
+def _key(path: str, pairs: List[Tuple[str, str]]) -> str:
+    return f"{path}?{urllib.parse.urlencode(sorted(pairs))}" if pairs else path
+
+class JDMRecorder:
+    def __init__(self, fixture_file: str):
+        """
+        Args:
+            fixture_file: Fichier JSONL des réponses, complété à chaque requête
+        """
+        self.fixture_file = fixture_file
+        self._lock = threading.Lock()
+
+    def record(self, path: str, params: Optional[Dict[str, Any]], status: int, text: str, seconds: float):
+        entry = {"request": request_key(path, params), "status": status, "seconds": round(seconds, 4)}
+        try:
+            entry["body"] = json.loads(text)
+        except ValueError:
+            entry["text"] = text
+        # Une seule écriture par ligne : les processus d'un pool partagent le fichier
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock, open(self.fixture_file, "a", encoding="utf-8") as f:
+            f.write(line)
+
+def load_fixture(fixture_file: str) -> Dict[str, Dict[str, Any]]:
+    """Réponses enregistrées par clé de requête (la dernière l'emporte)"""
+    responses = {}
+    with open(fixture_file, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                responses[entry["request"]] = entry
+    return responses
+
+class JDMReplayServer:
+    def __init__(self, fixture_file: str, host: str = "127.0.0.1", port: int = 8766, latency: float = 0.0, jitter: float = 0.0,
+                 recorded_latency: bool = False, error_rate: float = 0.0, rate_limit: Optional[float] = None, seed: int = 0):
+        """
+        Args:
+            fixture_file: Fichier JSONL des réponses enregistrées
+            host: Adresse d'écoute
+            port: Port d'écoute (0 : port libre choisi par le système)
+            latency: Délai ajouté à chaque réponse (secondes)
+            jitter: Délai aléatoire supplémentaire, entre 0 et `jitter` secondes
+            recorded_latency: Ajouter aussi la durée mesurée lors de l'enregistrement
+            error_rate: Part des requêtes qui reçoivent une erreur 500
+            rate_limit: Requêtes par seconde au-delà desquelles la réponse est 429 (sans limite si None)
+            seed: Graine du tirage des erreurs et des délais aléatoires
+        """
+        self.fixture_file = fixture_file
+        self.responses = load_fixture(fixture_file)
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.recorded_latency = recorded_latency
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.random = random.Random(seed)
+        self.httpd = None
+        self._thread = None
+        self._lock = threading.Lock()
+        # Seau à jetons de la limite de débit (capacité : une seconde de requêtes)
+        self._tokens = rate_limit or 0.0
+        self._refilled = time.monotonic()
+        self._stats = {"requests": 0, "replayed": 0, "missing": 0, "errors": 0, "throttled": 0}
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2] if self.httpd is not None else (self.host, self.port)
+        return f"http://{host}:{port}"
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats)
+
+    def reset_stats(self):
+        with self._lock:
+            for name in self._stats:
+                self._stats[name] = 0
+
+    def _count(self, name: str):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _throttled(self) -> bool:
+        if not self.rate_limit:
+            return False
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.rate_limit, self._tokens + (now - self._refilled) * self.rate_limit)
+            self._refilled = now
+            if self._tokens < 1:
+                return True
+            self._tokens -= 1
+            return False
+
+    def respond(self, path: str, query: str) -> Tuple[int, Any]:
+        """Statut et corps de la réponse à une requête (appelé par les threads du serveur)"""
+        self._count("requests")
+        if self._throttled():
+            self._count("throttled")
+            return 429, {"detail": "Trop de requêtes"}
+        path = urllib.parse.unquote(path)
+        if not any(endpoint.match(path) for endpoint in ENDPOINTS):
+            return 404, {"detail": f"Chemin inconnu : {path}"}
+        entry = self.responses.get(_key(path, urllib.parse.parse_qsl(query, keep_blank_values=True)))
+        with self._lock:
+            delay = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0.0)
+            failed = self.error_rate > 0 and self.random.random() < self.error_rate
+        if entry is not None and self.recorded_latency:
+            delay += entry.get("seconds", 0.0)
+        if delay:
+            time.sleep(delay)
+        if failed:
+            self._count("errors")
+            return 500, {"detail": "Erreur injectée"}
+        if entry is None:
+            self._count("missing")
+            return 404, {"detail": f"Requête absente de l'enregistrement : {path}"}
+        self._count("replayed")
+        return entry["status"], entry["body"] if "body" in entry else entry["text"]
+
+    def _bind(self):
+        self.httpd = ThreadingHTTPServer((self.host, self.port), _ReplayHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.app = self
+
+    def serve_forever(self):
+        self._bind()
+        print(f"Rejeu JDM ({len(self.responses)} réponses) à l'écoute sur {self.url}")
+        try:
+            self.httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.httpd.server_close()
+
+    def start(self) -> "JDMReplayServer":
+        """Lance le serveur dans un thread (mesures, tests) ; arrêt avec shutdown()"""
+        self._bind()
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def shutdown(self):
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+class _ReplayHandler(BaseHTTPRequestHandler):
+    # Connexions persistantes, comme l'API réelle
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, payload: Any):
+        text = payload if isinstance(payload, str) else json.dumps(payload, ensure_ascii=False)
+        body = text.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        if status == 429:
+            self.send_header("Retry-After", "1")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path, _, query = self.path.partition("?")
+        if path == "/_replay/stats":
+            self._send(200, self.server.app.stats())
+        else:
+            self._send(*self.server.app.respond(path, query))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serveur de rejeu des réponses enregistrées de l'API JDM")
+    parser.add_argument("--fixture", default="data/jdm_fixture.jsonl", help="Fichier JSONL enregistré avec JDM_RECORD")
+    parser.add_argument("--host", default="127.0.0.1", help="Adresse d'écoute")
+    parser.add_argument("--port", type=int, default=8766, help="Port d'écoute")
+    parser.add_argument("--latency", type=float, default=0.0, help="Délai ajouté à chaque réponse (secondes)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Délai aléatoire supplémentaire maximal (secondes)")
+    parser.add_argument("--recorded-latency", action="store_true", help="Ajouter la durée mesurée lors de l'enregistrement")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Part des requêtes en erreur 500")
+    parser.add_argument("--rate-limit", type=float, help="Requêtes par seconde au-delà desquelles la réponse est 429")
+    parser.add_argument("--seed", type=int, default=0, help="Graine des erreurs et délais aléatoires")
+    args = parser.parse_args()
+    JDMReplayServer(args.fixture, args.host, args.port, args.latency, args.jitter, args.recorded_latency,
+                    args.error_rate, args.rate_limit, args.seed).serve_forever()
@@ -1,18 +1,40 @@
 import argparse
+import os
+from contextlib import nullcontext
 from story_generator import StoryGenerator
 from story_generalizer import test_all_stories, test_story
 from factoid_extractor import FactoidExtractor
 from story_database import StoryDatabase
 from factoid_predict_1 import FactoidPredict1
 from story_test import StoryTest
+from review_queue import ReviewQueue
+from prediction_server import PredictionServer
+from semantic_index import SemanticIndex, corpus_terms
+from hypernym_index import HypernymIndex, corpus_subjects
+from jdm_client import JDMClient
+import metrics
+from profiling import Profiler
 
-def importer_histoires(input_file="histoires.txt"):
-    generator = StoryGenerator(input_file=input_file)
-    generator.load_and_store_stories()
+def importer_histoires(input_file="histoires.txt", batch_size=32, resume=True, workers=1, mode="force"):
+    generator = StoryGenerator(input_file=input_file, batch_size=batch_size, defer_reviews=(mode == "defer"))
+    generator.load_and_store_stories(resume=resume, workers=workers, force=(mode == "force"))
     print("\nImportation des histoires terminée.")
 
-def generaliser_histoires():
-    test_all_stories()
+def revoir_validations(apply=False):
+    queue = ReviewQueue()
+    if apply:
+        generator = StoryGenerator(defer_reviews=True)
+        result = queue.apply(generator)
+        print(f"\n{result['added']} histoire(s) ajoutée(s), {result['rejected']} rejetée(s), {result['pending']} encore en attente.")
+        return
+    if not queue.pending_terms() and not queue.pending_relations():
+        print("\nAucune décision en attente.")
+        return
+    queue.review_interactively()
+    print("\nDécisions enregistrées. Appliquer avec : python main.py review --apply")
+
+def generaliser_histoires(workers=1):
+    test_all_stories(workers=workers)
     print("\nGénéralisation des histoires terminée.")
 
 def tester_histoire(story_id):
@@ -60,21 +82,84 @@ def prediction_incomplete():
         else:
             print(l)
 
-def prediction_incomplete_from_file():
-    print("\nEntrer le chemin d'accès d'un fichier histoire ('?' pour les trous) (eg 'tests.txt'):")
-    file_path = input()
-    storyTest = StoryTest(test_file = file_path)
-    storyTest.run_all_tests()
+def prediction_incomplete_from_file(file_path=None, workers=1, output_file=None, cache_file=None):
+    if not file_path:
+        print("\nEntrer le chemin d'accès d'un fichier histoire ('?' pour les trous) (eg 'tests.txt'):")
+        file_path = input()
+    storyTest = StoryTest(test_file = file_path, cache_file = cache_file)
+    storyTest.run_all_tests(workers=workers, output_file=output_file)
+
+def construire_index_semantique():
+    StoryDatabase.initialize()
+    index = SemanticIndex().build(corpus_terms(), JDMClient(logging=False))
+    index.save()
+    print(f"\nIndex sémantique construit : {len(index.terms)} termes, {len(index.features)} composantes.")
+
+def construire_index_hyperonymes(max_depth=3):
+    StoryDatabase.initialize()
+    index = HypernymIndex().build(corpus_subjects(), JDMClient(logging=False), max_depth=max_depth)
+    index.save()
+    print(f"\nIndex des hyperonymes construit : {index.term_count} termes, {len(index.ancestor_ids)} liens vers {len(index.names) - index.term_count} ancêtres.")
+
+def construire_instantane():
+    StoryDatabase.stories.clear()
+    StoryDatabase.initialize(use_snapshot=False)
+    counts = StoryDatabase.write_snapshot()
+    print(f"\nInstantané écrit dans {StoryDatabase.snapshot_file} : {counts['stories']} histoires, {counts['factoids']} factoïdes, {counts['strings']} chaînes.")
+
+def compacter_histoires():
+    StoryDatabase.initialize(use_snapshot=False)
+    reclaimed = StoryDatabase.compact_storage()
+    print(f"\nStockage compacté : {reclaimed} octets de versions remplacées récupérés ({len(StoryDatabase.store)} histoires).")
+
+def lancer_serveur(host="127.0.0.1", port=8765, reload_interval=2.0, cache_file=None):
+    server = PredictionServer(host=host, port=port, reload_interval=reload_interval, predictor_kwargs={"include_generalized": True, "cache_file": cache_file})
+    server.serve_forever()
+
+def options_communes(parser: argparse.ArgumentParser, default=None):
+    """Options de toutes les commandes ; `default` à argparse.SUPPRESS pour un sous-analyseur, qui garde la valeur donnée avant la commande"""
+    flag_default = False if default is None else default
+    parser.add_argument("--metrics", default=default, help="Fichier où écrire les mesures en fin de commande (.prom : format Prometheus, JSON sinon)")
+    parser.add_argument("--profile", metavar="FICHIER", default=default, help="Profiler la commande : piles repliées dans FICHIER et temps par étape affiché (échantillonnage)")
+    parser.add_argument("--cprofile", action="store_true", default=flag_default, help="Avec --profile : statistiques cProfile dans FICHIER au lieu de l'échantillonnage (pas de temps par étape)")
+    parser.add_argument("--verbose", action="store_true", default=flag_default, help="Afficher les requêtes JDM et le détail des prédictions")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Interface CLI pour le projet Jeux de Mots")
+    options_communes(parser)
     subparsers = parser.add_subparsers(dest="commande", required=True)
 
-    subparsers.add_parser("import", help="Importer les histoires depuis un fichier texte")
-    subparsers.add_parser("generalize", help="Généraliser toutes les histoires")
+    import_parser = subparsers.add_parser("import", help="Importer les histoires depuis un fichier texte")
+    import_parser.add_argument("--file", default="histoires.txt", help="Fichier d'histoires à importer")
+    import_parser.add_argument("--batch-size", type=int, default=32, help="Nombre d'histoires validées et enregistrées par lot")
+    import_parser.add_argument("--workers", type=int, default=1, help="Nombre de processus d'extraction et de validation")
+    import_parser.add_argument("--mode", choices=["force", "interactive", "defer"], default="force",
+                               help="Termes et relations inconnus de JDM : acceptés (force), demandés (interactive) ou mis en file de revue (defer)")
+    import_parser.add_argument("--restart", action="store_true", help="Ignorer le point de reprise d'une importation interrompue")
+    review_parser = subparsers.add_parser("review", help="Décider des termes et relations en attente de revue")
+    review_parser.add_argument("--apply", action="store_true", help="Appliquer les décisions et revalider les histoires concernées")
+    generalize_parser = subparsers.add_parser("generalize", help="Généraliser toutes les histoires")
+    generalize_parser.add_argument("--workers", type=int, default=1, help="Nombre de processus de généralisation")
     subparsers.add_parser("list", help="Lister toutes les histoires disponibles")
     subparsers.add_parser("predict", help="Compléter une histoire à trous")
-    subparsers.add_parser("predict-from-file", help="Compléter une histoire à trous à partir d'un fichier")
+    pff_parser = subparsers.add_parser("predict-from-file", help="Compléter une histoire à trous à partir d'un fichier")
+    pff_parser.add_argument("--file", help="Fichier d'histoires à trous (demandé si absent)")
+    pff_parser.add_argument("--workers", type=int, default=1, help="Nombre de processus de prédiction")
+    pff_parser.add_argument("--output", help="Fichier JSONL des résultats structurés")
+    pff_parser.add_argument("--cache-file", help="Fichier de persistance du cache de candidats")
+
+    subparsers.add_parser("build-index", help="Construire l'index de similarité sémantique à partir des relations JDM")
+    hypernyms_parser = subparsers.add_parser("build-hypernyms", help="Construire l'index de la fermeture transitive r_isa des sujets du corpus")
+    hypernyms_parser.add_argument("--max-depth", type=int, default=3, help="Nombre maximal de relations r_isa enchaînées")
+
+    subparsers.add_parser("snapshot", help="Compiler la base dans un instantané binaire projeté en mémoire au démarrage")
+    subparsers.add_parser("compact", help="Retirer du stockage des histoires les versions remplacées")
+
+    serve_parser = subparsers.add_parser("serve", help="Lancer le serveur de prédiction (modèles et caches gardés en mémoire)")
+    serve_parser.add_argument("--host", default="127.0.0.1", help="Adresse d'écoute")
+    serve_parser.add_argument("--port", type=int, default=8765, help="Port d'écoute")
+    serve_parser.add_argument("--reload-interval", type=float, default=2.0, help="Intervalle de détection des changements de la base (secondes)")
+    serve_parser.add_argument("--cache-file", help="Fichier de persistance du cache de candidats")
 
     aff_parser = subparsers.add_parser("show", help="Afficher une histoire spécifique")
     aff_parser.add_argument("id", help="ID de l'histoire")
@@ -82,19 +167,45 @@ if __name__ == "__main__":
     test_parser = subparsers.add_parser("test", help="Tester une histoire spécifique")
     test_parser.add_argument("id", help="ID de l'histoire")
 
+    # Options communes acceptées aussi après la commande (main.py import --profile F)
+    for command_parser in subparsers.choices.values():
+        options_communes(command_parser, argparse.SUPPRESS)
+
     args = parser.parse_args()
+    if args.verbose:
+        # Lu par les clients JDM, y compris dans les processus des pools
+        os.environ["JDM_VERBOSE"] = "1"
 
-    if args.commande == "import":
-        importer_histoires()
-    elif args.commande == "generalize":
-        generaliser_histoires()
-    elif args.commande == "list":
-        lister_histoires()
-    elif args.commande == "show":
-        afficher_histoire(args.id)
-    elif args.commande == "test":
-        tester_histoire(args.id)
-    elif args.commande == "predict":
-        prediction_incomplete()
-    elif args.commande == "predict-from-file":
-        prediction_incomplete_from_file()
+    try:
+        with Profiler(args.profile, deterministic=args.cprofile) if args.profile else nullcontext():
+            if args.commande == "import":
+                importer_histoires(args.file, args.batch_size, not args.restart, args.workers, args.mode)
+            elif args.commande == "review":
+                revoir_validations(args.apply)
+            elif args.commande == "generalize":
+                generaliser_histoires(args.workers)
+            elif args.commande == "list":
+                lister_histoires()
+            elif args.commande == "show":
+                afficher_histoire(args.id)
+            elif args.commande == "test":
+                tester_histoire(args.id)
+            elif args.commande == "predict":
+                prediction_incomplete()
+            elif args.commande == "predict-from-file":
+                prediction_incomplete_from_file(args.file, args.workers, args.output, args.cache_file)
+            elif args.commande == "build-index":
+                construire_index_semantique()
+            elif args.commande == "build-hypernyms":
+                construire_index_hyperonymes(args.max_depth)
+            elif args.commande == "snapshot":
+                construire_instantane()
+            elif args.commande == "compact":
+                compacter_histoires()
+            elif args.commande == "serve":
+                lancer_serveur(args.host, args.port, args.reload_interval, args.cache_file)
+    finally:
+        # Aussi après une interruption (Ctrl-C sur serve)
+        if args.metrics:
+            metrics.export(args.metrics)
+            print(f"Mesures écrites dans {args.metrics}")
@@ -0,0 +1,185 @@
+"""
+Mesures légères du pipeline : compteurs et histogrammes de durée, par nom et étiquettes.
+
+Les mesures sont propres au processus. Les pools de processus renvoient celles de leurs
+tâches avec take() et le processus principal les ajoute avec merge(). L'export se fait en
+JSON ou au format texte de Prometheus (main.py --metrics, ou GET /metrics du serveur).
+
+Mesures relevées :
+    jdm_requests_total, jdm_request_seconds           requêtes JDM par méthode (et statut)
+    cache_lookups_total                               accès aux caches, par cache, niveau et résultat
+    consistency_checks_total, consistency_check_seconds   vérifications de cohérence
+    generalization_attempts_total, generalization_seconds  recherches de généralisation
+    prediction_scoring_seconds, prediction_candidates_total   recherche des candidats de prédiction
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# Bornes supérieures des histogrammes (secondes)
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+_lock = threading.Lock()
+_counters: Dict[_Key, float] = {}
+# nom, étiquettes -> [effectifs par borne (+ dépassement), somme, nombre]
+_histograms: Dict[_Key, List[Any]] = {}
+
+def _key(name: str, labels: Dict[str, Any]) -> _Key:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def inc(name: str, value: float = 1, **labels: Any):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+def observe(name: str, seconds: float, **labels: Any):
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [[0] * (len(BUCKETS) + 1), 0.0, 0]
+        counts = histogram[0]
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                counts[i] += 1
+                break
+        else:
+            counts[-1] += 1
+        histogram[1] += seconds
+        histogram[2] += 1
+
+@contextmanager
+def timer(name: str, **labels: Any) -> Iterator[None]:
+    """Mesure la durée du bloc dans l'histogramme `name`"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+def snapshot() -> Dict[str, List[Dict[str, Any]]]:
+    """Mesures courantes, sérialisables en JSON"""
+    with _lock:
+        return _snapshot()
+
+def _snapshot() -> Dict[str, List[Dict[str, Any]]]:
+    counters = [{"name": name, "labels": dict(labels), "value": value} for (name, labels), value in sorted(_counters.items())]
+    histograms = [{"name": name, "labels": dict(labels), "buckets": list(h[0]), "sum": h[1], "count": h[2]}
+                  for (name, labels), h in sorted(_histograms.items())]
+    return {"counters": counters, "histograms": histograms}
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+def take() -> Dict[str, List[Dict[str, Any]]]:
+    """Mesures relevées depuis le dernier appel (processus d'un pool)"""
+    with _lock:
+        data = _snapshot()
+        _counters.clear()
+        _histograms.clear()
+    return data
+
+def merge(data: Dict[str, List[Dict[str, Any]]]):
+    """Ajoute des mesures relevées dans un autre processus (voir take)"""
+    if not data:
+        return
+    with _lock:
+        for counter in data.get("counters", []):
+            key = _key(counter["name"], counter["labels"])
+            _counters[key] = _counters.get(key, 0) + counter["value"]
+        for entry in data.get("histograms", []):
+            key = _key(entry["name"], entry["labels"])
+            histogram = _histograms.get(key)
+            if histogram is None:
+                histogram = _histograms[key] = [[0] * (len(BUCKETS) + 1), 0.0, 0]
+            histogram[0] = [a + b for a, b in zip(histogram[0], entry["buckets"])]
+            histogram[1] += entry["sum"]
+            histogram[2] += entry["count"]
+
+def total(name: str, **labels: Any) -> float:
+    """Somme des compteurs `name` dont les étiquettes contiennent `labels`"""
+    wanted = set(_key(name, labels)[1])
+    with _lock:
+        return sum(value for (key_name, key_labels), value in _counters.items() if key_name == name and wanted <= set(key_labels))
+
+def quantile(name: str, q: float, **labels: Any) -> Optional[float]:
+    """
+    Quantile estimé de l'histogramme `name` (séries dont les étiquettes contiennent `labels`),
+    par interpolation dans la borne atteinte comme histogram_quantile de Prometheus
+
+    Returns:
+        Durée en secondes, ou None sans observation
+    """
+    wanted = set(_key(name, labels)[1])
+    counts = [0] * (len(BUCKETS) + 1)
+    with _lock:
+        for (key_name, key_labels), histogram in _histograms.items():
+            if key_name == name and wanted <= set(key_labels):
+                counts = [a + b for a, b in zip(counts, histogram[0])]
+    count = sum(counts)
+    if not count:
+        return None
+    rank = q * count
+    cumulative = 0
+    for i, bucket_count in enumerate(counts[:-1]):
+        if bucket_count and cumulative + bucket_count >= rank:
+            lower = BUCKETS[i - 1] if i else 0.0
+            return lower + (BUCKETS[i] - lower) * (rank - cumulative) / bucket_count
+        cumulative += bucket_count
+    # Au-delà de la dernière borne
+    return BUCKETS[-1]
+
+def to_json() -> str:
+    return json.dumps({"buckets": list(BUCKETS), **snapshot()}, ensure_ascii=False, indent=2)
+
+def _labels_text(labels: Dict[str, str], extra: str = "") -> str:
+    parts = [f'{k}="{_escape(v)}"' for k, v in labels.items()]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _number_text(value: float) -> str:
+    # Valeur exacte : entière sans exposant, sinon repr (%g arrondit au-delà de six chiffres)
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+def to_prometheus() -> str:
+    """Format texte d'exposition de Prometheus"""
+    data = snapshot()
+    lines = []
+    typed = set()
+    for counter in data["counters"]:
+        if counter["name"] not in typed:
+            lines.append(f"# TYPE {counter['name']} counter")
+            typed.add(counter["name"])
+        lines.append(f"{counter['name']}{_labels_text(counter['labels'])} {_number_text(counter['value'])}")
+    for entry in data["histograms"]:
+        name = entry["name"]
+        if name not in typed:
+            lines.append(f"# TYPE {name} histogram")
+            typed.add(name)
+        cumulative = 0
+        for bound, count in zip(BUCKETS, entry["buckets"]):
+            cumulative += count
+            le = 'le="%g"' % bound
+            lines.append(f"{name}_bucket{_labels_text(entry['labels'], le)} {cumulative}")
+        le = 'le="+Inf"'
+        lines.append(f"{name}_bucket{_labels_text(entry['labels'], le)} {entry['count']}")
+        lines.append(f"{name}_sum{_labels_text(entry['labels'])} {entry['sum']:.6f}")
+        lines.append(f"{name}_count{_labels_text(entry['labels'])} {entry['count']}")
+    return "\n".join(lines) + "\n"
+
+def export(path: str):
+    """Écrit les mesures dans `path` : format Prometheus pour un fichier .prom, JSON sinon"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(to_prometheus() if path.endswith(".prom") else to_json())
@@ -0,0 +1,104 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from story_database import StoryDatabase
+from factoid import Factoid, json_default
+import metrics
+
+class PredictionCache:
+    """
+    Cache LRU des listes de candidats de FactoidPredict1.
+
+    Les clés combinent la direction ('previous' / 'next'), le factoïde de contexte
+    normalisé et les poids de score. Le cache est vidé dès que StoryDatabase change
+    (compteur `generation`) et peut être sauvegardé sur disque entre deux exécutions.
+    """
+
+    def __init__(self, max_size: int = 4096, cache_file: Optional[str] = None):
+        """
+        Args:
+            max_size: Nombre maximal de contextes conservés
+            cache_file: Fichier JSON de persistance (aucune persistance si None)
+        """
+        self.max_size = max_size
+        self.cache_file = cache_file
+        self.entries: "OrderedDict[str, List[Tuple[float, Factoid, str]]]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.generation = StoryDatabase.generation
+        self.hits = 0
+        self.misses = 0
+        if cache_file:
+            self.load()
+
+    @staticmethod
+    def make_key(direction: str, context: Tuple[str, ...], weights: Tuple) -> str:
+        return json.dumps([direction, list(context), list(weights)], ensure_ascii=False)
+
+    def _check_generation(self):
+        if self.generation != StoryDatabase.generation:
+            self.entries.clear()
+            self.generation = StoryDatabase.generation
+
+    def get(self, key: str) -> Optional[List[Tuple[float, Factoid, str]]]:
+        """Retourne une copie des candidats mis en cache, ou None"""
+        with self.lock:
+            self._check_generation()
+            candidates = self.entries.get(key)
+            if candidates is None:
+                self.misses += 1
+                metrics.inc("cache_lookups_total", cache="prediction", tier="memory", result="miss")
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            metrics.inc("cache_lookups_total", cache="prediction", tier="memory", result="hit")
+        # Les candidats sont modifiés par l'appelant : on rend des copies
+        return [(score, factoid.copy(), story_id) for score, factoid, story_id in candidates]
+
+    def set(self, key: str, candidates: List[Tuple[float, Factoid, str]]):
+        with self.lock:
+            self._check_generation()
+            self.entries[key] = [(score, factoid.copy(), story_id) for score, factoid, story_id in candidates]
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def snapshot(self) -> Dict[str, List[Tuple[float, Factoid, str]]]:
+        with self.lock:
+            self._check_generation()
+            return dict(self.entries)
+
+    def update(self, entries: Dict[str, List[Tuple[float, Factoid, str]]]):
+        for key, candidates in entries.items():
+            self.set(key, candidates)
+
+    def save(self):
+        if not self.cache_file:
+            return
+        with self.lock:
+            self._check_generation()
+            data = {
+                "fingerprint": StoryDatabase.fingerprint(),
+                "entries": [[key, [list(c) for c in candidates]] for key, candidates in self.entries.items()]
+            }
+        os.makedirs(os.path.dirname(self.cache_file) or ".", exist_ok=True)
+        with open(self.cache_file, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, default=json_default)
+
+    def load(self):
+        if not self.cache_file or not os.path.exists(self.cache_file):
+            return
+        try:
+            with open(self.cache_file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (json.JSONDecodeError, OSError):
+            return
+        # Cache calculé sur une autre version de la base : ignoré
+        if data.get("fingerprint") != StoryDatabase.fingerprint():
+            return
+        with self.lock:
+            for key, candidates in data.get("entries", []):
+                self.entries[key] = [(score, Factoid.from_dict(factoid), story_id) for score, factoid, story_id in candidates]
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
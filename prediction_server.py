@@ -0,0 +1,212 @@
+"""
+Serveur HTTP local de prédiction.
+
+Le prédicteur (extracteur, client JDM, générateur) et la base d'histoires sont chargés
+une seule fois et restent en mémoire entre les requêtes. La base est rechargée à chaud
+lorsque les fichiers de données changent.
+
+Points d'accès (JSON) :
+    GET  /health   -> état du serveur
+    GET  /metrics  -> mesures au format texte de Prometheus (voir metrics.py)
+    POST /predict  -> {"lines": [...]} ou {"stories": [[...], ...]}
+    POST /check    -> {"lines": [...]} : cohérence de l'histoire avec JDM
+    POST /reload   -> rechargement immédiat de la base
+"""
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from story_database import StoryDatabase
+from factoid_predict_1 import FactoidPredict1
+import metrics
+
+class ReadWriteLock:
+    """
+    Verrou lecteurs/rédacteur : les prédictions sont concurrentes, le rechargement exclusif.
+    Un rédacteur en attente passe avant les nouveaux lecteurs : un flot continu de
+    prédictions ne retarde pas indéfiniment le rechargement.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writing = False
+        self._waiting_writers = 0
+
+    def acquire_read(self):
+        with self._condition:
+            while self._writing or self._waiting_writers:
+                self._condition.wait()
+            self._readers += 1
+
+    def release_read(self):
+        with self._condition:
+            self._readers -= 1
+            if self._readers == 0:
+                self._condition.notify_all()
+
+    def acquire_write(self):
+        with self._condition:
+            self._waiting_writers += 1
+            try:
+                while self._writing or self._readers > 0:
+                    self._condition.wait()
+            finally:
+                self._waiting_writers -= 1
+            self._writing = True
+
+    def release_write(self):
+        with self._condition:
+            self._writing = False
+            self._condition.notify_all()
+
+class PredictionServer:
+    def __init__(self, host: str = "127.0.0.1", port: int = 8765, reload_interval: float = 2.0, predictor_kwargs: Optional[Dict[str, Any]] = None):
+        """
+        Args:
+            host: Adresse d'écoute
+            port: Port d'écoute
+            reload_interval: Intervalle (secondes) de vérification des fichiers de données
+            predictor_kwargs: Paramètres passés à FactoidPredict1
+        """
+        self.host = host
+        self.port = port
+        self.reload_interval = reload_interval
+        self.predictor = FactoidPredict1(**(predictor_kwargs or {"include_generalized": True}))
+        self.lock = ReadWriteLock()
+        self._signature = self._data_signature()
+        self._stop = threading.Event()
+        self.httpd = None
+
+    def _data_signature(self) -> Tuple:
+        """Dates de modification et tailles des fichiers de la base"""
+        paths = [StoryDatabase.store.index_file, StoryDatabase.factoids_file, StoryDatabase.factoids_journal_file, StoryDatabase.valid_terms_file, StoryDatabase.valid_relations_file]
+        signature = []
+        for path in paths:
+            try:
+                stat = os.stat(path)
+                signature.append((path, stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                signature.append((path, None, None))
+        return tuple(signature)
+
+    def reload_if_changed(self, force: bool = False) -> bool:
+        signature = self._data_signature()
+        if not force and signature == self._signature:
+            return False
+
+        self.lock.acquire_write()
+        try:
+            StoryDatabase.stories.clear()
+            StoryDatabase.initialize(StoryDatabase.storage_dir)
+            self._signature = signature
+        finally:
+            self.lock.release_write()
+        print(f"Base rechargée ({len(StoryDatabase.list_stories())} histoires).")
+        return True
+
+    def _watch(self):
+        while not self._stop.wait(self.reload_interval):
+            try:
+                self.reload_if_changed()
+            except Exception as e:
+                print(f"Erreur lors du rechargement de la base : {e}")
+
+    def predict(self, stories: List[List[str]]) -> List[Dict[str, Any]]:
+        self.lock.acquire_read()
+        try:
+            return [self.predictor._predict_story_result(index, lines) for index, lines in enumerate(stories)]
+        finally:
+            self.lock.release_read()
+
+    def check(self, lines: List[str]) -> bool:
+        factoids = [self.predictor.extractor._extract_factoid_components(line) for line in lines if line.strip() != "?"]
+        story = {"id": "check", "domain": "check", "factoids": factoids}
+        self.lock.acquire_read()
+        try:
+            return self.predictor.story_generator.check_story_consistency(story, ignore=True)
+        finally:
+            self.lock.release_read()
+
+    def serve_forever(self):
+        self.httpd = ThreadingHTTPServer((self.host, self.port), _PredictionHandler)
+        self.httpd.app = self
+        watcher = threading.Thread(target=self._watch, daemon=True)
+        watcher.start()
+        print(f"Serveur de prédiction à l'écoute sur http://{self.host}:{self.port}")
+        try:
+            self.httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        self._stop.set()
+        self.predictor.save_cache()
+        if self.httpd is not None:
+            self.httpd.server_close()
+
+class _PredictionHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        # Pas de journalisation par requête : le serveur est appelé très fréquemment
+        pass
+
+    def _send_json(self, status: int, payload: Any):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self) -> Dict[str, Any]:
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        return json.loads(self.rfile.read(length).decode("utf-8"))
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send_json(200, {"status": "ok", "stories": len(StoryDatabase.list_stories())})
+        elif self.path == "/metrics":
+            body = metrics.to_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self._send_json(404, {"error": f"Chemin inconnu : {self.path}"})
+
+    def do_POST(self):
+        try:
+            payload = self._read_json()
+        except (ValueError, UnicodeDecodeError):
+            self._send_json(400, {"error": "Corps JSON invalide"})
+            return
+
+        try:
+            if self.path == "/predict":
+                if "stories" in payload:
+                    self._send_json(200, {"results": self.server.app.predict(payload["stories"])})
+                elif "lines" in payload:
+                    self._send_json(200, self.server.app.predict([payload["lines"]])[0])
+                else:
+                    self._send_json(400, {"error": "Champ 'lines' ou 'stories' attendu"})
+            elif self.path == "/check":
+                if "lines" not in payload:
+                    self._send_json(400, {"error": "Champ 'lines' attendu"})
+                else:
+                    self._send_json(200, {"consistent": self.server.app.check(payload["lines"])})
+            elif self.path == "/reload":
+                self.server.app.reload_if_changed(force=True)
+                self._send_json(200, {"stories": len(StoryDatabase.list_stories())})
+            else:
+                self._send_json(404, {"error": f"Chemin inconnu : {self.path}"})
+        except Exception as e:
+            self._send_json(500, {"error": str(e)})
+
+if __name__ == "__main__":
+    PredictionServer().serve_forever()
@@ -0,0 +1,151 @@
+"""
+Profilage d'une commande de main.py (option --profile).
+
+Par défaut, un échantillonneur relève toutes les `interval` secondes la pile de chaque
+thread du processus : piles repliées dans le fichier demandé (flamegraph.pl, speedscope),
+et répartition du temps entre les étapes du pipeline. Il ne ralentit pas le code
+profilé, si bien que la part du Python et celle des entrées/sorties restent comparables.
+
+Avec --cprofile, cProfile (déterministe, thread principal) remplace l'échantillonneur :
+statistiques par fonction au format pstats (python -m pstats FICHIER, snakeviz...). Son
+coût par appel gonfle les étapes riches en appels Python : aucune répartition par étape
+n'est alors affichée.
+
+Chaque échantillon est attribué à l'étape de la fonction la plus profonde de la pile qui
+en relève (voir STAGES) : un accès JDM fait depuis une vérification de cohérence compte
+pour les entrées/sorties JDM, le reste de la vérification pour la cohérence. Les
+processus des pools (--workers N > 1) ne sont pas relevés : le thread principal y apparaît
+en attente, profiler avec --workers 1 pour le détail.
+"""
+import cProfile
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+# Étape, module (nom du fichier), motif du nom qualifié de la fonction ; la première règle vérifiée l'emporte
+STAGES: List[Tuple[str, str, str]] = [
+    ("persistance", "*", r"(.*\.)?_?(save|write)"),
+    ("cache", "jdm_client.py", r"JDMCache\."),
+    ("cache", "prediction_cache.py", r""),
+    ("cache", "hypernym_index.py", r""),
+    ("cache", "story_generalizer.py", r".*memo"),
+    ("JDM (réseau)", "jdm_client.py", r""),
+    ("analyse", "factoid_extractor.py", r""),
+    ("analyse", "import_pipeline.py", r"ImportPipeline\.(read_stories|_parse_stage)"),
+    ("analyse", "story_generator.py", r"StoryGenerator\._create_story"),
+    ("analyse", "story_test.py", r"StoryTest\._load_stories"),
+    ("cohérence", "story_generator.py", r"StoryGenerator\.(check_|_check_|_unaffected|_evaluate|_resolve|_lookup|_term_found|_relation_found)"),
+    ("score", "factoid_predict_1.py", r"FactoidPredict1\.(_predict_from|_context_score|check_|_beam_fill|_retrieve)"),
+    ("persistance", "story_database.py", r""),
+    ("persistance", "story_store.py", r""),
+    ("persistance", "snapshot.py", r""),
+    ("persistance", "file_lock.py", r""),
+    ("persistance", "review_queue.py", r""),
+]
+
+# Fonction bloquante en bas de pile : thread en attente (file, verrou, pool de threads ou de processus)
+IDLE_MODULES = ("threading.py", "queue.py", "selectors.py", os.path.join("concurrent", "futures", "thread.py"))
+
+_PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+_COMPILED = [(stage, module, re.compile(pattern)) for stage, module, pattern in STAGES]
+
+def _frame_name(code) -> str:
+    return f"{os.path.basename(code.co_filename)}:{getattr(code, 'co_qualname', code.co_name)}"
+
+def _stage(stack: List) -> str:
+    """Étape d'une pile (liste de code objects, du plus profond au plus externe)"""
+    if stack and stack[0].co_filename.endswith(IDLE_MODULES):
+        return "attente"
+    for code in stack:
+        if os.path.dirname(os.path.abspath(code.co_filename)) != _PROJECT_DIR:
+            continue
+        module = os.path.basename(code.co_filename)
+        qualname = getattr(code, "co_qualname", code.co_name)
+        for stage, stage_module, pattern in _COMPILED:
+            if (stage_module == module or stage_module == "*") and pattern.match(qualname):
+                return stage
+    return "autre"
+
+class Profiler:
+    def __init__(self, path: str, interval: float = 0.005, deterministic: bool = False):
+        """
+        Args:
+            path: Fichier des piles repliées, ou des statistiques cProfile si `deterministic`
+            interval: Période d'échantillonnage des piles (secondes)
+            deterministic: Profiler avec cProfile au lieu de l'échantillonneur
+        """
+        self.path = path
+        self.interval = interval
+        self.deterministic = deterministic
+        self.profile = cProfile.Profile() if deterministic else None
+        self.stacks: Counter = Counter()
+        self.stage_samples: Counter = Counter()
+        self.samples = 0
+        self.wall_time = 0.0
+        self._stop = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+        self._start = 0.0
+
+    def __enter__(self) -> "Profiler":
+        self._start = time.perf_counter()
+        if self.deterministic:
+            self.profile.enable()
+        else:
+            self._sampler = threading.Thread(target=self._sample_loop, name="profiler", daemon=True)
+            self._sampler.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self.deterministic:
+            self.profile.disable()
+        else:
+            self._stop.set()
+            self._sampler.join()
+        self.wall_time = time.perf_counter() - self._start
+        self.write()
+        if self.deterministic:
+            print(f"\nProfil : {self.wall_time:.2f} s ; statistiques cProfile dans {self.path}")
+        else:
+            self.print_breakdown()
+
+    def _sample_loop(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(frame.f_code)
+                    frame = frame.f_back
+                self.stacks[";".join(_frame_name(code) for code in reversed(stack))] += 1
+                self.stage_samples[_stage(stack)] += 1
+            self.samples += 1
+
+    def write(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        if self.deterministic:
+            self.profile.dump_stats(self.path)
+            return
+        with open(self.path, "w", encoding="utf-8") as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write(f"{stack} {count}\n")
+
+    def breakdown(self) -> Dict[str, float]:
+        """Temps par étape (secondes cumulées sur les threads), estimé à partir des échantillons"""
+        if not self.samples:
+            return {}
+        period = self.wall_time / self.samples
+        return {stage: count * period for stage, count in self.stage_samples.most_common()}
+
+    def print_breakdown(self):
+        breakdown = self.breakdown()
+        total = sum(breakdown.values())
+        print(f"\nProfil : {self.wall_time:.2f} s, {self.samples} échantillons ; piles repliées dans {self.path}")
+        print("Temps par étape (tous threads) :")
+        for stage, seconds in breakdown.items():
+            print(f"  {stage:<14} {seconds:8.2f} s  {100 * seconds / total:5.1f} %")
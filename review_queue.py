@@ -0,0 +1,125 @@
+"""
+File de revue des termes et relations inconnus de JDM.
+
+En mode différé, l'importation ne pose pas de question : chaque terme ou relation non
+résolu est noté ici avec les histoires qu'il bloque, et l'importation continue. Les
+décisions sont prises ensuite en une seule fois (main.py review), puis appliquées
+(main.py review --apply) : seules les histoires concernées sont revalidées.
+"""
+import json
+import os
+from typing import Any, Dict, List, Tuple
+from story_database import StoryDatabase
+from factoid import json_default
+
+class ReviewQueue:
+    def __init__(self, queue_file: str = "data/review_queue.json"):
+        self.queue_file = queue_file
+        self.terms: Dict[str, Dict[str, Any]] = {}
+        self.relations: Dict[str, Dict[str, Any]] = {}
+        self.stories: Dict[str, Dict[str, Any]] = {}
+        self.load()
+
+    @staticmethod
+    def relation_key(relation_type: str, node1: str, node2: str) -> str:
+        return f"{relation_type}|{node1}|{node2}"
+
+    def load(self):
+        if not os.path.exists(self.queue_file):
+            return
+        with open(self.queue_file, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        self.terms = data.get("terms", {})
+        self.relations = data.get("relations", {})
+        self.stories = data.get("stories", {})
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.queue_file) or ".", exist_ok=True)
+        tmp_file = self.queue_file + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump({"terms": self.terms, "relations": self.relations, "stories": self.stories}, f, ensure_ascii=False, indent=4, default=json_default)
+        os.replace(tmp_file, self.queue_file)
+
+    def add_story(self, story: Dict[str, Any], terms: List[str], relations: List[Tuple[str, str, str]]):
+        """Met une histoire en attente des décisions sur ses termes et relations non résolus"""
+        story_id = story["id"]
+        self.stories[story_id] = story
+        for term in terms:
+            entry = self.terms.setdefault(term, {"stories": [], "decision": None})
+            if story_id not in entry["stories"]:
+                entry["stories"].append(story_id)
+        for relation_type, node1, node2 in relations:
+            entry = self.relations.setdefault(self.relation_key(relation_type, node1, node2), {
+                "relation": relation_type, "node1": node1, "node2": node2, "stories": [], "decision": None
+            })
+            if story_id not in entry["stories"]:
+                entry["stories"].append(story_id)
+
+    def pending_terms(self) -> List[str]:
+        return [term for term, entry in self.terms.items() if entry["decision"] is None]
+
+    def pending_relations(self) -> List[str]:
+        return [key for key, entry in self.relations.items() if entry["decision"] is None]
+
+    def decide_term(self, term: str, accept: bool):
+        self.terms[term]["decision"] = accept
+
+    def decide_relation(self, key: str, accept: bool):
+        self.relations[key]["decision"] = accept
+
+    def review_interactively(self):
+        """Demande une décision pour chaque terme et relation en attente (ligne vide : plus tard)"""
+        for term in self.pending_terms():
+            blocked = len(self.terms[term]["stories"])
+            resp = input(f'Terme "{term}" ({blocked} histoire(s)) : ajouter aux termes valides ? (o/n) ').strip().lower()
+            if resp in ("o", "n"):
+                self.decide_term(term, resp == "o")
+        for key in self.pending_relations():
+            entry = self.relations[key]
+            resp = input(f'Relation {entry["relation"]}({entry["node1"]}, {entry["node2"]}) ({len(entry["stories"])} histoire(s)) : acceptable ? (o/n) ').strip().lower()
+            if resp in ("o", "n"):
+                self.decide_relation(key, resp == "o")
+        self.save()
+
+    def apply(self, generator) -> Dict[str, int]:
+        """
+        Applique les décisions prises : enregistre les termes et relations acceptés, écarte
+        les histoires bloquées par un refus et revalide les histoires débloquées.
+
+        Args:
+            generator: StoryGenerator utilisé pour la revalidation (en mode différé)
+
+        Returns:
+            Nombre d'histoires ajoutées, rejetées et encore en attente
+        """
+        StoryDatabase.add_valid_terms([term for term, entry in self.terms.items() if entry["decision"]])
+        StoryDatabase.add_valid_relations([(e["relation"], e["node1"], e["node2"]) for e in self.relations.values() if e["decision"]])
+
+        blockers: Dict[str, List[Any]] = {story_id: [] for story_id in self.stories}
+        for entry in list(self.terms.values()) + list(self.relations.values()):
+            for story_id in entry["stories"]:
+                if story_id in blockers:
+                    blockers[story_id].append(entry["decision"])
+
+        rejected = [story_id for story_id, decisions in blockers.items() if False in decisions]
+        ready = [story_id for story_id, decisions in blockers.items() if False not in decisions and None not in decisions]
+        stories = [self.stories.pop(story_id) for story_id in ready]
+        for story_id in rejected:
+            del self.stories[story_id]
+
+        # Les histoires débloquées sont retirées de la file ; celles qui restent bloquées y reviennent
+        self._forget_stories(set(ready) | set(rejected))
+        verdicts = generator.check_stories_consistency(stories)
+        StoryDatabase.add_stories([story for story, consistent in zip(stories, verdicts) if consistent])
+        for story, terms, relations in generator.take_pending_reviews():
+            self.add_story(story, terms, relations)
+        self.save()
+
+        return {"added": sum(verdicts), "rejected": len(rejected), "pending": len(self.stories)}
+
+    def _forget_stories(self, story_ids: set):
+        for items in (self.terms, self.relations):
+            for key in list(items):
+                items[key]["stories"] = [s for s in items[key]["stories"] if s not in story_ids]
+                if not items[key]["stories"]:
+                    del items[key]
@@ -0,0 +1,189 @@
+"""
+Index de similarité sémantique entre les termes du corpus.
+
+Chaque terme est représenté par un vecteur creux construit hors ligne à partir de ses
+relations JDM sortantes (r_isa, r_syn, r_agent-1, ...) : une composante par nœud voisin,
+pondérée par le poids des relations, plus une composante pour le terme lui-même. Les
+vecteurs sont normalisés et stockés sous forme de matrice CSR compacte ; la similarité
+est un cosinus, calculé sans accès réseau.
+"""
+import json
+import math
+import os
+import time
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+from jdm_client import JDMClient
+from story_database import StoryDatabase
+
+class SemanticIndex:
+    DEFAULT_RELATIONS = ["r_isa", "r_syn", "r_agent-1", "r_hypo", "r_masc", "r_fem"]
+
+    def __init__(self, index_file: str = "data/semantic_index.json"):
+        self.index_file = index_file
+        self.relations: List[str] = []
+        self.built_at: float = 0.0
+        self.terms: List[str] = []
+        self.term_ids: Dict[str, int] = {}
+        self.features: List[str] = []
+        # Matrice CSR : la ligne i occupe indices/data[indptr[i]:indptr[i + 1]]
+        self.indptr = array("l", [0])
+        self.indices = array("l")
+        self.data = array("d")
+        self._rows: Dict[int, Dict[int, float]] = {}
+        self._postings: Optional[Dict[int, List[Tuple[int, float]]]] = None
+        self._similarities: Dict[Tuple[int, int], float] = {}
+
+    # Nombre maximal de similarités gardées en mémoire (serveur de prédiction de longue durée)
+    MAX_CACHED_SIMILARITIES = 100000
+
+    def build(self, terms: Iterable[str], jdm: JDMClient, relations: Optional[List[str]] = None, min_weight: int = 5) -> "SemanticIndex":
+        """
+        Construit les vecteurs des termes à partir des relations JDM (servies par le cache du client)
+
+        Args:
+            terms: Termes du corpus
+            jdm: Client JDM
+            relations: Types de relations sortantes utilisés
+            min_weight: Poids minimum des relations
+        """
+        self.relations = relations or self.DEFAULT_RELATIONS
+        self.terms = sorted({t.lower() for t in terms if t})
+        self.term_ids = {t: i for i, t in enumerate(self.terms)}
+        feature_ids: Dict[str, int] = {}
+        self.features = []
+        self.indptr = array("l", [0])
+        self.indices = array("l")
+        self.data = array("d")
+
+        for term in self.terms:
+            weights: Dict[str, float] = {}
+            for relation in self.relations:
+                relation_id = jdm.relation_type_ids.get(relation)
+                if relation_id is None:
+                    continue
+                result = jdm.get_relations_from(term, types_ids=[relation_id], min_weight=min_weight)
+                if not result or not result.get("relations"):
+                    continue
+                names = {node.get("id"): node.get("name") for node in result.get("nodes", [])}
+                for rel in result["relations"]:
+                    name = names.get(rel.get("node2"))
+                    if not name or name == term or rel.get("w", 0) <= 0:
+                        continue
+                    weights[name] = weights.get(name, 0.0) + math.log1p(rel["w"])
+
+            # Le terme lui-même est une composante : 'serveuse' -r_masc-> 'serveur' rapproche les deux termes
+            weights[term] = max(weights.values(), default=1.0)
+
+            norm = math.sqrt(sum(v * v for v in weights.values()))
+            row = sorted((feature_ids.setdefault(name, len(feature_ids)), value / norm) for name, value in weights.items())
+            for feature_id, value in row:
+                self.indices.append(feature_id)
+                self.data.append(value)
+            self.indptr.append(len(self.indices))
+
+        self.features = [None] * len(feature_ids)
+        for name, feature_id in feature_ids.items():
+            self.features[feature_id] = name
+        self.built_at = time.time()
+        self._reset_lookups()
+        return self
+
+    def _reset_lookups(self):
+        self._rows = {}
+        self._postings = None
+        self._similarities = {}
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.index_file) or ".", exist_ok=True)
+        with open(self.index_file, "w", encoding="utf-8") as f:
+            json.dump({
+                "relations": self.relations,
+                "built_at": self.built_at,
+                "terms": self.terms,
+                "features": self.features,
+                "indptr": list(self.indptr),
+                "indices": list(self.indices),
+                "data": list(self.data)
+            }, f, ensure_ascii=False)
+
+    def load(self) -> bool:
+        if not os.path.exists(self.index_file):
+            return False
+        with open(self.index_file, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        self.relations = data["relations"]
+        self.built_at = data["built_at"]
+        self.terms = data["terms"]
+        self.term_ids = {t: i for i, t in enumerate(self.terms)}
+        self.features = data["features"]
+        self.indptr = array("l", data["indptr"])
+        self.indices = array("l", data["indices"])
+        self.data = array("d", data["data"])
+        self._reset_lookups()
+        return True
+
+    def _row(self, term_id: int) -> Dict[int, float]:
+        row = self._rows.get(term_id)
+        if row is None:
+            start, end = self.indptr[term_id], self.indptr[term_id + 1]
+            row = dict(zip(self.indices[start:end], self.data[start:end]))
+            self._rows[term_id] = row
+        return row
+
+    def similarity(self, term1: str, term2: str) -> float:
+        """Cosinus entre deux termes (0 si l'un d'eux n'est pas indexé)"""
+        if term1 == term2:
+            return 1.0
+        id1 = self.term_ids.get(term1.lower())
+        id2 = self.term_ids.get(term2.lower())
+        if id1 is None or id2 is None:
+            return 0.0
+        key = (id1, id2) if id1 < id2 else (id2, id1)
+        value = self._similarities.get(key)
+        if value is None:
+            row1, row2 = self._row(id1), self._row(id2)
+            if len(row1) > len(row2):
+                row1, row2 = row2, row1
+            value = sum(v * row2.get(f, 0.0) for f, v in row1.items())
+            if len(self._similarities) >= self.MAX_CACHED_SIMILARITIES:
+                self._similarities = {}
+            self._similarities[key] = value
+        return value
+
+    def nearest(self, term: str, k: int = 5, min_similarity: float = 0.0) -> List[Tuple[str, float]]:
+        """Les k termes les plus proches (recherche exacte sur l'index inversé)"""
+        term_id = self.term_ids.get(term.lower())
+        if term_id is None:
+            return []
+        if self._postings is None:
+            self._postings = {}
+            for row_id in range(len(self.terms)):
+                for feature_id, value in self._row(row_id).items():
+                    self._postings.setdefault(feature_id, []).append((row_id, value))
+
+        scores: Dict[int, float] = {}
+        for feature_id, value in self._row(term_id).items():
+            for row_id, other in self._postings.get(feature_id, []):
+                if row_id != term_id:
+                    scores[row_id] = scores.get(row_id, 0.0) + value * other
+
+        best = sorted(((self.terms[i], s) for i, s in scores.items() if s >= min_similarity), key=lambda x: x[1], reverse=True)
+        return best[:k]
+
+def corpus_terms() -> List[str]:
+    """Termes distincts des histoires de StoryDatabase (hors termes généralisés '(...)')"""
+    terms = set()
+    for story_id in StoryDatabase.list_stories():
+        for factoid in StoryDatabase.get_story(story_id).get("factoids", []):
+            for role in ("subject", "predicate", "object", "location", "time"):
+                term = factoid.get(role)
+                if term and not term.startswith("("):
+                    terms.add(term.lower())
+    return sorted(terms)
+
+if __name__ == "__main__":
+    StoryDatabase.initialize()
+    index = SemanticIndex().build(corpus_terms(), JDMClient(logging=False))
+    index.save()
+    print(f"Index sémantique : {len(index.terms)} termes, {len(index.features)} composantes.")
@@ -0,0 +1,352 @@
+"""
+Instantané binaire de la base d'histoires, projeté en mémoire (mmap) au chargement.
+
+`main.py snapshot` compile les histoires, les factoïdes, les termes et les relations valides
+dans un seul fichier versionné : une table des chaînes et des colonnes typées d'entiers
+(identifiants de chaînes, bornes des histoires). Au chargement, le fichier est projeté en
+lecture seule : l'ouverture ne dépend pas de la taille de la base, les pages sont partagées
+par tous les processus qui l'ouvrent et les histoires ne sont décodées qu'à la demande.
+
+L'instantané mémorise la signature des fichiers dont il est issu ; s'ils ont changé depuis
+(importation, généralisation...), il est ignoré et la base est relue depuis ces fichiers.
+"""
+import json
+import mmap
+import os
+import struct
+from array import array
+from collections.abc import MutableMapping
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+MAGIC = b"JDMSNAP1"
+VERSION = 1
+
+# Codage d'un rôle de factoïde absent ou à None dans les colonnes de termes
+_ABSENT = -1
+_NONE = -2
+
+ROLES = ("subject", "predicate", "object", "location", "time")
+# Champs des factoïdes stockés en colonnes, dans l'ordre des fichiers JSON
+FIELDS = ("original_sentence", "story_id", "id")
+# Groupes de factoïdes de StoryDatabase.factoids
+GROUPS = ("generalized", "not_generalized")
+
+class _Writer:
+    def __init__(self):
+        self.strings: Dict[str, int] = {}
+        self.columns: Dict[str, array] = {}
+
+    def string(self, value: str) -> int:
+        string_id = self.strings.get(value)
+        if string_id is None:
+            string_id = len(self.strings)
+            self.strings[value] = string_id
+        return string_id
+
+    def column(self, name: str, typecode: str = "i") -> array:
+        if name not in self.columns:
+            self.columns[name] = array(typecode)
+        return self.columns[name]
+
+    def term(self, factoid: Dict[str, Any], role: str) -> int:
+        if role not in factoid:
+            return _ABSENT
+        value = factoid[role]
+        return _NONE if value is None else self.string(value)
+
+    def optional(self, value: Any) -> int:
+        """Chaîne facultative (-1 si absente) ; les autres valeurs sont encodées en JSON"""
+        if value is None:
+            return _ABSENT
+        return self.string(value if isinstance(value, str) else json.dumps(value, ensure_ascii=False))
+
+    def add_factoids(self, prefix: str, factoids: List[Dict[str, Any]], with_stories: bool):
+        for factoid in factoids:
+            for role in ROLES:
+                self.column(f"{prefix}.{role}").append(self.term(factoid, role))
+            for field in FIELDS:
+                self.column(f"{prefix}.{field}").append(self.string(json.dumps(factoid[field], ensure_ascii=False)) if field in factoid else _ABSENT)
+            extra = {k: v for k, v in factoid.items() if k not in ROLES and k not in FIELDS and not (with_stories and k == "stories_id")}
+            self.column(f"{prefix}.extra").append(self.optional(extra or None))
+            if with_stories:
+                stories_id = self.column(f"{prefix}.stories_id")
+                stories_id.extend(self.string(story_id) for story_id in factoid.get("stories_id", []))
+                self.column(f"{prefix}.stories_ptr", "q").append(len(stories_id))
+
+def build_snapshot(path: str, stories: Dict[str, Dict], factoids: Dict[str, List], valid_terms: List[str],
+                   valid_relations: Dict[str, List[Dict[str, str]]], signature: List) -> Dict[str, int]:
+    """
+    Écrit l'instantané de la base (écriture atomique). Retourne le nombre d'éléments par section.
+
+    Args:
+        path: Fichier de l'instantané
+        signature: Signature des fichiers sources (voir StoryDatabase.source_signature)
+    """
+    writer = _Writer()
+    writer.column("story.factoid_ptr", "q").append(0)
+    for story_id, story in stories.items():
+        writer.column("story.id").append(writer.string(story_id))
+        writer.column("story.domain").append(writer.optional(story.get("domain")))
+        writer.column("story.generalized", "b").append(1 if story.get("generalized") else 0)
+        extra = {k: v for k, v in story.items() if k not in ("id", "domain", "factoids", "generalized")}
+        writer.column("story.extra").append(writer.optional(extra or None))
+        writer.add_factoids("story_factoid", story.get("factoids", []), with_stories=False)
+        writer.column("story.factoid_ptr", "q").append(len(writer.column("story_factoid.subject")))
+
+    for group in GROUPS:
+        writer.column(f"{group}.stories_ptr", "q").append(0)
+        writer.add_factoids(group, factoids.get(group, []), with_stories=True)
+        writer.column(f"{group}.subject")
+
+    for term in valid_terms:
+        writer.column("valid_term").append(writer.string(term))
+    for relation_type, relations in valid_relations.items():
+        for relation in relations:
+            writer.column("valid_relation.type").append(writer.string(relation_type))
+            writer.column("valid_relation.node1").append(writer.string(relation["node1"]))
+            writer.column("valid_relation.node2").append(writer.string(relation["node2"]))
+    # Types de relations sans relation : gardés pour reproduire le dictionnaire
+    writer.column("valid_relation.types").extend(writer.string(t) for t in valid_relations)
+
+    blob = bytearray()
+    string_ptr = array("q", [0])
+    for value in writer.strings:
+        blob += value.encode("utf-8")
+        string_ptr.append(len(blob))
+    columns = {"strings.ptr": string_ptr, **writer.columns}
+
+    sections = {}
+    offset = 0
+    for name, column in columns.items():
+        sections[name] = {"offset": offset, "typecode": column.typecode, "length": len(column)}
+        offset += _aligned(len(column) * column.itemsize)
+    sections["strings.data"] = {"offset": offset, "typecode": "B", "length": len(blob)}
+    header = json.dumps({"version": VERSION, "signature": signature, "stories": len(stories), "sections": sections}).encode("utf-8")
+    data_start = _aligned(len(MAGIC) + 4 + len(header))
+
+    tmp_file = path + ".tmp"
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(tmp_file, "wb") as f:
+        f.write(MAGIC + struct.pack("<I", len(header)) + header)
+        f.write(b"\0" * (data_start - f.tell()))
+        for name, column in columns.items():
+            raw = column.tobytes()
+            f.write(raw + b"\0" * (_aligned(len(raw)) - len(raw)))
+        f.write(bytes(blob))
+    os.replace(tmp_file, path)
+    return {"stories": len(stories), "factoids": sum(len(factoids.get(g, [])) for g in GROUPS), "strings": len(writer.strings)}
+
+def _aligned(size: int) -> int:
+    return (size + 7) // 8 * 8
+
+class Snapshot:
+    """Lecture d'un instantané projeté en mémoire ; les chaînes sont décodées à la demande"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+        if bytes(view[:len(MAGIC)]) != MAGIC:
+            raise ValueError(f"{path} n'est pas un instantané de la base")
+        header_len = struct.unpack_from("<I", self._mmap, len(MAGIC))[0]
+        header_start = len(MAGIC) + 4
+        self.header = json.loads(bytes(view[header_start:header_start + header_len]).decode("utf-8"))
+        self.version = self.header["version"]
+        self.signature = self.header["signature"]
+        self.story_count = self.header["stories"]
+        data_start = _aligned(header_start + header_len)
+        self._columns = {}
+        for name, section in self.header["sections"].items():
+            start = data_start + section["offset"]
+            itemsize = array(section["typecode"]).itemsize
+            self._columns[name] = view[start:start + section["length"] * itemsize].cast(section["typecode"])
+        self._strings: Dict[int, str] = {}
+        self._story_ids: Optional[List[str]] = None
+        self._story_rows: Optional[Dict[str, int]] = None
+
+    @staticmethod
+    def open(path: str, signature: List) -> Optional["Snapshot"]:
+        """Ouvre l'instantané s'il existe, est de la version courante et correspond à `signature`"""
+        if not os.path.exists(path):
+            return None
+        try:
+            snapshot = Snapshot(path)
+        except (ValueError, OSError, KeyError):
+            return None
+        if snapshot.version != VERSION or snapshot.signature != signature:
+            return None
+        return snapshot
+
+    def column(self, name: str) -> memoryview:
+        return self._columns.get(name, memoryview(b"").cast("i"))
+
+    def string(self, string_id: int) -> str:
+        value = self._strings.get(string_id)
+        if value is None:
+            ptr = self._columns["strings.ptr"]
+            value = bytes(self._columns["strings.data"][ptr[string_id]:ptr[string_id + 1]]).decode("utf-8")
+            self._strings[string_id] = value
+        return value
+
+    def _json(self, string_id: int) -> Any:
+        return json.loads(self.string(string_id))
+
+    def __len__(self) -> int:
+        return self.story_count
+
+    def story_ids(self) -> List[str]:
+        if self._story_ids is None:
+            self._story_ids = [self.string(string_id) for string_id in self.column("story.id")]
+        return self._story_ids
+
+    def has_story(self, story_id: str) -> bool:
+        return self.story_row(story_id) is not None
+
+    def read_story(self, story_id: str) -> Dict[str, Any]:
+        row = self.story_row(story_id)
+        if row is None:
+            raise KeyError(story_id)
+        return self.story(row)
+
+    def story_row(self, story_id: str) -> Optional[int]:
+        if self._story_rows is None:
+            self._story_rows = {story_id: row for row, story_id in enumerate(self.story_ids())}
+        return self._story_rows.get(story_id)
+
+    def _factoid(self, prefix: str, row: int) -> Dict[str, Any]:
+        factoid = {}
+        for role in ROLES:
+            value = self.column(f"{prefix}.{role}")[row]
+            if value != _ABSENT:
+                factoid[role] = None if value == _NONE else self.string(value)
+        for field in FIELDS:
+            value = self.column(f"{prefix}.{field}")[row]
+            if value != _ABSENT:
+                factoid[field] = self._json(value)
+        extra = self.column(f"{prefix}.extra")[row]
+        if extra != _ABSENT:
+            factoid.update(self._json(extra))
+        return factoid
+
+    def story(self, row: int) -> Dict[str, Any]:
+        ptr = self.column("story.factoid_ptr")
+        story = {"id": self.string(self.column("story.id")[row])}
+        domain = self.column("story.domain")[row]
+        if domain != _ABSENT:
+            story["domain"] = self.string(domain)
+        story["factoids"] = [self._factoid("story_factoid", i) for i in range(ptr[row], ptr[row + 1])]
+        story["generalized"] = bool(self.column("story.generalized")[row])
+        extra = self.column("story.extra")[row]
+        if extra != _ABSENT:
+            story.update(self._json(extra))
+        return story
+
+    def factoids(self, group: str) -> List[Dict[str, Any]]:
+        stories_ptr = self.column(f"{group}.stories_ptr")
+        stories_id = self.column(f"{group}.stories_id")
+        factoids = []
+        for row in range(len(self.column(f"{group}.subject"))):
+            factoid = self._factoid(group, row)
+            factoid["stories_id"] = [self.string(stories_id[i]) for i in range(stories_ptr[row], stories_ptr[row + 1])]
+            factoids.append(factoid)
+        return factoids
+
+    def valid_terms(self) -> List[str]:
+        return [self.string(string_id) for string_id in self.column("valid_term")]
+
+    def valid_relations(self) -> Dict[str, List[Dict[str, str]]]:
+        relations = {self.string(string_id): [] for string_id in self.column("valid_relation.types")}
+        for relation_type, node1, node2 in zip(self.column("valid_relation.type"), self.column("valid_relation.node1"), self.column("valid_relation.node2")):
+            relations[self.string(relation_type)].append({"node1": self.string(node1), "node2": self.string(node2)})
+        return relations
+
+class LazyStoryMap(MutableMapping):
+    """
+    Dictionnaire identifiant -> histoire adossé à une source (instantané ou StoryStore) : une
+    histoire n'est décodée qu'au premier accès ; les ajouts et suppressions restent en mémoire.
+    La source fournit story_ids(), has_story(), read_story() et len().
+    """
+
+    def __init__(self, source, decode=None):
+        """
+        Args:
+            source: Instantané ouvert ou StoryStore
+            decode: Fonction appliquée à chaque histoire décodée (conversion des factoïdes)
+        """
+        self._source = source
+        self._decode = decode
+        self._loaded: Dict[str, Dict] = {}
+        self._added: Dict[str, Dict] = {}
+        self._removed: set = set()
+
+    @property
+    def source(self):
+        return self._source
+
+    def evict(self, story_ids: Iterable[str]):
+        """
+        Oublie les histoires décodées ou ajoutées, relues dans la source au prochain accès.
+        La source doit contenir leur dernière version (StoryStore après flush).
+        """
+        for story_id in story_ids:
+            if self._source is not None and self._source.has_story(story_id):
+                self._added.pop(story_id, None)
+                self._loaded.pop(story_id, None)
+
+    def _in_source(self, story_id: object) -> bool:
+        return self._source is not None and story_id not in self._removed and self._source.has_story(story_id)
+
+    def __getitem__(self, story_id: str) -> Dict:
+        if story_id in self._added:
+            return self._added[story_id]
+        if story_id in self._loaded:
+            return self._loaded[story_id]
+        if not self._in_source(story_id):
+            raise KeyError(story_id)
+        story = self._source.read_story(story_id)
+        if self._decode is not None:
+            story = self._decode(story)
+        self._loaded[story_id] = story
+        return story
+
+    def __contains__(self, story_id: object) -> bool:
+        return story_id in self._added or story_id in self._loaded or self._in_source(story_id)
+
+    def __setitem__(self, story_id: str, story: Dict):
+        self._removed.discard(story_id)
+        if story_id not in self._added and self._in_source(story_id):
+            self._loaded[story_id] = story
+        else:
+            self._added[story_id] = story
+
+    def __delitem__(self, story_id: str):
+        if story_id not in self:
+            raise KeyError(story_id)
+        self._added.pop(story_id, None)
+        self._loaded.pop(story_id, None)
+        if self._source is not None and self._source.has_story(story_id):
+            self._removed.add(story_id)
+
+    def __iter__(self) -> Iterator[str]:
+        # Une source modifiable (StoryStore) peut déjà contenir les histoires ajoutées
+        if self._source is not None:
+            for story_id in self._source.story_ids():
+                if story_id not in self._removed:
+                    yield story_id
+        for story_id in list(self._added):
+            if self._source is None or not self._source.has_story(story_id):
+                yield story_id
+
+    def __len__(self) -> int:
+        if self._source is None:
+            return len(self._added)
+        removed = sum(1 for story_id in self._removed if self._source.has_story(story_id))
+        added = sum(1 for story_id in self._added if not self._source.has_story(story_id))
+        return len(self._source) - removed + added
+
+    def clear(self):
+        self._source = None
+        self._loaded.clear()
+        self._added.clear()
+        self._removed.clear()
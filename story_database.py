@@ -1,83 +1,507 @@
 import os
 import json
-from typing import List, Dict, Optional
+import hashlib
+import threading
+from contextlib import contextmanager, nullcontext
+from typing import Any, List, Dict, Optional, Tuple
+from factoid import Factoid, json_default, to_factoids
+from file_lock import FileLock
+from snapshot import LazyStoryMap, Snapshot, build_snapshot
+from story_store import StoryStore
 
 class StoryDatabase:
+    # Les factoïdes des histoires et des listes ci-dessous sont des Factoid (termes internés),
+    # convertis en dictionnaires uniquement à l'écriture des fichiers JSON
     stories: Dict[str, Dict] = {}
-    factoids: Dict[str, List[Dict]] = {"generalized": [], "not_generalized": []}
+    factoids: Dict[str, List[Factoid]] = {"generalized": [], "not_generalized": []}
     valid_terms: List[str] = []
     valid_relations: Dict[str, List[Dict[str, str]]] = {}
 
     storage_dir: str = "data/stories"
     factoids_file: str = "data/factoids.json"
+    # Histoires dont les factoïdes ont changé depuis la dernière écriture de factoids_file (une par ligne)
+    factoids_journal_file: str = "data/factoids.journal.jsonl"
     valid_terms_file: str = "data/valid_terms.json"
     valid_relations_file: str = "data/valid_relations.json"
+    content_hashes_file: str = "data/story_hashes.json"
+    snapshot_file: str = "data/snapshot.bin"
+    lock_file: str = "data/story_database.lock"
+
+    # Empreinte du contenu normalisé de chaque histoire importée (voir story_hash)
+    content_hashes: Dict[str, str] = {}
+
+    # Index des factoïdes par contenu, reconstruit après chaque chargement
+    _factoid_index: Dict[str, Dict[tuple, Dict]] = {}
+
+    # Incrémenté à chaque modification des histoires (voir PredictionCache)
+    generation: int = 0
+    # (génération, empreinte) : voir fingerprint
+    _fingerprint: Optional[Tuple[int, str]] = None
+
+    # Segment et index des histoires (voir story_store.py)
+    store: Optional[StoryStore] = None
+
+    # Instantané à jour ouvert par initialize (voir snapshot.py) et sections pas encore décodées
+    _snapshot: Optional[Snapshot] = None
+    _lazy_sections: set = set()
+    # Décodage d'une section par un seul thread (serveur de prédiction)
+    _sections_lock = threading.Lock()
+
+    # Verrou entre processus (voir transaction) et état des fichiers lors de notre dernière lecture ou écriture
+    _lock: Optional[FileLock] = None
+    _disk_state: Dict[str, Any] = {}
 
     @staticmethod
-    def initialize(storage_dir: str = "data/stories"):
+    def initialize(storage_dir: str = "data/stories", use_snapshot: bool = True):
         StoryDatabase.storage_dir = storage_dir
         os.makedirs(storage_dir, exist_ok=True)
-        StoryDatabase.load_all_stories()
-        StoryDatabase.load_all_factoids()
-        StoryDatabase.load_valid_terms()
-        StoryDatabase.load_valid_relations()
+        # Sous verrou : aucune écriture d'un autre processus n'est vue à moitié
+        with StoryDatabase._file_lock():
+            # Index des histoires lu au premier accès : inutile si l'instantané est à jour
+            StoryDatabase.open_store(migrate=False)
+            snapshot = Snapshot.open(StoryDatabase.snapshot_file, StoryDatabase.source_signature()) if use_snapshot else None
+            if snapshot is None:
+                StoryDatabase.migrate_legacy_files()
+            StoryDatabase._remember(*StoryDatabase._tracked_files())
+            StoryDatabase._snapshot = snapshot
+            if snapshot is not None:
+                # Lecture à la demande : les histoires à leur premier accès, les autres sections au premier usage
+                StoryDatabase.stories = LazyStoryMap(snapshot, decode=StoryDatabase._decode_story)
+                StoryDatabase._lazy_sections = {"factoids", "valid_terms", "valid_relations", "content_hashes"}
+                StoryDatabase._factoid_index = {}
+            else:
+                StoryDatabase._lazy_sections = set()
+                StoryDatabase.load_all_stories()
+                StoryDatabase.load_all_factoids()
+                StoryDatabase.load_valid_terms()
+                StoryDatabase.load_valid_relations()
+                StoryDatabase.load_content_hashes()
+        StoryDatabase.generation += 1
+
+    @staticmethod
+    def _file_lock() -> FileLock:
+        if StoryDatabase._lock is None or StoryDatabase._lock.path != StoryDatabase.lock_file:
+            StoryDatabase._lock = FileLock(StoryDatabase.lock_file)
+        return StoryDatabase._lock
+
+    @staticmethod
+    @contextmanager
+    def transaction():
+        """
+        Section exclusive entre processus (verrou consultatif sur lock_file). À l'entrée, les
+        fichiers modifiés par un autre processus depuis notre dernière lecture sont relus et
+        fusionnés (voir _refresh) : les modifications faites dans la section s'appliquent à
+        l'état à jour, et chaque fichier est remplacé atomiquement.
+        """
+        lock = StoryDatabase._file_lock()
+        with lock:
+            if lock.depth == 1:
+                StoryDatabase._refresh()
+            yield
+
+    @staticmethod
+    def _tracked_files() -> List[str]:
+        return [StoryDatabase.store.index_file, StoryDatabase.factoids_file, StoryDatabase.factoids_journal_file,
+                StoryDatabase.valid_terms_file, StoryDatabase.valid_relations_file, StoryDatabase.content_hashes_file]
+
+    @staticmethod
+    def _file_state(path: str) -> Optional[Tuple[int, int, int]]:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        # L'inode change à chaque remplacement atomique, même à taille et date égales
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    @staticmethod
+    def _remember(*paths: str):
+        for path in paths:
+            StoryDatabase._disk_state[path] = StoryDatabase._file_state(path)
+
+    @staticmethod
+    def _refresh():
+        """
+        Relit les fichiers écrits par un autre processus depuis notre dernière lecture ou écriture.
+        Les histoires, factoïdes et empreintes sont relus ; les termes et relations valides, qui ne
+        font que croître, sont fusionnés avec ceux ajoutés ici sans être encore enregistrés.
+        """
+        changed = {path for path in StoryDatabase._tracked_files() if StoryDatabase._file_state(path) != StoryDatabase._disk_state.get(path)}
+        if not changed:
+            return
+        StoryDatabase._remember(*changed)
+        if StoryDatabase.store.index_file in changed:
+            StoryDatabase.store.reload()
+            StoryDatabase.load_all_stories()
+        if StoryDatabase.factoids_file in changed or StoryDatabase.factoids_journal_file in changed:
+            StoryDatabase._lazy_sections.discard("factoids")
+            StoryDatabase.load_all_factoids()
+        if StoryDatabase.valid_terms_file in changed:
+            ours = [] if "valid_terms" in StoryDatabase._lazy_sections else StoryDatabase.valid_terms
+            StoryDatabase._lazy_sections.discard("valid_terms")
+            StoryDatabase.load_valid_terms()
+            known = set(StoryDatabase.valid_terms)
+            StoryDatabase.valid_terms = StoryDatabase.valid_terms + [term for term in ours if term not in known]
+        if StoryDatabase.valid_relations_file in changed:
+            ours = {} if "valid_relations" in StoryDatabase._lazy_sections else StoryDatabase.valid_relations
+            StoryDatabase._lazy_sections.discard("valid_relations")
+            StoryDatabase.valid_relations = {}
+            StoryDatabase.load_valid_relations()
+            for relation_type, relations in ours.items():
+                for relation in relations:
+                    StoryDatabase.add_valid_relation(relation_type, relation["node1"], relation["node2"], save=False)
+        if StoryDatabase.content_hashes_file in changed:
+            StoryDatabase._lazy_sections.discard("content_hashes")
+            StoryDatabase.load_content_hashes()
+        StoryDatabase.generation += 1
+
+    @staticmethod
+    def _write_json(path: str, data: Any, **kwargs):
+        """Écriture atomique : fichier temporaire puis renommage ; l'état du fichier écrit est mémorisé"""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_file = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=4, **kwargs)
+        os.replace(tmp_file, path)
+        StoryDatabase._remember(path)
+
+    @staticmethod
+    def open_store(migrate: bool = True):
+        """
+        Ouvre le stockage des histoires ; son index n'est lu qu'au premier accès.
+
+        Args:
+            migrate: Range dans le stockage les fichiers de l'ancien format (un par histoire)
+        """
+        if StoryDatabase.store is not None:
+            StoryDatabase.store.close()
+        StoryDatabase.store = StoryStore(StoryDatabase.storage_dir, lazy=True)
+        if migrate:
+            StoryDatabase.migrate_legacy_files()
+
+    @staticmethod
+    def migrate_legacy_files():
+        """Range dans le stockage les fichiers de l'ancien format (un par histoire)"""
+        migrated = StoryDatabase.store.migrate_legacy_files(exclude=(os.path.basename(StoryDatabase.factoids_file),))
+        if migrated:
+            print(f"{migrated} fichier(s) d'histoire rangé(s) dans {StoryDatabase.store.segment_file}.")
+
+    @staticmethod
+    def _require(section: str):
+        """Décode une section de l'instantané lors de son premier usage"""
+        if section not in StoryDatabase._lazy_sections:
+            return
+        with StoryDatabase._sections_lock:
+            if section not in StoryDatabase._lazy_sections:
+                return
+            snapshot = StoryDatabase._snapshot
+            if section == "factoids":
+                StoryDatabase.factoids = {group: to_factoids(snapshot.factoids(group)) for group in ("generalized", "not_generalized")}
+                StoryDatabase._factoid_index = {}
+            elif section == "valid_terms":
+                StoryDatabase.valid_terms = snapshot.valid_terms()
+            elif section == "valid_relations":
+                StoryDatabase.valid_relations = snapshot.valid_relations()
+            elif section == "content_hashes":
+                # Pas dans l'instantané : fichier lu au premier usage
+                StoryDatabase.load_content_hashes()
+            # Retirée après l'affectation : les autres threads n'utilisent pas la section vide
+            StoryDatabase._lazy_sections.discard(section)
+
+    @staticmethod
+    def _decode_story(story: Dict) -> Dict:
+        story["factoids"] = to_factoids(story.get("factoids", []))
+        return story
+
+    @staticmethod
+    def source_signature() -> List:
+        """Dates de modification et tailles des fichiers de la base (fraîcheur de l'instantané)"""
+        signature = []
+        for path in StoryDatabase._tracked_files():
+            try:
+                stat = os.stat(path)
+                signature.append([path, stat.st_mtime_ns, stat.st_size])
+            except OSError:
+                signature.append([path, None, None])
+        return signature
+
+    @staticmethod
+    def write_snapshot() -> Dict[str, int]:
+        """Compile la base chargée dans l'instantané (main.py snapshot)"""
+        with StoryDatabase.transaction():
+            for section in list(StoryDatabase._lazy_sections):
+                StoryDatabase._require(section)
+            stories = {story_id: {**story, "factoids": [f.to_dict() if isinstance(f, Factoid) else f for f in story.get("factoids", [])]}
+                       for story_id, story in StoryDatabase.stories.items()}
+            factoids = {group: [f.to_dict() if isinstance(f, Factoid) else f for f in StoryDatabase.factoids[group]] for group in ("generalized", "not_generalized")}
+            return build_snapshot(StoryDatabase.snapshot_file, stories, factoids, StoryDatabase.valid_terms,
+                                  StoryDatabase.valid_relations, StoryDatabase.source_signature())
 
     @staticmethod
     def add_story(story: Dict, generalized: bool = False):
+        StoryDatabase.add_stories([story], generalized)
+
+    @staticmethod
+    def add_stories(stories: List[Dict], generalized: bool = False):
+        """
+        Ajoute un lot d'histoires. Les factoïdes modifiés sont notés dans le journal (voir
+        _journal_factoids) : le coût d'un lot ne dépend pas de la taille de la base. Les
+        histoires enregistrées ne restent pas en mémoire, elles sont relues à la demande.
+        """
+        if not stories:
+            return
+        with StoryDatabase.transaction():
+            changed = []
+            for story in stories:
+                changed.extend(StoryDatabase._add_story_entry(story, generalized))
+            StoryDatabase._flush_store()
+            StoryDatabase._journal_factoids(changed)
+            if not generalized:
+                StoryDatabase.save_content_hashes()
+            if isinstance(StoryDatabase.stories, LazyStoryMap) and StoryDatabase.stories.source is StoryDatabase.store:
+                StoryDatabase.stories.evict(story["id"] for story in stories)
+        StoryDatabase.generation += 1
+
+    @staticmethod
+    def story_hash(story: Dict) -> str:
+        """Empreinte du domaine et des factoïdes normalisés d'une histoire"""
+        content = [story.get("domain"), [StoryDatabase._factoid_key(f) for f in story.get("factoids", [])]]
+        return hashlib.sha1(json.dumps(content, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def is_unchanged(story: Dict) -> bool:
+        """Vrai si l'histoire a déjà été importée avec le même contenu"""
+        story_id = story.get("id")
+        if StoryDatabase._lazy_sections:
+            StoryDatabase._require("content_hashes")
+        return story_id in StoryDatabase.stories and StoryDatabase.content_hashes.get(story_id) == StoryDatabase.story_hash(story)
+
+    @staticmethod
+    def _factoid_key(factoid: Dict) -> tuple:
+        return (factoid.get("subject"), factoid.get("predicate"), factoid.get("object"), factoid.get("location"), factoid.get("time"))
+
+    @staticmethod
+    def _factoid_index_for(factoid_list_key: str) -> Dict[tuple, Dict]:
+        """Index (sujet, prédicat, objet, lieu, temps) -> factoïde, construit à la demande"""
+        if StoryDatabase._lazy_sections:
+            StoryDatabase._require("factoids")
+        index = StoryDatabase._factoid_index.get(factoid_list_key)
+        if index is None:
+            index = {}
+            for existing in StoryDatabase.factoids[factoid_list_key]:
+                index.setdefault(StoryDatabase._factoid_key(existing), existing)
+            StoryDatabase._factoid_index[factoid_list_key] = index
+        return index
+
+    @staticmethod
+    def _add_story_entry(story: Dict, generalized: bool) -> List[str]:
+        """Enregistre une histoire ; retourne les histoires dont les factoïdes ont changé"""
         story_id = story.get("id")
         if not story_id:
             raise ValueError("Story must have an 'id' field.")
 
+        if StoryDatabase._lazy_sections:
+            StoryDatabase._require("content_hashes")
+        changed = [story_id]
+        previous = StoryDatabase.stories.get(story_id)
+        if previous is not None:
+            # Nouvelle version : retire l'histoire des factoïdes qu'elle ne contient plus
+            kept = {StoryDatabase._factoid_key(f) for f in story.get("factoids", [])} if previous.get("generalized") == generalized else set()
+            StoryDatabase._detach_story(previous, kept)
+            # Base antérieure aux empreintes : celle de la version enregistrée
+            previous_hash = StoryDatabase.content_hashes.get(story_id) or StoryDatabase.story_hash(previous)
+            if not generalized and previous_hash != StoryDatabase.story_hash(story):
+                # La généralisation de l'ancienne version n'est plus à jour
+                if StoryDatabase.remove_story(story_id + "_generalized", save=False):
+                    changed.append(story_id + "_generalized")
+
+        story["factoids"] = to_factoids(story.get("factoids", []))
         StoryDatabase.stories[story_id] = story
         StoryDatabase.stories[story_id]["generalized"] = generalized
         StoryDatabase._save_story_to_file(story)
+        if not generalized:
+            StoryDatabase.content_hashes[story_id] = StoryDatabase.story_hash(story)
+        StoryDatabase._attach_story(story, generalized)
+        return changed
 
+    @staticmethod
+    def _attach_story(story: Dict, generalized: bool):
+        """Ajoute l'histoire à la liste `stories_id` de ses factoïdes ; crée les factoïdes nouveaux"""
+        story_id = story["id"]
         factoid_list_key = "generalized" if generalized else "not_generalized"
+        index = StoryDatabase._factoid_index_for(factoid_list_key)
         for new_factoid in story.get("factoids", []):
-            matched = False
-            for existing in StoryDatabase.factoids[factoid_list_key]:
-                if (existing.get("subject") == new_factoid.get("subject") and
-                    existing.get("predicate") == new_factoid.get("predicate") and
-                    existing.get("object") == new_factoid.get("object") and
-                    existing.get("location") == new_factoid.get("location") and
-                    existing.get("time") == new_factoid.get("time")):
-
-                    stories_id = existing.setdefault("stories_id", [])
-                    if story_id not in stories_id:
-                        stories_id.append(story_id)
-                    matched = True
-                    break
-
-            if not matched:
+            existing = index.get(StoryDatabase._factoid_key(new_factoid))
+            if existing is not None:
+                stories_id = existing.setdefault("stories_id", [])
+                if story_id not in stories_id:
+                    stories_id.append(story_id)
+            else:
                 factoid_copy = new_factoid.copy()
                 factoid_copy["stories_id"] = [story_id]
                 StoryDatabase.factoids[factoid_list_key].append(factoid_copy)
+                index[StoryDatabase._factoid_key(factoid_copy)] = factoid_copy
+
+    @staticmethod
+    def _detach_story(story: Dict, kept_keys: set):
+        """Retire l'histoire de la liste `stories_id` des factoïdes hors de `kept_keys` ; supprime les factoïdes orphelins"""
+        if StoryDatabase._lazy_sections:
+            StoryDatabase._require("factoids")
+        factoid_list_key = "generalized" if story.get("generalized") else "not_generalized"
+        index = StoryDatabase._factoid_index_for(factoid_list_key)
+        removed = False
+        for factoid in story.get("factoids", []):
+            key = StoryDatabase._factoid_key(factoid)
+            if key in kept_keys:
+                continue
+            existing = index.get(key)
+            if existing is None or story["id"] not in existing.get("stories_id", []):
+                continue
+            existing["stories_id"].remove(story["id"])
+            if not existing["stories_id"]:
+                del index[key]
+                removed = True
+        if removed:
+            StoryDatabase.factoids[factoid_list_key] = [f for f in StoryDatabase.factoids[factoid_list_key] if f.get("stories_id")]
+
+    @staticmethod
+    def remove_story(story_id: str, save: bool = True) -> bool:
+        """Supprime une histoire, sa version stockée et ses appartenances aux factoïdes ; retourne False si elle n'existe pas"""
+        with StoryDatabase.transaction() if save else nullcontext():
+            story = StoryDatabase.stories.pop(story_id, None)
+            if story is None:
+                return False
+            StoryDatabase._detach_story(story, set())
+            if StoryDatabase._lazy_sections:
+                StoryDatabase._require("content_hashes")
+            StoryDatabase.content_hashes.pop(story_id, None)
+            StoryDatabase.store.delete_story(story_id)
+            if save:
+                StoryDatabase._flush_store()
+                StoryDatabase._journal_factoids([story_id])
+                StoryDatabase.save_content_hashes()
+                StoryDatabase.generation += 1
+        return True
 
-        StoryDatabase._save_all_factoids()
+    @staticmethod
+    def save_content_hashes():
+        # Appelé dans une transaction : les empreintes d'un autre processus y ont été relues
+        if StoryDatabase._lazy_sections:
+            StoryDatabase._require("content_hashes")
+        StoryDatabase._write_json(StoryDatabase.content_hashes_file, StoryDatabase.content_hashes)
+
+    @staticmethod
+    def load_content_hashes():
+        if os.path.exists(StoryDatabase.content_hashes_file):
+            with open(StoryDatabase.content_hashes_file, "r", encoding="utf-8") as f:
+                StoryDatabase.content_hashes = json.load(f)
+        else:
+            StoryDatabase.content_hashes = {}
 
     @staticmethod
     def _save_story_to_file(story: Dict):
-        story_id = story["id"]
-        filepath = os.path.join(StoryDatabase.storage_dir, f"{story_id}.json")
-        with open(filepath, "w", encoding="utf-8") as f:
-            json.dump(story, f, ensure_ascii=False, indent=4)
+        # Ajout au segment ; l'index est écrit par store.flush() à la fin du lot
+        StoryDatabase.store.write_story(story)
+
+    @staticmethod
+    def _flush_store():
+        StoryDatabase.store.flush()
+        StoryDatabase._remember(StoryDatabase.store.index_file)
+
+    @staticmethod
+    def compact_storage() -> int:
+        """Retire du segment les versions remplacées des histoires ; retourne le nombre d'octets récupérés"""
+        with StoryDatabase.transaction():
+            reclaimed = StoryDatabase.store.compact()
+            StoryDatabase._remember(StoryDatabase.store.index_file)
+        return reclaimed
 
     @staticmethod
     def _save_all_factoids():
-        with open(StoryDatabase.factoids_file, "w", encoding="utf-8") as f:
-            json.dump(StoryDatabase.factoids, f, ensure_ascii=False, indent=4)
+        """Réécrit factoids_file, puis vide le journal qu'il intègre désormais"""
+        if StoryDatabase._lazy_sections:
+            StoryDatabase._require("factoids")
+        StoryDatabase._write_json(StoryDatabase.factoids_file, StoryDatabase.factoids, default=json_default)
+        if os.path.exists(StoryDatabase.factoids_journal_file):
+            os.remove(StoryDatabase.factoids_journal_file)
+        StoryDatabase._remember(StoryDatabase.factoids_journal_file)
+
+    @staticmethod
+    def _journal_factoids(story_ids: List[str]):
+        """
+        Note dans le journal les histoires dont les factoïdes ont changé (appelé dans une
+        transaction, après l'écriture des histoires). factoids_file n'est réécrit que lorsque le
+        journal dépasse sa taille : le coût total d'une importation reste linéaire.
+        """
+        if not story_ids:
+            return
+        os.makedirs(os.path.dirname(StoryDatabase.factoids_journal_file) or ".", exist_ok=True)
+        with open(StoryDatabase.factoids_journal_file, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(story_id, ensure_ascii=False) + "\n" for story_id in story_ids))
+        StoryDatabase._remember(StoryDatabase.factoids_journal_file)
+        journal_size = os.path.getsize(StoryDatabase.factoids_journal_file)
+        factoids_size = os.path.getsize(StoryDatabase.factoids_file) if os.path.exists(StoryDatabase.factoids_file) else 0
+        if journal_size > max(factoids_size, 64 * 1024):
+            StoryDatabase._save_all_factoids()
+
+    @staticmethod
+    def save_factoids():
+        """Intègre le journal des factoïdes dans factoids_file (fin d'importation)"""
+        with StoryDatabase.transaction():
+            if os.path.exists(StoryDatabase.factoids_journal_file):
+                StoryDatabase._save_all_factoids()
+
+    @staticmethod
+    def _replay_factoid_journal():
+        """Applique aux factoïdes chargés les histoires notées dans le journal, relues dans le stockage"""
+        if not os.path.exists(StoryDatabase.factoids_journal_file):
+            return
+        # Ordre de la première mention : les factoïdes recréés le sont dans l'ordre des écritures
+        story_ids: Dict[str, None] = {}
+        with open(StoryDatabase.factoids_journal_file, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    story_ids.setdefault(json.loads(line))
+                except json.JSONDecodeError:
+                    # Dernière ligne incomplète : écriture interrompue
+                    break
+        if not story_ids:
+            return
+        # Version enregistrée de chaque histoire (None si supprimée) et ses factoïdes par groupe
+        stories = {}
+        for story_id in story_ids:
+            if StoryDatabase.store.has_story(story_id):
+                stories[story_id] = StoryDatabase._decode_story(StoryDatabase.store.read_story(story_id))
+        kept = {(("generalized" if story.get("generalized") else "not_generalized"), story_id): {StoryDatabase._factoid_key(f) for f in story["factoids"]}
+                for story_id, story in stories.items()}
+        # Rejouer est idempotent : chaque histoire ne reste que dans les factoïdes de sa dernière version
+        for group in ("generalized", "not_generalized"):
+            remaining = []
+            for factoid in StoryDatabase.factoids[group]:
+                stories_id = factoid.get("stories_id", [])
+                if any(story_id in story_ids for story_id in stories_id):
+                    key = StoryDatabase._factoid_key(factoid)
+                    factoid["stories_id"] = [story_id for story_id in stories_id
+                                             if story_id not in story_ids or key in kept.get((group, story_id), ())]
+                if factoid.get("stories_id"):
+                    remaining.append(factoid)
+            StoryDatabase.factoids[group] = remaining
+        StoryDatabase._factoid_index = {}
+        for story in stories.values():
+            StoryDatabase._attach_story(story, bool(story.get("generalized")))
 
     @staticmethod
     def save_valid_terms():
-        os.makedirs(os.path.dirname(StoryDatabase.valid_terms_file), exist_ok=True)
-        with open(StoryDatabase.valid_terms_file, "w", encoding="utf-8") as f:
-            json.dump(StoryDatabase.valid_terms, f, ensure_ascii=False, indent=4)
+        with StoryDatabase.transaction():
+            if StoryDatabase._lazy_sections:
+                StoryDatabase._require("valid_terms")
+            StoryDatabase._write_json(StoryDatabase.valid_terms_file, StoryDatabase.valid_terms)
 
     @staticmethod
     def save_valid_relations():
-        os.makedirs(os.path.dirname(StoryDatabase.valid_relations_file), exist_ok=True)
-        with open(StoryDatabase.valid_relations_file, "w", encoding="utf-8") as f:
-            json.dump(StoryDatabase.valid_relations, f, ensure_ascii=False, indent=4)
+        with StoryDatabase.transaction():
+            if StoryDatabase._lazy_sections:
+                StoryDatabase._require("valid_relations")
+            StoryDatabase._write_json(StoryDatabase.valid_relations_file, StoryDatabase.valid_relations)
 
     @staticmethod
     def load_valid_terms():
@@ -93,30 +517,60 @@ class StoryDatabase:
 
     @staticmethod
     def is_valid_term(term: str) -> bool:
+        if StoryDatabase._lazy_sections:
+            StoryDatabase._require("valid_terms")
         return term in StoryDatabase.valid_terms
 
     @staticmethod
     def is_valid_relation(relation_type: str, node1: str, node2: str) -> bool:
+        if StoryDatabase._lazy_sections:
+            StoryDatabase._require("valid_relations")
         if relation_type not in StoryDatabase.valid_relations:
             return False
         return any(rel.get("node1") == node1 and rel.get("node2") == node2 for rel in StoryDatabase.valid_relations[relation_type])
 
     @staticmethod
-    def add_valid_term(term: str):
+    def add_valid_term(term: str, save: bool = True):
+        if StoryDatabase._lazy_sections:
+            StoryDatabase._require("valid_terms")
         if term not in StoryDatabase.valid_terms:
             StoryDatabase.valid_terms.append(term)
-        StoryDatabase.save_valid_terms()
+        if save:
+            StoryDatabase.save_valid_terms()
 
     @staticmethod
-    def add_valid_relation(relation_type: str, node1: str, node2: str):
+    def add_valid_relation(relation_type: str, node1: str, node2: str, save: bool = True):
+        if StoryDatabase._lazy_sections:
+            StoryDatabase._require("valid_relations")
         if relation_type not in StoryDatabase.valid_relations:
             StoryDatabase.valid_relations[relation_type] = []
         if not any(rel.get("node1") == node1 and rel.get("node2") == node2 for rel in StoryDatabase.valid_relations[relation_type]):
             StoryDatabase.valid_relations[relation_type].append({"node1": node1, "node2": node2})
+        if save:
+            StoryDatabase.save_valid_relations()
+
+    @staticmethod
+    def add_valid_terms(terms: List[str]):
+        """Ajoute plusieurs termes valides avec une seule écriture du fichier"""
+        if not terms:
+            return
+        for term in terms:
+            StoryDatabase.add_valid_term(term, save=False)
+        StoryDatabase.save_valid_terms()
+
+    @staticmethod
+    def add_valid_relations(relations: List[Tuple[str, str, str]]):
+        """Ajoute plusieurs relations valides (type, noeud1, noeud2) avec une seule écriture du fichier"""
+        if not relations:
+            return
+        for relation_type, node1, node2 in relations:
+            StoryDatabase.add_valid_relation(relation_type, node1, node2, save=False)
         StoryDatabase.save_valid_relations()
 
     @staticmethod
     def get_factoid_by_id(factoid_id: str) -> Optional[Dict]:
+        if StoryDatabase._lazy_sections:
+            StoryDatabase._require("factoids")
         for group in ["generalized", "not_generalized"]:
             for factoid in StoryDatabase.factoids[group]:
                 if factoid.get("id") == factoid_id:
@@ -125,6 +579,8 @@ class StoryDatabase:
 
     @staticmethod
     def find_factoid(subject: str, predicate: str, object_: str = None, location: str = None, time: str = None, generalized: Optional[bool] = None) -> Optional[Dict]:
+        if StoryDatabase._lazy_sections:
+            StoryDatabase._require("factoids")
         keys = ["generalized", "not_generalized"] if generalized is None else (
             ["generalized"] if generalized else ["not_generalized"]
         )
@@ -140,6 +596,8 @@ class StoryDatabase:
 
     @staticmethod
     def list_factoids(generalized: Optional[bool] = None) -> List[Dict]:
+        if StoryDatabase._lazy_sections:
+            StoryDatabase._require("factoids")
         if generalized is None:
             return StoryDatabase.factoids["generalized"] + StoryDatabase.factoids["not_generalized"]
         key = "generalized" if generalized else "not_generalized"
@@ -151,19 +609,44 @@ class StoryDatabase:
 
     @staticmethod
     def load_all_stories():
-        for filename in os.listdir(StoryDatabase.storage_dir):
-            if filename.endswith(".json") and filename != os.path.basename(StoryDatabase.factoids_file):
-                with open(os.path.join(StoryDatabase.storage_dir, filename), "r", encoding="utf-8") as f:
-                    story = json.load(f)
-                    StoryDatabase.stories[story["id"]] = story
+        # Seul l'index est lu : chaque histoire est lue dans le segment à son premier accès
+        StoryDatabase.stories = LazyStoryMap(StoryDatabase.store, decode=StoryDatabase._decode_story)
 
     @staticmethod
     def load_all_factoids():
         if os.path.exists(StoryDatabase.factoids_file):
             with open(StoryDatabase.factoids_file, "r", encoding="utf-8") as f:
-                StoryDatabase.factoids = json.load(f)
+                StoryDatabase.factoids = {key: to_factoids(factoids) for key, factoids in json.load(f).items()}
         else:
             StoryDatabase.factoids = {"generalized": [], "not_generalized": []}
+        StoryDatabase._factoid_index = {}
+        StoryDatabase._replay_factoid_journal()
+
+    @staticmethod
+    def fingerprint() -> str:
+        """
+        Empreinte du contenu de la base, pour invalider les caches persistés entre deux
+        exécutions : factoïdes (termes et histoires liées) et empreinte de chaque histoire
+        importée (story_hash, qui suit l'ordre des factoïdes dont dépendent les candidats de
+        prédiction). Indépendante des dates des fichiers : une base réimportée à l'identique
+        garde son empreinte.
+        """
+        cached = StoryDatabase._fingerprint
+        if cached is not None and cached[0] == StoryDatabase.generation:
+            return cached[1]
+        if StoryDatabase._lazy_sections:
+            StoryDatabase._require("factoids")
+            StoryDatabase._require("content_hashes")
+        lines = sorted(json.dumps([group, StoryDatabase._factoid_key(factoid), sorted(factoid.get("stories_id", []))], ensure_ascii=False)
+                       for group in ("generalized", "not_generalized") for factoid in StoryDatabase.factoids[group])
+        digest = hashlib.sha1()
+        for line in lines:
+            digest.update(line.encode("utf-8") + b"\n")
+        for story_id, content_hash in sorted(StoryDatabase.content_hashes.items()):
+            digest.update(f"{story_id}\t{content_hash}\n".encode("utf-8"))
+        fingerprint = f"{len(StoryDatabase.stories)}:{digest.hexdigest()}"
+        StoryDatabase._fingerprint = (StoryDatabase.generation, fingerprint)
+        return fingerprint
 
     @staticmethod
     def list_stories() -> List[str]:
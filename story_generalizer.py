@@ -1,43 +1,129 @@
 import json
 import os
-from typing import Dict, Any, List
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Dict, Any, List, Optional
 from jdm_client import JDMClient
 from factoid_extractor import FactoidExtractor
 from story_generator import StoryGenerator
 from story_database import StoryDatabase
+from hypernym_index import HypernymIndex
+import metrics
 
 class StoryGeneralizer:
-    def __init__(self, valid_terms_path: str = "data/valid_terms.json", valid_relations_path: str = "data/valid_relations.json"):
+    def __init__(self, valid_terms_path: str = "data/valid_terms.json", valid_relations_path: str = "data/valid_relations.json", memo_file: str = "data/generalization_memo.json", hypernym_index_file: str = "data/hypernym_index.json"):
+        # Paramètres du constructeur, pour recréer le généralisateur dans les processus du pool
+        self.init_kwargs = {"valid_terms_path": valid_terms_path, "valid_relations_path": valid_relations_path, "memo_file": memo_file, "hypernym_index_file": hypernym_index_file}
         self.jdm = JDMClient(logging = False)
         self.extractor = FactoidExtractor()
         self.story_checker = StoryGenerator()  # Utilise le mode auto pour valider sans prompt
         self.good_generalizators = ["humain", "être humain", "personne", "individu", "employé", "convive", "artiste", "visiteur", "animal domestique", "animal", "nourriture"]
+        self._good_generalizators_set = set(self.good_generalizators)
+        # (rôle, terme, prédicats reliés) -> premier hyperonyme dont le terme et les relations
+        # sont valides (None : aucun, non sauvegardé). Le reste de l'histoire est vérifié à part.
+        self.memo_file = memo_file
+        self.memo: Dict[str, Optional[str]] = {}
+        # Fermeture r_isa précalculée (main.py build-hypernyms) : si elle existe, les hyperonymes
+        # des termes indexés sont lus localement, au-delà du premier niveau
+        self.hypernym_index = HypernymIndex(hypernym_index_file)
+        if not self.hypernym_index.load():
+            self.hypernym_index = None
+        self.load_memo()
 
-    def _get_generalizations1(self, term: str) -> list:        
-        rels = []
-        for good_generalizator in self.good_generalizators:
-            rel = self.jdm.get_relations_from_to(term, good_generalizator, types_ids=[self.jdm.relation_type_ids["r_isa"]], min_weight=5)
-            if not (not rel or "relations" not in rel or not rel["relations"]):
-                rels.append((good_generalizator, rel["relations"][0]["w"]))
+    def _add_good_generalizator(self, generalizator: str):
+        if generalizator not in self._good_generalizators_set:
+            self.good_generalizators.append(generalizator)
+            self._good_generalizators_set.add(generalizator)
 
-        rels = sorted(rels, key=lambda x: x[1], reverse=True)[:5]
-        return rels
+    def _get_isa_relations(self, term: str) -> list:
+        """
+        Hyperonymes (r_isa, poids >= 5) d'un terme : [(nom, poids, profondeur)]. Lus dans
+        l'index des hyperonymes si le terme y figure, sinon en une seule requête JDM (profondeur 1).
+        """
+        if self.hypernym_index is not None:
+            indexed = self.hypernym_index.contains(term)
+            metrics.inc("cache_lookups_total", cache="hypernym_index", tier="index", result="hit" if indexed else "miss")
+            if indexed:
+                return self.hypernym_index.ancestors(term)
 
-    def _get_generalizations(self, term: str) -> list:
-        """Retourne les hyperonymes (r_isa) d’un terme via JDM"""
         relations = self.jdm.get_relations_from(term, types_ids=[self.jdm.relation_type_ids["r_isa"]], min_weight=5)
 
         if not relations or "relations" not in relations:
             return []
-        
-        rels = [
-            (relations["nodes"][idx]["name"], relations["relations"][idx]["w"])
-            for idx in range(len(relations["relations"]))
-            if ':' not in relations["nodes"][idx]["name"]
+
+        names = {node.get("id"): node.get("name") for node in relations.get("nodes", [])}
+        return [
+            (names[rel.get("node2")], rel["w"], 1)
+            for rel in relations["relations"]
+            if names.get(rel.get("node2"))
         ]
 
-        rels = sorted(rels, key=lambda x: x[1], reverse=True)[:5]
-        return rels
+    def _get_generalizations1(self, term: str) -> list:
+        """Hyperonymes du terme parmi les bons généralisateurs, du plus proche au plus lointain puis par poids décroissant"""
+        found = {}
+        for name, weight, depth in self._get_isa_relations(term):
+            if name in self._good_generalizators_set and name not in found:
+                found[name] = (weight, depth)
+
+        # Ordre des généralisateurs en cas d'égalité
+        rels = [(good_generalizator, *found[good_generalizator]) for good_generalizator in self.good_generalizators if good_generalizator in found]
+        rels = sorted(rels, key=lambda x: (x[2], -x[1]))[:5]
+        return [(name, weight) for name, weight, _ in rels]
+
+    def _get_generalizations(self, term: str) -> list:
+        """Retourne les hyperonymes (r_isa) d’un terme, du plus proche au plus lointain puis par poids décroissant"""
+        rels = [rel for rel in self._get_isa_relations(term) if ':' not in rel[0]]
+
+        rels = sorted(rels, key=lambda x: (x[2], -x[1]))[:5]
+        return [(name, weight) for name, weight, _ in rels]
+
+    def shared_generalization(self, terms: List[str]) -> Optional[str]:
+        """Ancêtre commun le plus spécifique d'un ensemble de termes (index des hyperonymes requis)"""
+        if self.hypernym_index is None:
+            return None
+        return self.hypernym_index.most_specific_shared_ancestor(terms)
+
+    def _memo_key(self, role: str, value: str, factoids: List[Dict[str, Any]]) -> str:
+        """Clé du mémo : le terme, son rôle et les prédicats auxquels il est relié dans l'histoire"""
+        predicates = sorted({f.get("predicate") for f in factoids if f.get(role) == value})
+        return json.dumps([role, value, predicates], ensure_ascii=False)
+
+    def _find_generalization(self, role: str, value: str, story: Dict[str, Any]) -> Optional[str]:
+        """Premier hyperonyme de `value` dont le terme et les relations sont valides, ou None"""
+        with metrics.timer("generalization_seconds", role=role):
+            candidate = self._first_consistent_generalization(role, value, story)
+        metrics.inc("generalization_attempts_total", role=role, result="found" if candidate else "none")
+        return candidate
+
+    def _first_consistent_generalization(self, role: str, value: str, story: Dict[str, Any]) -> Optional[str]:
+        for get_candidates in (self._get_generalizations1, self._get_generalizations):
+            for candidate, _ in get_candidates(value):
+                if candidate != value and not (">" in candidate and candidate.split(">")[0] == value):
+                    # Seuls le candidat et ses relations sont vérifiés, le reste de l'histoire l'est par l'appelant
+                    if self.story_checker.check_substitution(story, role, value, candidate, unaffected=False):
+                        print(f"Généralisation {role} réussie : {value} → {candidate}")
+                        return candidate
+        return None
+
+    def _hypernym_index_version(self) -> Optional[float]:
+        return self.hypernym_index.built_at if self.hypernym_index is not None else None
+
+    def load_memo(self):
+        if not os.path.exists(self.memo_file):
+            return
+        with open(self.memo_file, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        # Mémo calculé avec une autre version de l'index des hyperonymes : ignoré
+        if data.get("hypernym_index") == self._hypernym_index_version():
+            self.memo = {key: candidate for key, candidate in data.get("memo", {}).items() if candidate is not None}
+        for generalizator in data.get("good_generalizators", []):
+            self._add_good_generalizator(generalizator)
+
+    def save_memo(self):
+        """Sauvegarde le mémo des généralisations et les généralisateurs appris"""
+        os.makedirs(os.path.dirname(self.memo_file) or ".", exist_ok=True)
+        with open(self.memo_file, "w", encoding="utf-8") as f:
+            json.dump({"hypernym_index": self._hypernym_index_version(), "memo": {key: candidate for key, candidate in self.memo.items() if candidate is not None}, "good_generalizators": self.good_generalizators}, f, ensure_ascii=False, indent=2)
 
     def generalize_factoid_story(self, story_id: str, factoids: List[Dict[str, Any]], domain: str) -> Dict[str, Any]:
         """Généralise tous les sujets ET objets distincts des factoïdes si possible"""
@@ -47,63 +133,28 @@ class StoryGeneralizer:
         # Collecte des sujets et objets uniques
         elements = []
         for f in factoids:
-            if f.get("subject"):
+            if f.get("subject") and ("subject", f["subject"]) not in elements:
                 elements.append(("subject", f["subject"]))
-            #if f.get("object"):
+            #if f.get("object") and ("object", f["object"]) not in elements:
             #    elements.append(("object", f["object"]))
 
         # Tentative de généralisation de chaque élément
+        story = {"id": story_id, "domain": domain, "factoids": factoids}
         for role, value in elements:
-            candidates1 = self._get_generalizations1(value)
-            candidate_found = None
-
-            for candidate, _ in candidates1:
-                if candidate != value and not (">" in candidate and candidate.split(">")[0] == value):
-                    # Appliquer temporairement la généralisation
-                    test_factoids = [
-                        {
-                            **f,
-                            role: candidate if f.get(role) == value else f.get(role)
-                        }
-                        for f in factoids
-                    ]
-                    test_story = {
-                        "id": story_id + "_generalized_test",
-                        "domain": domain,
-                        "factoids": test_factoids
-                    }
-                    if self.story_checker.check_story_consistency(test_story, ignore=True):
-                        candidate_found = candidate
-                        print(f"Généralisation {role} réussie : {value} → {candidate_found}")
-                        break
-            
-            if not candidate_found:
-                candidates2 = self._get_generalizations(value)
-
-                for candidate, _ in candidates2:
-                    if candidate != value and not (">" in candidate and candidate.split(">")[0] == value):
-                        # Appliquer temporairement la généralisation
-                        test_factoids = [
-                            {
-                                **f,
-                                role: candidate if f.get(role) == value else f.get(role)
-                            }
-                            for f in factoids
-                        ]
-                        test_story = {
-                            "id": story_id + "_generalized_test",
-                            "domain": domain,
-                            "factoids": test_factoids
-                        }
-                        if self.story_checker.check_story_consistency(test_story, ignore=True):
-                            candidate_found = candidate
-                            self.good_generalizators.append(candidate_found)
-                            print(f"Généralisation {role} réussie : {value} → {candidate_found}")
-                            break
+            if not self.story_checker.check_unaffected(story, role, value):
+                # Le reste de l'histoire est incohérent : aucune substitution ne la rend cohérente
+                candidate_found = None
+            else:
+                memo_key = self._memo_key(role, value, factoids)
+                metrics.inc("cache_lookups_total", cache="generalization_memo", tier="memory", result="hit" if memo_key in self.memo else "miss")
+                if memo_key in self.memo:
+                    candidate_found = self.memo[memo_key]
+                else:
+                    candidate_found = self._find_generalization(role, value, story)
+                    self.memo[memo_key] = candidate_found
 
             if candidate_found:
-                if not candidate_found in self.good_generalizators:
-                    self.good_generalizators.append(candidate_found)
+                self._add_good_generalizator(candidate_found)
 
                 if ">" in candidate_found:
                     candidate_found = candidate_found.split(">")[0]
@@ -117,6 +168,10 @@ class StoryGeneralizer:
         for (role, general), originals in reverse_mappings.items():
             if len(originals) == 1:
                 continue
+            # Ancêtre commun plus spécifique (index des hyperonymes), s'il garde l'histoire cohérente
+            shared = self.shared_generalization(originals)
+            if shared and shared != general and all(self.story_checker.check_substitution(story, role, original, shared) for original in originals):
+                general = shared
             for i, original in enumerate(originals, start=1):
                 final_mappings[(role, original)] = f"{general}:{i}"
 
@@ -148,55 +203,102 @@ class StoryGeneralizer:
         if f.get("time"): parts.append(f"[temps] {f['time']}")
         return " ".join(parts)
     
-def test_all_stories():
+def _print_factoids(title: str, factoids: List[Dict[str, Any]]):
+    print(f"\n{title} :")
+    for f in factoids:
+        parts = [f"[sujet] {f['subject']}", f"[predicat] {f['predicate']}"]
+        if f.get("object"): parts.append(f"[objet] {f['object']}")
+        if f.get("location"): parts.append(f"[lieu] {f['location']}")
+        if f.get("time"): parts.append(f"[temps] {f['time']}")
+        print(" ".join(parts))
+
+def _print_generalization(story: Dict[str, Any], generalized_story: Optional[Dict[str, Any]]):
+    _print_factoids("Histoire originale", story["factoids"])
+    if generalized_story is None:
+        print("\nHistoire généralisée :")
+        print("Pas de généralisation trouvée")
+    else:
+        _print_factoids("Histoire généralisée", generalized_story["factoids"])
+
+def generalize_stories(workers: int = 1, save_stories: bool = True) -> List[Dict[str, Any]]:
+    """
+    Généralise toutes les histoires non généralisées de StoryDatabase.
+
+    Chaque processus garde un seul StoryGeneralizer (client JDM, caches de verdicts et mémo)
+    pour toutes ses histoires. Les mémos et les généralisateurs appris par les processus
+    sont fusionnés dans le processus principal, qui enregistre les histoires généralisées
+    en un seul lot.
+
+    Args:
+        workers: Nombre de processus de généralisation
+        save_stories: Enregistre les histoires généralisées dans StoryDatabase
+
+    Returns:
+        Les histoires généralisées, dans l'ordre de la base
+    """
     StoryDatabase.initialize()
-    story_ids = StoryDatabase.list_stories()
-    for story_id in story_ids:
-        test_story(story_id, save_story=True)
+    stories = [StoryDatabase.get_story(story_id) for story_id in StoryDatabase.list_stories()]
+    stories = [story for story in stories if not story["generalized"]]
+
+    generalizer = StoryGeneralizer()
+    if workers <= 1:
+        generalized_stories = []
+        for story in stories:
+            generalized_story = generalizer.generalize_factoid_story(story["id"], story["factoids"], story["domain"])
+            _print_generalization(story, generalized_story)
+            generalized_stories.append(generalized_story)
+    else:
+        generalized_stories = []
+        chunksize = max(1, len(stories) // (4 * workers))
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_generalize_worker, initargs=(generalizer.init_kwargs,)) as executor:
+            for story, (generalized_story, memo_entries, generalizators, worker_metrics) in zip(stories, executor.map(_generalize_worker, stories, chunksize=chunksize)):
+                generalizer.memo.update(memo_entries)
+                metrics.merge(worker_metrics)
+                for generalizator in generalizators:
+                    generalizer._add_good_generalizator(generalizator)
+                _print_generalization(story, generalized_story)
+                generalized_stories.append(generalized_story)
+
+    generalizer.save_memo()
+    if save_stories:
+        StoryDatabase.add_stories(generalized_stories, generalized=True)
+        StoryDatabase.save_factoids()
+    return generalized_stories
+
+# Généralisateur propre à chaque processus du pool
+_worker_generalizer = None
+
+def _init_generalize_worker(init_kwargs: Dict[str, Any]):
+    global _worker_generalizer
+    _worker_generalizer = StoryGeneralizer(**init_kwargs)
+
+def _generalize_worker(story: Dict[str, Any]):
+    """Généralise une histoire ; retourne aussi les entrées du mémo, les généralisateurs appris et les mesures"""
+    memo_size = len(_worker_generalizer.memo)
+    generalizators_count = len(_worker_generalizer.good_generalizators)
+    generalized_story = _worker_generalizer.generalize_factoid_story(story["id"], story["factoids"], story["domain"])
+    # Le mémo et la liste ne font que grandir : les nouveautés sont à la fin
+    memo_entries = dict(islice(_worker_generalizer.memo.items(), memo_size, None))
+    return generalized_story, memo_entries, _worker_generalizer.good_generalizators[generalizators_count:], metrics.take()
+
+def test_all_stories(workers: int = 1):
+    generalize_stories(workers=workers, save_stories=True)
 
 def test_story(story_id, save_story: bool = False):
-    new_stories = []
     StoryDatabase.initialize()
     story = StoryDatabase.get_story(story_id)
 
     if story["generalized"]:
         return
 
-    factoids = story.get("factoids")
-
-    print("\nHistoire originale :")
-    for f in factoids:
-        parts = [f"[sujet] {f['subject']}", f"[predicat] {f['predicate']}"]
-        if f.get("object"): parts.append(f"[objet] {f['object']}")
-        if f.get("location"): parts.append(f"[lieu] {f['location']}")
-        if f.get("time"): parts.append(f"[temps] {f['time']}")
-        print(" ".join(parts))
-
     generalizer = StoryGeneralizer()
-    generalized_story = generalizer.generalize_factoid_story(story["id"], factoids, story["domain"])
+    generalized_story = generalizer.generalize_factoid_story(story["id"], story["factoids"], story["domain"])
+    generalizer.save_memo()
 
     if save_story:
         StoryDatabase.add_story(generalized_story, generalized=True)
 
-    print("\nHistoire originale :")
-    for f in factoids:
-        parts = [f"[sujet] {f['subject']}", f"[predicat] {f['predicate']}"]
-        if f.get("object"): parts.append(f"[objet] {f['object']}")
-        if f.get("location"): parts.append(f"[lieu] {f['location']}")
-        if f.get("time"): parts.append(f"[temps] {f['time']}")
-        print(" ".join(parts))
-
-    print("\nHistoire généralisée :")
-    if generalized_story == None:
-        print("Pas de généralisation trouvée")
-    else:
-        new_stories.append(generalized_story)
-        for f in generalized_story["factoids"]:
-            parts = [f"[sujet] {f['subject']}", f"[predicat] {f['predicate']}"]
-            if f.get("object"): parts.append(f"[objet] {f['object']}")
-            if f.get("location"): parts.append(f"[lieu] {f['location']}")
-            if f.get("time"): parts.append(f"[temps] {f['time']}")
-            print(" ".join(parts))
+    _print_generalization(story, generalized_story)
 
 if __name__ == "__main__":
-    test_all_stories()
\ No newline at end of file
+    test_all_stories()
@@ -1,41 +1,58 @@
 import os
-from typing import Dict, List, Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Any, Optional, Tuple
 from factoid_extractor import FactoidExtractor
 from jdm_client import JDMClient
+import metrics
 from story_database import StoryDatabase
+from import_pipeline import ImportPipeline
 
 class StoryGenerator:
-    def __init__(self, input_file: str = "histoires.txt", output_dir: str = "data/stories"):
+    # (relations acceptées, rôle relié au prédicat) : au moins une relation du groupe doit exister
+    RELATION_CHECKS = [
+        (("r_agent",), "subject"),
+        (("r_patient", "r_instr"), "object"),
+        (("r_action_lieu",), "location"),
+        (("r_time",), "time")
+    ]
+
+    def __init__(self, input_file: str = "histoires.txt", output_dir: str = "data/stories", max_workers: int = 8, batch_size: int = 32, defer_reviews: bool = False):
+        # Paramètres du constructeur, pour recréer le générateur dans les processus d'importation
+        self.init_kwargs = {"input_file": input_file, "output_dir": output_dir, "max_workers": max_workers, "batch_size": batch_size, "defer_reviews": defer_reviews}
         self.input_file = input_file
         self.output_dir = output_dir
+        self.max_workers = max_workers
+        self.batch_size = batch_size
         os.makedirs(output_dir, exist_ok=True)
         self.extractor = FactoidExtractor()
         self.jdm = JDMClient()
+        # Réponses JDM déjà obtenues : terme -> existe, (relations, source, cible) -> existe
+        self._term_verdicts: Dict[str, bool] = {}
+        self._relation_verdicts: Dict[Tuple[Tuple[str, ...], str, str], bool] = {}
+        # Si défini, les termes et relations acceptés sont notés ici au lieu d'être enregistrés
+        # (importation multi-processus : le processus principal fusionne et enregistre)
+        self.pending_validations: Optional[Dict[str, List]] = None
+        # Mode différé : au lieu de poser la question, les histoires bloquées sont notées
+        # ici avec leurs termes et relations non résolus (voir ReviewQueue)
+        self.defer_reviews = defer_reviews
+        self.pending_reviews: List[Tuple[Dict[str, Any], List[str], List[Tuple[str, str, str]]]] = []
+        # Dernier verdict de la partie d'une histoire non touchée par une substitution :
+        # (factoïdes, rôle, terme remplacé, verdict), voir check_substitution
+        self._substitution_base: Optional[Tuple[List[Dict[str, Any]], str, str, bool]] = None
         StoryDatabase.initialize(output_dir)
 
-    def load_and_store_stories(self):
-        current_domain = None
-        factoid_sentences = []
-        story_counter = 1
-
-        with open(self.input_file, 'r', encoding='utf-8') as f:
-            for line in f:
-                line = line.strip()
-                if not line:
-                    continue
-                if '[' not in line:
-                    if current_domain and factoid_sentences:
-                        self._create_and_add_story(current_domain, factoid_sentences, story_counter)
-                        story_counter += 1
-                    current_domain = line
-                    factoid_sentences = []
-                else:
-                    factoid_sentences.append(line)
-
-            if current_domain and factoid_sentences:
-                self._create_and_add_story(current_domain, factoid_sentences, story_counter)
+    def load_and_store_stories(self, resume: bool = True, checkpoint_file: str = "data/import_checkpoint.json", workers: int = 1, force: bool = True) -> int:
+        """
+        Importe le fichier d'entrée via le pipeline en flux (voir ImportPipeline).
+        Retourne le nombre d'histoires ajoutées.
 
-    def _create_and_add_story(self, domain: str, sentences: List[str], story_id: int):
+        Sans `force`, les termes et relations inconnus de JDM sont soumis à l'utilisateur,
+        ou notés dans la file de revue si le générateur est en mode différé.
+        """
+        pipeline = ImportPipeline(self, batch_size = self.batch_size, checkpoint_file = checkpoint_file, workers = workers, force = force)
+        return pipeline.run(resume = resume)
+
+    def _create_story(self, domain: str, sentences: List[str], story_id: int) -> Dict[str, Any]:
         story_identifier = f"{domain.lower().replace(' ', '_')}_{story_id}"
         factoids = []
         for idx, sentence in enumerate(sentences):
@@ -45,71 +62,235 @@ class StoryGenerator:
             factoid["id"] = f"{story_identifier}_f{idx+1}"
             factoids.append(factoid)
 
-        story = {
+        return {
             "id": story_identifier,
             "domain": domain,
             "factoids": factoids
         }
 
-        if self.check_story_consistency(story, force = True):
-            StoryDatabase.add_story(story)
+    def _check_and_add_stories(self, stories: List[Dict[str, Any]]):
+        for story, consistent in zip(stories, self.check_stories_consistency(stories, force = True)):
+            if consistent:
+                StoryDatabase.add_story(story)
+
+    def _create_and_add_story(self, domain: str, sentences: List[str], story_id: int):
+        self._check_and_add_stories([self._create_story(domain, sentences, story_id)])
+
+    def _accept_term(self, term: str):
+        if self.pending_validations is None:
+            StoryDatabase.add_valid_term(term)
+        else:
+            StoryDatabase.add_valid_term(term, save=False)
+            self.pending_validations["terms"].append(term)
+
+    def _accept_relation(self, relation_type: str, src: str, tgt: str):
+        if self.pending_validations is None:
+            StoryDatabase.add_valid_relation(relation_type, src, tgt)
+        else:
+            StoryDatabase.add_valid_relation(relation_type, src, tgt, save=False)
+            self.pending_validations["relations"].append((relation_type, src, tgt))
+
+    def take_pending_reviews(self) -> List[Tuple[Dict[str, Any], List[str], List[Tuple[str, str, str]]]]:
+        reviews = self.pending_reviews
+        self.pending_reviews = []
+        return reviews
+
+    def _story_terms(self, factoid: Dict[str, Any]) -> List[str]:
+        terms = [factoid['subject'], factoid['predicate']]
+        if factoid['object']:
+            terms.append(factoid['object'])
+        if factoid['location']:
+            terms.append(factoid['location'])
+        if factoid['time']:
+            terms.append(factoid['time'])
+        return terms
+
+    def _story_relations(self, factoid: Dict[str, Any]) -> List[Tuple[Tuple[str, ...], str, str]]:
+        relations = []
+        for rel_group, role in self.RELATION_CHECKS:
+            src, tgt = factoid["predicate"], factoid[role]
+            if src and tgt:
+                relations.append((rel_group, src, tgt))
+        return relations
+
+    def _collect_lookups(self, stories: List[Dict[str, Any]]) -> Tuple[List[str], List[Tuple[Tuple[str, ...], str, str]]]:
+        """Phase 1 : termes et relations distincts à demander à JDM pour un lot d'histoires"""
+        terms = {}
+        relations = {}
+        for story in stories:
+            for factoid in story.get("factoids", []):
+                for term in self._story_terms(factoid):
+                    if term not in self._term_verdicts and not StoryDatabase.is_valid_term(term):
+                        terms[term] = None
+                for rel_group, src, tgt in self._story_relations(factoid):
+                    key = (rel_group, src, tgt)
+                    if key in self._relation_verdicts:
+                        continue
+                    if any(StoryDatabase.is_valid_relation(rel_key, src, tgt) for rel_key in rel_group):
+                        continue
+                    relations[key] = None
+        return list(terms), list(relations)
+
+    def _lookup_term(self, term: str) -> bool:
+        node = self.jdm.get_node_by_name(term)
+        return bool(node and 'id' in node)
+
+    def _lookup_relation(self, key: Tuple[Tuple[str, ...], str, str]) -> bool:
+        rel_group, src, tgt = key
+        return any(self.jdm.has_relation(src, tgt, rel_key) for rel_key in rel_group)
+
+    def _term_found(self, term: str) -> bool:
+        if StoryDatabase.is_valid_term(term):
+            return True
+        if term not in self._term_verdicts:
+            self._term_verdicts[term] = self._lookup_term(term)
+        return self._term_verdicts[term]
+
+    def _relation_found(self, key: Tuple[Tuple[str, ...], str, str]) -> bool:
+        rel_group, src, tgt = key
+        if any(StoryDatabase.is_valid_relation(rel_key, src, tgt) for rel_key in rel_group):
+            return True
+        if key not in self._relation_verdicts:
+            self._relation_verdicts[key] = self._lookup_relation(key)
+        return self._relation_verdicts[key]
+
+    def _resolve_lookups(self, terms: List[str], relations: List[Tuple[Tuple[str, ...], str, str]]):
+        """Phase 2 : résolution concurrente des recherches JDM"""
+        if not terms and not relations:
+            return
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            term_results = executor.map(self._lookup_term, terms)
+            relation_results = executor.map(self._lookup_relation, relations)
+            for term, found in zip(terms, term_results):
+                self._term_verdicts[term] = found
+            for key, found in zip(relations, relation_results):
+                self._relation_verdicts[key] = found
+
+    def check_stories_consistency(self, stories: List[Dict[str, Any]], force: bool = False, ignore: bool = False) -> List[bool]:
+        """
+        Vérifie la cohérence d'un lot d'histoires avec JDM.
+
+        Les termes et relations distincts du lot sont d'abord collectés puis résolus
+        en parallèle ; les verdicts sont ensuite évalués histoire par histoire.
+        """
+        with metrics.timer("consistency_check_seconds", kind="stories"):
+            self._resolve_lookups(*self._collect_lookups(stories))
+            verdicts = [self._evaluate_story(story, force, ignore) for story in stories]
+        for consistent in verdicts:
+            metrics.inc("consistency_checks_total", kind="story", result="consistent" if consistent else "inconsistent")
+        return verdicts
 
     def check_story_consistency(self, story: Dict[str, Any], force: bool = False, ignore: bool = False) -> bool:
-        relation_checks = [
-            (["r_agent"], lambda f: (f["predicate"], f["subject"])),
-            (["r_patient", "r_instr"], lambda f: (f["predicate"], f["object"])),
-            (["r_action_lieu"], lambda f: (f["predicate"], f["location"])),
-            (["r_time"], lambda f: (f["predicate"], f["time"]))
-        ]
+        return self.check_stories_consistency([story], force = force, ignore = ignore)[0]
+
+    def check_substitution(self, story: Dict[str, Any], role: str, old: str, new: str, unaffected: bool = True) -> bool:
+        """
+        Cohérence de l'histoire où `old` est remplacé par `new` dans le rôle `role`, sans
+        copier l'histoire. Équivaut à check_story_consistency(..., ignore=True) sur l'histoire
+        modifiée, mais seuls le terme `new` et les relations (prédicat, `new`) sont revérifiés :
+        le verdict du reste de l'histoire est calculé une fois pour toutes les substitutions
+        de `old`.
+
+        Args:
+            story: Histoire d'origine
+            role: Rôle substitué ('subject', 'object', ...)
+            old: Terme remplacé
+            new: Terme de remplacement
+            unaffected: Vérifier aussi le reste de l'histoire ; si False, seuls `new` et ses
+                relations sont jugés (verdict qui ne dépend que du rôle, de `new` et des
+                prédicats reliés à `old`)
+        """
+        with metrics.timer("consistency_check_seconds", kind="substitution"):
+            consistent = self._check_substitution(story, role, old, new, unaffected)
+        metrics.inc("consistency_checks_total", kind="substitution", result="consistent" if consistent else "inconsistent")
+        return consistent
+
+    def check_unaffected(self, story: Dict[str, Any], role: str, old: str) -> bool:
+        """Cohérence du reste de l'histoire, hors `old` dans le rôle `role` (calculée une fois pour toutes les substitutions de `old`)"""
+        factoids = story.get("factoids", [])
+        base = self._substitution_base
+        if base is None or base[0] is not factoids or base[1] != role or base[2] != old:
+            base = (factoids, role, old, self._unaffected_consistency(factoids, role, old))
+            self._substitution_base = base
+        return base[3]
+
+    def _check_substitution(self, story: Dict[str, Any], role: str, old: str, new: str, unaffected: bool) -> bool:
+        if unaffected and not self.check_unaffected(story, role, old):
+            return False
+
+        factoids = story.get("factoids", [])
+        relations = []
+        for factoid in factoids:
+            if factoid.get(role) == old:
+                relations.extend((rel_group, factoid["predicate"], new) for rel_group, checked_role in self.RELATION_CHECKS
+                                 if checked_role == role and factoid["predicate"])
+        terms = [new] if new not in self._term_verdicts and not StoryDatabase.is_valid_term(new) else []
+        self._resolve_lookups(terms, [key for key in dict.fromkeys(relations) if key not in self._relation_verdicts])
+
+        if not self._term_found(new):
+            if self.jdm.logging:
+                print(f'Terme "{new}" introuvable dans JDM.')
+            return False
+        return all(self._relation_found(key) for key in relations)
+
+    def _unaffected_consistency(self, factoids: List[Dict[str, Any]], role: str, old: str) -> bool:
+        """Termes et relations de l'histoire qui ne dépendent pas de `old` dans le rôle `role`"""
+        # Le terme substitué et ses relations sont vérifiés par check_substitution
+        masked = [{**f, role: None} if f.get(role) == old else f for f in factoids]
+        terms, relations = self._collect_lookups([{"factoids": masked}])
+        self._resolve_lookups([term for term in terms if term is not None], relations)
+        for factoid in masked:
+            if not all(self._term_found(term) for term in self._story_terms(factoid) if term is not None):
+                return False
+            if not all(self._relation_found(key) for key in self._story_relations(factoid)):
+                return False
+        return True
+
+    def _evaluate_story(self, story: Dict[str, Any], force: bool = False, ignore: bool = False) -> bool:
+        """Phase 3 : évaluation des verdicts, dans l'ordre des factoïdes"""
+        defer = self.defer_reviews and not force and not ignore
+        deferred_terms = []
+        deferred_relations = []
 
         for factoid in story.get("factoids", []):
-            terms = [factoid['subject'], factoid['predicate']]
-            if factoid['object']:
-                terms.append(factoid['object'])
-            if factoid['location']:
-                terms.append(factoid['location'])
-            if factoid['time']:
-                terms.append(factoid['time'])
-
-            for term in terms:
-                if StoryDatabase.is_valid_term(term):
-                    continue
-                node = self.jdm.get_node_by_name(term)
-                if not node or 'id' not in node:
+            for term in self._story_terms(factoid):
+                if not self._term_found(term):
                     print(f'Terme "{term}" introuvable dans JDM.')
                     if force:
-                        StoryDatabase.add_valid_term(term)
+                        self._accept_term(term)
                     elif ignore:
                         return False
+                    elif defer:
+                        if term not in deferred_terms:
+                            deferred_terms.append(term)
                     else:
                         resp = input("Souhaitez-vous l’ajouter aux termes valides ? (o/n) ").strip().lower()
                         if resp == 'o':
-                            StoryDatabase.add_valid_term(term)
+                            self._accept_term(term)
                         else:
                             return False
 
-            for rel_group, extractor in relation_checks:
-                src, tgt = extractor(factoid)
-                if not src or not tgt:
-                    continue
-                found = False
-                for rel_key in rel_group:
-                    if StoryDatabase.is_valid_relation(rel_key, src, tgt) or self.jdm.has_relation(src, tgt, rel_key):
-                        found = True
-                        break
-                if not found:
+            for key in self._story_relations(factoid):
+                rel_group, src, tgt = key
+                if not self._relation_found(key):
                     #print(f"Aucune relation valide trouvée entre {src} et {tgt} dans {rel_group}")
                     if force:
-                        StoryDatabase.add_valid_relation(rel_group[0], src, tgt)
+                        self._accept_relation(rel_group[0], src, tgt)
                     elif ignore:
                         return False
+                    elif defer:
+                        if (rel_group[0], src, tgt) not in deferred_relations:
+                            deferred_relations.append((rel_group[0], src, tgt))
                     else:
                         resp = input("L’une de ces relations est-elle acceptable ? (o/n) ").strip().lower()
                         if resp == 'o':
-                            StoryDatabase.add_valid_relation(rel_group[0], src, tgt)
+                            self._accept_relation(rel_group[0], src, tgt)
                         else:
                             return False
 
+        if deferred_terms or deferred_relations:
+            self.pending_reviews.append((story, deferred_terms, deferred_relations))
+            return False
         return True
 
 if __name__ == "__main__":
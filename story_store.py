@@ -0,0 +1,287 @@
+"""
+Stockage groupé des histoires : un fichier segment en ajout seul et un index des positions.
+
+Chaque écriture d'une histoire ajoute sa version complète (une ligne JSON) à la fin du
+segment, et une ligne [identifiant, position, longueur, version] à la fin de l'index ;
+une suppression ajoute [identifiant]. Au chargement, seul l'index est relu (la dernière
+ligne de chaque histoire l'emporte) : lister les histoires ne lit pas le segment, et lire
+une histoire coûte un déplacement et une lecture.
+
+Les versions remplacées restent dans le segment jusqu'au compactage, qui recopie les
+seules versions à jour dans un nouveau segment. L'index commence par une ligne d'en-tête
+qui nomme son segment : il est remplacé atomiquement, si bien qu'un compactage interrompu
+laisse l'ancien couple index/segment intact.
+"""
+import json
+import os
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+from factoid import json_default
+
+VERSION = 1
+INDEX_FILE = "index.jsonl"
+
+class StoryStore:
+    def __init__(self, directory: str = "data/stories", compact_ratio: float = 1.0, compact_min_bytes: int = 4 * 1024 * 1024, lazy: bool = False):
+        """
+        Args:
+            directory: Répertoire du segment et de l'index
+            compact_ratio: Compactage automatique quand les versions remplacées dépassent cette part des octets à jour
+            compact_min_bytes: Taille minimale des versions remplacées avant un compactage automatique
+            lazy: Ne lit l'index qu'au premier accès (démarrage depuis un instantané)
+        """
+        self.directory = directory
+        self.index_file = os.path.join(directory, INDEX_FILE)
+        self.compact_ratio = compact_ratio
+        self.compact_min_bytes = compact_min_bytes
+        # identifiant -> (position, longueur, version), dans l'ordre d'ajout des histoires
+        self._index: Dict[str, Tuple[int, int, int]] = {}
+        self._segment = "stories-1.seg"
+        self._loaded = False
+        self.next_version = 1
+        self.live_bytes = 0
+        self.dead_bytes = 0
+        # Lignes d'index en attente : écrites après le segment (voir flush)
+        self._pending: List[str] = []
+        # Index à réécrire avant le prochain ajout (dernière ligne incomplète)
+        self._torn = False
+        self._writer = None
+        self._reader = None
+        # Lecteur partagé ; réentrant : compact le garde pendant tout l'échange des segments
+        self._read_lock = threading.RLock()
+        os.makedirs(directory, exist_ok=True)
+        if not lazy:
+            self._ensure_loaded()
+
+    @property
+    def index(self) -> Dict[str, Tuple[int, int, int]]:
+        self._ensure_loaded()
+        return self._index
+
+    @index.setter
+    def index(self, index: Dict[str, Tuple[int, int, int]]):
+        self._index = index
+
+    @property
+    def segment(self) -> str:
+        self._ensure_loaded()
+        return self._segment
+
+    @segment.setter
+    def segment(self, segment: str):
+        self._segment = segment
+
+    @property
+    def segment_file(self) -> str:
+        return os.path.join(self.directory, self.segment)
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            with self._read_lock:
+                if not self._loaded:
+                    self._load_index()
+                    self._loaded = True
+
+    def _load_index(self):
+        if not os.path.exists(self.index_file):
+            return
+        with open(self.index_file, "r", encoding="utf-8") as f:
+            header = json.loads(f.readline())
+            self._segment = header["segment"]
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # Dernière ligne incomplète : écriture interrompue, ou en cours dans un autre processus
+                    self._torn = True
+                    break
+                if len(entry) == 1:
+                    self._index.pop(entry[0], None)
+                else:
+                    self._index[entry[0]] = (entry[1], entry[2], entry[3])
+        # Attributs privés : appelée avant que l'index soit marqué chargé (voir _ensure_loaded)
+        segment_file = os.path.join(self.directory, self._segment)
+        segment_size = os.path.getsize(segment_file) if os.path.exists(segment_file) else 0
+        # Positions au-delà de la fin du segment : histoire jamais écrite entièrement
+        for story_id in [s for s, (offset, length, _) in self._index.items() if offset + length > segment_size]:
+            del self._index[story_id]
+            self._torn = True
+        self.next_version = max((version for _, _, version in self._index.values()), default=0) + 1
+        self.live_bytes = sum(length for _, length, _ in self._index.values())
+        self.dead_bytes = segment_size - self.live_bytes
+
+    def reload(self):
+        """Relit l'index écrit par un autre processus ; les ajouts suivants repartent de la fin du segment"""
+        self.close()
+        self._index = {}
+        self._segment = "stories-1.seg"
+        self._pending = []
+        self._torn = False
+        self._load_index()
+        self._loaded = True
+
+    def _write_index(self, segment: str):
+        """Réécrit l'index (en-tête et positions à jour) de façon atomique"""
+        tmp_file = self.index_file + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"version": VERSION, "segment": segment}) + "\n")
+            for story_id, (offset, length, version) in self.index.items():
+                f.write(json.dumps([story_id, offset, length, version], ensure_ascii=False) + "\n")
+        os.replace(tmp_file, self.index_file)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def story_ids(self) -> List[str]:
+        return list(self.index)
+
+    def has_story(self, story_id: str) -> bool:
+        return story_id in self.index
+
+    def story_count(self) -> int:
+        return len(self.index)
+
+    def version(self, story_id: str) -> Optional[int]:
+        """Numéro de la dernière écriture de l'histoire (inchangé par le compactage)"""
+        entry = self.index.get(story_id)
+        return entry[2] if entry is not None else None
+
+    def locate(self, story_id: str) -> Optional[Tuple[str, int, int]]:
+        """(segment, position, longueur) de la version à jour de l'histoire"""
+        entry = self.index.get(story_id)
+        if entry is None:
+            return None
+        if self._pending:
+            self.flush()
+        return self.segment_file, entry[0], entry[1]
+
+    def read_story(self, story_id: str) -> Dict[str, Any]:
+        if self._pending:
+            self.flush()
+        # Descripteur partagé par les threads du serveur de prédiction ; position lue sous le
+        # verrou pour qu'elle corresponde au segment ouvert (voir compact)
+        with self._read_lock:
+            try:
+                data = self._read(story_id)
+            except FileNotFoundError:
+                # Segment supprimé par le compactage d'un autre processus : son index désigne le nouveau
+                self.reload()
+                data = self._read(story_id)
+        return json.loads(data)
+
+    def _read(self, story_id: str) -> bytes:
+        entry = self.index.get(story_id)
+        if entry is None:
+            raise KeyError(story_id)
+        offset, length, _ = entry
+        if self._reader is None:
+            self._reader = open(self.segment_file, "rb")
+        self._reader.seek(offset)
+        return self._reader.read(length)
+
+    def write_story(self, story: Dict[str, Any]):
+        """Ajoute la nouvelle version d'une histoire (visible dans l'index après flush)"""
+        story_id = story["id"]
+        data = (json.dumps(story, ensure_ascii=False, default=json_default) + "\n").encode("utf-8")
+        if self._writer is None:
+            self._writer = open(self.segment_file, "ab")
+        offset = self._writer.tell()
+        self._writer.write(data)
+        previous = self.index.get(story_id)
+        if previous is not None:
+            self.dead_bytes += previous[1]
+            self.live_bytes -= previous[1]
+        self.index[story_id] = (offset, len(data), self.next_version)
+        self.live_bytes += len(data)
+        self._pending.append(json.dumps([story_id, offset, len(data), self.next_version], ensure_ascii=False))
+        self.next_version += 1
+
+    def delete_story(self, story_id: str):
+        previous = self.index.pop(story_id, None)
+        if previous is None:
+            return
+        self.dead_bytes += previous[1]
+        self.live_bytes -= previous[1]
+        self._pending.append(json.dumps([story_id], ensure_ascii=False))
+
+    def flush(self):
+        """Écrit le segment puis les lignes d'index en attente : l'index ne désigne jamais des octets absents"""
+        if self._writer is not None:
+            self._writer.flush()
+        if self._pending:
+            if self._torn or not os.path.exists(self.index_file):
+                self._write_index(self.segment)
+                self._torn = False
+            else:
+                with open(self.index_file, "a", encoding="utf-8") as f:
+                    f.write("\n".join(self._pending) + "\n")
+            self._pending = []
+        if self.dead_bytes >= self.compact_min_bytes and self.dead_bytes > self.compact_ratio * self.live_bytes:
+            self.compact()
+
+    def compact(self) -> int:
+        """Recopie les versions à jour dans un nouveau segment ; retourne le nombre d'octets récupérés"""
+        if self._pending:
+            self.flush()
+        # Les lecteurs attendent la fin de l'échange : index et segment changent ensemble
+        with self._read_lock:
+            self.close()
+            generation = int(self.segment.split("-")[1].split(".")[0]) + 1
+            segment = f"stories-{generation}.seg"
+            old_segment_file = self.segment_file
+            index = {}
+            with open(os.path.join(self.directory, segment), "wb") as out:
+                if os.path.exists(old_segment_file):
+                    with open(old_segment_file, "rb") as f:
+                        for story_id, (offset, length, version) in self.index.items():
+                            f.seek(offset)
+                            index[story_id] = (out.tell(), length, version)
+                            out.write(f.read(length))
+            reclaimed = self.dead_bytes
+            self.index = index
+            self._write_index(segment)
+            self.segment = segment
+            self.dead_bytes = 0
+            self._torn = False
+        try:
+            os.remove(old_segment_file)
+        except OSError:
+            # Absent, ou encore ouvert par un lecteur (Windows)
+            pass
+        return reclaimed
+
+    def migrate_legacy_files(self, exclude: Tuple[str, ...] = ()) -> int:
+        """
+        Range dans le segment les histoires de l'ancien format (un fichier JSON par histoire),
+        puis supprime ces fichiers. Retourne le nombre d'histoires migrées.
+
+        Args:
+            exclude: Noms de fichiers JSON du répertoire qui ne sont pas des histoires
+        """
+        filenames = [name for name in os.listdir(self.directory) if name.endswith(".json") and name not in exclude]
+        if not filenames:
+            return 0
+        for filename in filenames:
+            with open(os.path.join(self.directory, filename), "r", encoding="utf-8") as f:
+                story = json.load(f)
+            if story.get("id") not in self.index:
+                self.write_story(story)
+        self.flush()
+        for filename in filenames:
+            os.remove(os.path.join(self.directory, filename))
+        return len(filenames)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        with self._read_lock:
+            if self._reader is not None:
+                self._reader.close()
+                self._reader = None
+
+def read_record(segment_file: str, offset: int, length: int) -> Dict[str, Any]:
+    """Lit une histoire à partir de sa position (processus sans StoryStore ouvert)"""
+    with open(segment_file, "rb") as f:
+        f.seek(offset)
+        return json.loads(f.read(length))
@@ -1,16 +1,39 @@
 import os
 import json
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
 from story_database import StoryDatabase
 from factoid_extractor import FactoidExtractor
 from factoid_predict_1 import FactoidPredict1
 
 class StoryTest:
-    def __init__(self, test_file: str = "tests.txt"):
+    def __init__(self, test_file: str = "tests.txt", cache_file: Optional[str] = None):
         self.test_file = test_file
-        self.predictor = FactoidPredict1(include_generalized=True)
+        self.predictor = FactoidPredict1(include_generalized=True, cache_file=cache_file)
 
-    def run_all_tests(self):
+    def run_all_tests(self, workers: int = 1, output_file: Optional[str] = None):
+        """
+        Prédit toutes les histoires du fichier de test en un seul lot.
+
+        Args:
+            workers: Nombre de processus utilisés pour la prédiction
+            output_file: Fichier JSONL où écrire un résultat structuré par histoire
+        """
+        stories = self._load_stories()
+        results = self.predictor.predict_batch([lines for _, lines in stories], workers=workers)
+
+        for (title, story_lines), result in zip(stories, results):
+            self._print_prediction(title, story_lines, result["predictions"])
+
+        if output_file:
+            with open(output_file, "w", encoding="utf-8") as f:
+                for (title, story_lines), result in zip(stories, results):
+                    record = {"title": title, "lines": story_lines, **result}
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+        self.predictor.save_cache()
+
+    def _load_stories(self) -> List[Tuple[str, List[str]]]:
+        stories = []
         with open(self.test_file, 'r', encoding='utf-8') as f:
             story_counter = 0
             current_story = []
@@ -20,18 +43,23 @@ class StoryTest:
                 if not line:
                     continue
                 if '[' not in line and '?' not in line:
-                    self._run_and_print(f"Histoire {story_counter}", current_story)
+                    if current_story:
+                        stories.append((f"Histoire {story_counter}", current_story))
                     story_counter += 1
                     current_story = []
                 else:
                     current_story.append(line)
 
             if current_story:
-                self._run_and_print(f"Histoire {story_counter}", current_story)
+                stories.append((f"Histoire {story_counter}", current_story))
+        return stories
 
     def _run_and_print(self, title: str, story_lines: List[str]):
-        print(f"\n=== {title} ===")
         prediction = self.predictor.predict_missing(story_lines)
+        self._print_prediction(title, story_lines, prediction)
+
+    def _print_prediction(self, title: str, story_lines: List[str], prediction: List[str]):
+        print(f"\n=== {title} ===")
         id_prediction = 0
         for ligne in story_lines:
             if ligne == "?":
@@ -42,4 +70,4 @@ class StoryTest:
 
 if __name__ == "__main__":
     storyTest = StoryTest()
-    storyTest.run_all_tests()
\ No newline at end of file
+    storyTest.run_all_tests()
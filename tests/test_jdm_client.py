@@ -0,0 +1,43 @@
+import json
+import pytest
+
+RELATION_TYPES = [{"id": 6, "name": "r_isa"}]
+
+def _fixture(path) -> str:
+    entries = [
+        {"request": "/v0/relations_types", "status": 200, "seconds": 0.0, "body": RELATION_TYPES},
+        {"request": "/v0/relations/from/chat/to/animal?limit=50&min_weight=5&types_ids=6", "status": 200, "seconds": 0.0,
+         "body": {"nodes": [], "relations": [{"node1": 1, "node2": 2, "type": 6, "w": 50}]}},
+    ]
+    with open(path, "w", encoding="utf-8") as f:
+        for entry in entries:
+            f.write(json.dumps(entry) + "\n")
+    return str(path)
+
+def _client(monkeypatch, tmp_path, **server_options):
+    # Journal et cache du client dans le répertoire du test
+    monkeypatch.chdir(tmp_path)
+    from jdm_client import JDMClient
+    from jdm_replay import JDMReplayServer
+    server = JDMReplayServer(_fixture(tmp_path / "fixture.jsonl"), port=0, **server_options).start()
+    return server, JDMClient(base_url=server.url, use_cache=False, logging=False, max_retries=2, retry_delay=0.01)
+
+def test_rate_limited_request_is_retried(monkeypatch, tmp_path):
+    server, client = _client(monkeypatch, tmp_path, rate_limit=1.0)
+    try:
+        # Le jeton de la seconde a servi aux types de relations : 429 avec Retry-After, puis succès
+        assert client.has_relation("chat", "animal", "r_isa")
+        assert server.stats()["throttled"] >= 1
+    finally:
+        server.shutdown()
+
+def test_server_errors_are_not_a_missing_relation(monkeypatch, tmp_path):
+    server, client = _client(monkeypatch, tmp_path)
+    server.error_rate = 1.0
+    try:
+        from jdm_client import JDMUnavailableError
+        with pytest.raises(JDMUnavailableError):
+            client.has_relation("chat", "animal", "r_isa")
+        assert server.stats()["errors"] == 3
+    finally:
+        server.shutdown()
@@ -0,0 +1,52 @@
+from story_database import StoryDatabase
+
+def _story(story_id: str, subjects) -> dict:
+    return {"id": story_id, "domain": "test", "factoids": [
+        {"subject": subject, "predicate": "manger", "object": "pomme", "location": "", "time": ""} for subject in subjects
+    ]}
+
+def _open(workdir, monkeypatch):
+    monkeypatch.chdir(workdir)
+    StoryDatabase.initialize(use_snapshot=False)
+
+def test_fingerprint_follows_factoid_order(tmp_path, monkeypatch):
+    _open(tmp_path, monkeypatch)
+    StoryDatabase.add_stories([_story("h1", ["chat", "chien"]), _story("h2", ["oiseau"])])
+    original = StoryDatabase.fingerprint()
+    # Mêmes factoïdes, ordre inversé : les candidats de prédiction (factoïdes voisins) changent
+    StoryDatabase.add_stories([_story("h1", ["chien", "chat"])])
+    assert StoryDatabase.fingerprint() != original
+    StoryDatabase.add_stories([_story("h1", ["chat", "chien"])])
+    assert StoryDatabase.fingerprint() == original
+
+    # Base rouverte à l'identique : même empreinte
+    _open(tmp_path, monkeypatch)
+    assert StoryDatabase.fingerprint() == original
+
+def _factoid_state() -> dict:
+    return {group: [(StoryDatabase._factoid_key(f), list(f.get("stories_id", []))) for f in StoryDatabase.factoids[group]]
+            for group in ("generalized", "not_generalized")}
+
+def test_journal_replay_matches_clean_save(tmp_path, monkeypatch):
+    _open(tmp_path, monkeypatch)
+    StoryDatabase.add_stories([_story("h1", ["chat", "chien"]), _story("h2", ["chien", "oiseau"])])
+    StoryDatabase.save_factoids()
+    # Modifications notées dans le journal seulement (journal plus petit que factoids_file)
+    StoryDatabase.add_stories([_story("h3", ["oiseau", "lapin"]), _story("h1", ["lapin", "chat"])])
+    StoryDatabase.remove_story("h2")
+    StoryDatabase.add_stories([_story("h1", ["lapin", "chat"])])
+    expected = _factoid_state()
+    journal = tmp_path / StoryDatabase.factoids_journal_file
+    assert journal.exists()
+
+    # Dernière ligne du journal tronquée : écriture interrompue
+    content = journal.read_bytes()
+    journal.write_bytes(content[:-3])
+    _open(tmp_path, monkeypatch)
+    assert _factoid_state() == expected
+
+    # Journal intégré à factoids_file : même état une fois relu
+    StoryDatabase.save_factoids()
+    assert not journal.exists()
+    _open(tmp_path, monkeypatch)
+    assert _factoid_state() == expected
@@ -0,0 +1,75 @@
+import json
+import multiprocessing
+import os
+from story_database import StoryDatabase
+
+# Processus neufs : l'état de StoryDatabase (attributs de classe) n'est pas hérité
+_CONTEXT = multiprocessing.get_context("spawn")
+
+def _story(story_id: str, subject: str) -> dict:
+    return {"id": story_id, "domain": "test", "factoids": [
+        {"subject": subject, "predicate": "manger", "object": "pomme", "location": "", "time": ""},
+        {"subject": "serveur", "predicate": "servir", "object": subject, "location": "", "time": ""},
+    ]}
+
+def _writer(workdir: str, prefix: str, barrier, batches: int):
+    os.chdir(workdir)
+    StoryDatabase.initialize(use_snapshot=False)
+    barrier.wait()
+    for i in range(batches):
+        StoryDatabase.add_stories([_story(f"{prefix}{i}_{j}", f"{prefix}sujet{i}") for j in range(2)])
+        StoryDatabase.add_valid_terms([f"{prefix}terme{i}"])
+        StoryDatabase.add_valid_relations([("r_agent", f"{prefix}terme{i}", "manger")])
+    StoryDatabase.save_factoids()
+
+def _add_one(workdir: str, story_id: str):
+    os.chdir(workdir)
+    StoryDatabase.initialize(use_snapshot=False)
+    StoryDatabase.add_stories([_story(story_id, "oiseau")])
+
+def _run(target, *args):
+    process = _CONTEXT.Process(target=target, args=args)
+    process.start()
+    process.join(60)
+    assert process.exitcode == 0
+
+def _reload(workdir: str, monkeypatch):
+    monkeypatch.chdir(workdir)
+    StoryDatabase.initialize(use_snapshot=False)
+
+def test_concurrent_add_stories_are_merged(tmp_path, monkeypatch):
+    workdir = str(tmp_path)
+    batches = 10
+    barrier = _CONTEXT.Barrier(2)
+    processes = [_CONTEXT.Process(target=_writer, args=(workdir, prefix, barrier, batches)) for prefix in ("a", "b")]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(120)
+        assert process.exitcode == 0
+
+    _reload(workdir, monkeypatch)
+    expected = {f"{prefix}{i}_{j}" for prefix in ("a", "b") for i in range(batches) for j in range(2)}
+    assert set(StoryDatabase.list_stories()) == expected
+    assert set(StoryDatabase.content_hashes) == expected
+    serveur = [f for f in StoryDatabase.factoids["not_generalized"] if f["subject"] == "serveur" and f["predicate"] == "servir"]
+    assert {story_id for f in serveur for story_id in f["stories_id"]} == expected
+    assert set(StoryDatabase.valid_terms) >= {f"{prefix}terme{i}" for prefix in ("a", "b") for i in range(batches)}
+    relations = {(rel["node1"], rel["node2"]) for rel in StoryDatabase.valid_relations["r_agent"]}
+    assert relations == {(f"{prefix}terme{i}", "manger") for prefix in ("a", "b") for i in range(batches)}
+
+def test_torn_index_repaired_by_next_locked_flush(tmp_path, monkeypatch):
+    workdir = str(tmp_path)
+    _run(_add_one, workdir, "h1")
+    # Processus arrêté au milieu d'une ligne d'index
+    index_file = os.path.join(workdir, "data", "stories", "index.jsonl")
+    with open(index_file, "a", encoding="utf-8") as f:
+        f.write('["h2", 40')
+    _run(_add_one, workdir, "h3")
+
+    with open(index_file, "r", encoding="utf-8") as f:
+        for line in f:
+            json.loads(line)
+    _reload(workdir, monkeypatch)
+    assert sorted(StoryDatabase.list_stories()) == ["h1", "h3"]
+    assert StoryDatabase.get_story("h3")["factoids"][0]["subject"] == "oiseau"
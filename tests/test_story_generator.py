@@ -0,0 +1,54 @@
+import pytest
+
+# Verdicts JDM simulés : termes connus et relations (type, source, cible) existantes
+TERMS = {"chat", "chien", "lion", "manger", "souris", "fromage", "pierre", "jardin", "dormir", "panier"}
+RELATIONS = {
+    ("r_agent", "manger", "chat"), ("r_agent", "manger", "chien"), ("r_agent", "dormir", "chat"), ("r_agent", "dormir", "chien"),
+    ("r_agent", "dormir", "lion"), ("r_patient", "manger", "souris"), ("r_instr", "manger", "fromage"),
+    ("r_action_lieu", "manger", "jardin"), ("r_action_lieu", "dormir", "panier"),
+}
+
+class StubJDM:
+    logging = False
+
+    def get_node_by_name(self, term):
+        return {"id": 1, "name": term} if term in TERMS else None
+
+    def has_relation(self, src, tgt, rel_key):
+        return (rel_key, src, tgt) in RELATIONS
+
+def _factoid(subject, predicate, obj="", location="") -> dict:
+    return {"subject": subject, "predicate": predicate, "object": obj, "location": location, "time": ""}
+
+STORIES = [
+    {"id": "h1", "domain": "test", "factoids": [_factoid("chat", "manger", "souris", "jardin"), _factoid("chat", "dormir", "", "panier")]},
+    # Lieu sans relation : le reste de l'histoire est incohérent quelle que soit la substitution
+    {"id": "h2", "domain": "test", "factoids": [_factoid("chat", "manger", "souris", "panier")]},
+]
+
+def _generator(tmp_path, monkeypatch):
+    # Journal JDM et base de test dans le répertoire du test
+    monkeypatch.chdir(tmp_path)
+    import story_generator
+    monkeypatch.setattr(story_generator, "JDMClient", StubJDM)
+    return story_generator.StoryGenerator(output_dir=str(tmp_path / "stories"), max_workers=2)
+
+def _substitute(story: dict, role: str, old: str, new: str) -> dict:
+    return {**story, "factoids": [{**f, role: new} if f[role] == old else dict(f) for f in story["factoids"]]}
+
+@pytest.mark.parametrize("role, old, candidates", [
+    ("subject", "chat", ["chien", "lion", "souris", "inconnu"]),
+    ("object", "souris", ["fromage", "pierre", "chat", "inconnu"]),
+])
+def test_substitution_matches_full_check(tmp_path, monkeypatch, role, old, candidates):
+    generator = _generator(tmp_path, monkeypatch)
+    verdicts = []
+    for story in STORIES:
+        for new in candidates:
+            # Vérification complète par un générateur sans verdicts en mémoire
+            reference = _generator(tmp_path, monkeypatch)
+            expected = reference.check_story_consistency(_substitute(story, role, old, new), ignore=True)
+            verdicts.append(expected)
+            assert generator.check_substitution(story, role, old, new) == expected, (story["id"], new)
+            assert (generator.check_unaffected(story, role, old) and generator.check_substitution(story, role, old, new, unaffected=False)) == expected
+    assert True in verdicts and False in verdicts
@@ -0,0 +1,114 @@
+import json
+import os
+import sys
+import threading
+from story_store import StoryStore
+
+def _story(story_id: str, text: str) -> dict:
+    return {"id": story_id, "domain": "test", "factoids": [{"subject": text, "predicate": "manger", "object": "pomme"}]}
+
+def test_write_rewrite_compact_reopen(tmp_path):
+    store = StoryStore(str(tmp_path))
+    for i in range(5):
+        store.write_story(_story(f"h{i}", "chat"))
+    store.flush()
+    store.write_story(_story("h1", "chien"))
+    store.delete_story("h3")
+    store.flush()
+    versions = {story_id: store.version(story_id) for story_id in store.story_ids()}
+    old_segment = store.segment_file
+
+    assert store.compact() > 0
+    assert store.dead_bytes == 0
+    assert not os.path.exists(old_segment)
+    assert store.read_story("h1")["factoids"][0]["subject"] == "chien"
+    store.close()
+
+    reopened = StoryStore(str(tmp_path))
+    assert sorted(reopened.story_ids()) == ["h0", "h1", "h2", "h4"]
+    assert {story_id: reopened.version(story_id) for story_id in reopened.story_ids()} == versions
+    assert reopened.read_story("h1")["factoids"][0]["subject"] == "chien"
+    assert reopened.read_story("h4")["factoids"][0]["subject"] == "chat"
+    assert reopened.dead_bytes == 0
+    reopened.close()
+
+def test_torn_index_line_is_repaired(tmp_path):
+    store = StoryStore(str(tmp_path))
+    store.write_story(_story("h0", "chat"))
+    store.write_story(_story("h1", "chien"))
+    store.flush()
+    store.close()
+    # Écriture interrompue au milieu de la dernière ligne de l'index
+    with open(os.path.join(str(tmp_path), "index.jsonl"), "a", encoding="utf-8") as f:
+        f.write('["h2", 12')
+
+    torn = StoryStore(str(tmp_path))
+    assert sorted(torn.story_ids()) == ["h0", "h1"]
+    torn.write_story(_story("h2", "oiseau"))
+    torn.flush()
+    torn.close()
+
+    with open(os.path.join(str(tmp_path), "index.jsonl"), "r", encoding="utf-8") as f:
+        lines = f.read().splitlines()
+    for line in lines:
+        json.loads(line)
+    repaired = StoryStore(str(tmp_path))
+    assert sorted(repaired.story_ids()) == ["h0", "h1", "h2"]
+    assert repaired.read_story("h2")["factoids"][0]["subject"] == "oiseau"
+    repaired.compact()
+    repaired.close()
+    assert StoryStore(str(tmp_path)).read_story("h0")["factoids"][0]["subject"] == "chat"
+
+def test_reads_during_compaction(tmp_path):
+    store = StoryStore(str(tmp_path))
+    for i in range(50):
+        store.write_story(_story(f"h{i}", f"terme{i}"))
+    store.flush()
+    errors = []
+    stop = threading.Event()
+
+    def read():
+        while not stop.is_set():
+            for i in range(50):
+                try:
+                    if store.read_story(f"h{i}")["factoids"][0]["subject"] != f"terme{i}":
+                        errors.append(i)
+                except Exception as e:
+                    errors.append(repr(e))
+
+    readers = [threading.Thread(target=read) for _ in range(4)]
+    # Changements de thread fréquents : les lectures tombent au milieu des compactages
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        for reader in readers:
+            reader.start()
+        for n in range(20):
+            # Nouvelle version plus longue de la première histoire : les positions des autres changent au compactage
+            store.write_story({**_story("h0", "terme0"), "domain": "test" * (n + 2)})
+            store.flush()
+            store.compact()
+    finally:
+        stop.set()
+        for reader in readers:
+            reader.join()
+        sys.setswitchinterval(interval)
+    store.close()
+    assert errors == []
+
+def test_read_after_compaction_in_another_process(tmp_path):
+    writer = StoryStore(str(tmp_path))
+    for i in range(3):
+        writer.write_story(_story(f"h{i}", f"terme{i}"))
+    writer.flush()
+    writer.write_story(_story("h0", "chat"))
+    writer.flush()
+    # Index relu avant le compactage, segment pas encore ouvert
+    reader = StoryStore(str(tmp_path))
+    writer.compact()
+
+    assert reader.read_story("h1")["factoids"][0]["subject"] == "terme1"
+    assert reader.read_story("h0")["factoids"][0]["subject"] == "chat"
+    assert reader.segment == writer.segment
+    reader.close()
+    writer.close()